@@ -818,6 +818,12 @@ public:
 	 * char buffer.
 	 */
 	void writeCigar(BTString* o, char* oc) const;
+
+	/**
+	 * Return the CIGAR operations and run lengths built by buildCigar().
+	 */
+	const EList<char>& cigarOps() const { return cigOp_; }
+	const EList<size_t>& cigarRuns() const { return cigRun_; }
 	
 	/**
 	 * Write an MD:Z representation of the alignment to the given string and/or
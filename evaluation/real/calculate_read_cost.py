@@ -9,6 +9,9 @@ from datetime import datetime, date, time
 from collections import defaultdict
 from argparse import ArgumentParser, FileType
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), "../.."))
+import hisat2_genome
+
 osx_mode = False
 if sys.platform == 'darwin':
     osx_mode = True
@@ -67,24 +70,7 @@ def reverse_complement(seq):
 """
 """
 def read_genome(genome_filename):
-    chr_dic = {}
-    genome_file = open(genome_filename, "r")
-
-    chr_name, sequence = "", ""
-    for line in genome_file:
-        if line[0] == ">":
-            if chr_name and sequence:
-                chr_dic[chr_name] = sequence
-
-            chr_name = line[1:-1].split()[0]
-            sequence = ""
-        else:
-            sequence += line[:-1]
-
-    if chr_name and sequence:
-        chr_dic[chr_name] = sequence
-
-    genome_file.close()
+    chr_dic = hisat2_genome.read_genome(genome_filename)
 
     print >> sys.stderr, "genome is loaded"
     
@@ -10,6 +10,9 @@ from argparse import ArgumentParser, FileType
 from multiprocessing import Process
 import bisect
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), "../.."))
+import hisat2_genome
+
 mp_mode = False
 mp_num = 1
 
@@ -265,24 +268,7 @@ def repeat_to_genome_pos(repeat_db, repeat_map, rptRefName, pos, cigar_str = '')
 """
 """
 def read_genome(genome_filename):
-    chr_dic = {}
-    genome_file = open(genome_filename, "r")
-
-    chr_name, sequence = "", ""
-    for line in genome_file:
-        if line[0] == ">":
-            if chr_name and sequence:
-                chr_dic[chr_name] = sequence
-
-            chr_name = line[1:-1].split()[0]
-            sequence = ""
-        else:
-            sequence += line[:-1]
-
-    if chr_name and sequence:
-        chr_dic[chr_name] = sequence
-
-    genome_file.close()
+    chr_dic = hisat2_genome.read_genome(genome_filename)
 
     print >> sys.stderr, "genome is loaded"
     
@@ -6352,10 +6352,10 @@ void GFM<index_t>::readIntoMemory(
                     throw 1;
                 }
             } else {
-                index_t *tmp = NULL;
-                shmemLeader = ALLOC_SHARED_U32(
-                                               (_in2Str + "[offs]"), offsLenSampled*sizeof(index_t), &tmp,
-                                               "offs", (_verbose || startVerbose));
+                uint8_t *tmp = NULL;
+                shmemLeader = ALLOC_SHARED_U8(
+                                              (_in2Str + "[offs]"), offsLenSampled*sizeof(index_t), &tmp,
+                                              "offs", (_verbose || startVerbose));
                 _offs.init((index_t*)tmp, offsLenSampled, false);
             }
         }
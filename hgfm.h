@@ -1312,13 +1312,13 @@ void LocalGFM<index_t, full_index_t>::readIntoMemory(
 				}
 			}
 #ifdef BOWTIE_SHARED_MEM
-			if(useShmem_) NOTIFY_SHARED(this->gfm(), this->_gh._gbwtTotLen);
+			if(this->useShmem_) NOTIFY_SHARED(this->gfm(), this->_gh._gbwtTotLen);
 #endif
 		} else {
 			// Seek past the data and wait until master is finished
 			fseek(in5, this->_gh._gbwtTotLen, SEEK_CUR);
 #ifdef BOWTIE_SHARED_MEM
-			if(useShmem_) WAIT_SHARED(this->gfm(), this->_gh._gbwtTotLen);
+			if(this->useShmem_) WAIT_SHARED(this->gfm(), this->_gh._gbwtTotLen);
 #endif
 		}
 	}
@@ -1455,10 +1455,10 @@ void LocalGFM<index_t, full_index_t>::readIntoMemory(
 					throw 1;
 				}
 			} else {
-				index_t *tmp = NULL;
-				shmemLeader = ALLOC_SHARED_U32(
-											   (this->_in2Str + "[offs]"), offsLenSampled*2, &tmp,
-											   "offs", (this->_verbose || startVerbose));
+				uint8_t *tmp = NULL;
+				shmemLeader = ALLOC_SHARED_U8(
+											  (this->_in2Str + "[offs]"), offsLenSampled*sizeof(index_t), &tmp,
+											  "offs", (this->_verbose || startVerbose));
 				this->_offs.init((index_t*)tmp, offsLenSampled, false);
 			}
 		}
@@ -2472,6 +2472,13 @@ void HGFM<index_t, local_index_t>::readIntoMemory(
                                  startVerbose);
     
     bool switchEndian; // dummy; caller doesn't care
+	// Local indexes are too many to get a shared-memory segment each, so
+	// they are memory-mapped instead when the index lives in shared memory
+#ifdef BOWTIE_MM
+	const bool localMm = this->_useMm || this->useShmem_;
+#else
+	const bool localMm = false;
+#endif
 #ifdef BOWTIE_MM
 	char *mmFile[] = { NULL, NULL };
 #endif
@@ -2499,7 +2506,7 @@ void HGFM<index_t, local_index_t>::readIntoMemory(
 		}
 		
 #ifdef BOWTIE_MM
-		if(this->_useMm /*&& !justHeader*/) {
+		if(localMm /*&& !justHeader*/) {
 			const char *names[] = {_in5Str.c_str(), _in6Str.c_str()};
             int fds[] = { fileno(_in5), fileno(_in6) };
 			for(int i = 0; i < (loadSASamp ? 2 : 1); i++) {
@@ -2537,11 +2544,11 @@ void HGFM<index_t, local_index_t>::readIntoMemory(
 #endif
 	}
 #ifdef BOWTIE_MM
-	else if(this->_useMm && !justHeader) {
+	else if(localMm && !justHeader) {
 		mmFile[0] = mmFile5_;
 		mmFile[1] = mmFile6_;
 	}
-	if(this->_useMm && !justHeader) {
+	if(localMm && !justHeader) {
 		assert(mmFile[0] == mmFile5_);
 		assert(mmFile[1] == mmFile6_);
 	}
@@ -2621,8 +2628,8 @@ void HGFM<index_t, local_index_t>::readIntoMemory(
                                                                                           (uint32_t)lineRate,
                                                                                           (uint32_t)offRate,
                                                                                           (uint32_t)ftabChars,
-                                                                                          this->_useMm,
-                                                                                          this->useShmem_,
+                                                                                          localMm,
+                                                                                          false, // local indexes never use shared memory
                                                                                           mmSweep,
                                                                                           loadNames,
                                                                                           loadSASamp,
@@ -0,0 +1,521 @@
+#!/usr/bin/env python3
+
+#
+# Copyright 2015, Daehwan Kim <infphilo@gmail.com>
+#
+# This file is part of HISAT 2.
+#
+# HISAT 2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# HISAT 2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with HISAT 2.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+# In-process reader for plain, gzipped and bgzipped (VCF) text files, used
+# instead of piping "gzip -cd" into the extract scripts.
+#
+# BGZF files (bgzip, as produced for tabix) are a series of independent
+# gzip blocks of at most 64 KB, so blocks can be inflated on several
+# threads (zlib releases the GIL), and with a .tbi index next to the file
+# only the blocks overlapping the requested regions are read at all.
+#
+# OutputFile is the other direction: text output written as plain, gzip or
+# BGZF, compressed on a background thread while the caller keeps producing.
+
+import os, sys, gzip, struct, zlib, queue, threading
+from multiprocessing.pool import ThreadPool
+
+
+BGZF_MAGIC = b"\x1f\x8b\x08\x04"
+
+# Empty block marking the end of a BGZF file
+BGZF_EOF = bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000")
+
+# Uncompressed bytes per block, leaving room for incompressible data in 64 KB
+BGZF_BLOCK_SIZE = 0xff00
+
+COMPRESS_TYPES = ("gzip", "bgzf")
+
+# tabix format flags
+TBX_GENERIC, TBX_SAM, TBX_VCF = 0, 1, 2
+TBX_UCSC = 0x10000
+
+
+"""
+"""
+def is_bgzf(fname):
+    with open(fname, "rb") as fp:
+        header = fp.read(18)
+    return len(header) == 18 and header[:4] == BGZF_MAGIC and header[12:14] == b"BC"
+
+
+"""
+Parse regions such as "22", "22:1000" and "22:1000-2000" (1-based, inclusive)
+into [chr, begin, end] with 0-based, half-open coordinates
+"""
+def parse_regions(regions_str):
+    regions = []
+    for region in regions_str.split(','):
+        region = region.strip()
+        if not region:
+            continue
+        chr, beg, end = region, 0, 1 << 62
+        if ':' in region:
+            chr, coords = region.rsplit(':', 1)
+            try:
+                if '-' in coords:
+                    beg, end = coords.split('-')
+                    beg = int(beg) - 1
+                    if end:
+                        end = int(end)
+                    else:
+                        end = 1 << 62
+                else:
+                    beg = int(coords) - 1
+            except ValueError:
+                raise ValueError("invalid region: %s" % region)
+            if beg < 0 or beg >= end:
+                raise ValueError("invalid region: %s" % region)
+        regions.append([chr, beg, end])
+    return regions
+
+
+"""
+Sort regions by chromosome (in first-seen or given order) and position,
+merging overlapping ones
+"""
+def merge_regions(regions, chr_order=None):
+    if chr_order is None:
+        chr_order = {}
+        for chr, _, _ in regions:
+            if chr not in chr_order:
+                chr_order[chr] = len(chr_order)
+    merged = []
+    for chr, beg, end in sorted(regions, key=lambda r: (chr_order.get(r[0], len(chr_order)), r[1], r[2])):
+        if merged and merged[-1][0] == chr and beg <= merged[-1][2]:
+            merged[-1][2] = max(merged[-1][2], end)
+        else:
+            merged.append([chr, beg, end])
+    return merged
+
+
+"""
+Sequential reader of BGZF blocks, inflating batches of blocks on a thread pool
+"""
+class BGZFReader:
+    def __init__(self, fname, threads=1):
+        self.fp = open(fname, "rb")
+        self.threads = max(1, threads)
+        self.pool = None
+        if self.threads > 1:
+            self.pool = ThreadPool(self.threads)
+
+    def close(self):
+        self.fp.close()
+        if self.pool:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    """
+    Return (compressed offset, raw deflate data, uncompressed size) of the next block,
+    or None at the end of the file
+    """
+    def read_raw_block(self):
+        coffset = self.fp.tell()
+        header = self.fp.read(12)
+        if len(header) < 12:
+            return None
+        if header[:4] != BGZF_MAGIC:
+            raise ValueError("%s is not a BGZF file (bad block at offset %d)" % (self.fp.name, coffset))
+        xlen = struct.unpack("<H", header[10:12])[0]
+        extra = self.fp.read(xlen)
+        bsize, i = None, 0
+        while i + 4 <= xlen:
+            si1, si2, slen = extra[i], extra[i+1], struct.unpack("<H", extra[i+2:i+4])[0]
+            if si1 == 66 and si2 == 67 and slen == 2:
+                bsize = struct.unpack("<H", extra[i+4:i+6])[0]
+            i += 4 + slen
+        if bsize is None:
+            raise ValueError("%s is not a BGZF file (no block size at offset %d)" % (self.fp.name, coffset))
+        cdata = self.fp.read(bsize - xlen - 19)
+        crc, isize = struct.unpack("<II", self.fp.read(8))
+        return coffset, cdata, isize
+
+    """
+    Yield (compressed offset, uncompressed data) of the blocks from coffset on,
+    stopping after the block at end_coffset if given
+    """
+    def blocks(self, coffset=0, end_coffset=None):
+        self.fp.seek(coffset)
+        batch_size = self.threads * 8
+        done = False
+        while not done:
+            batch = []
+            while len(batch) < batch_size:
+                block = self.read_raw_block()
+                if block is None:
+                    done = True
+                    break
+                batch.append(block)
+                if end_coffset is not None and block[0] >= end_coffset:
+                    done = True
+                    break
+            if not batch:
+                break
+            if self.pool and len(batch) > 1:
+                datas = self.pool.map(inflate_block, batch)
+            else:
+                datas = [inflate_block(block) for block in batch]
+            for block, data in zip(batch, datas):
+                yield block[0], data
+
+    """
+    Yield the lines (bytes, with newlines) between two virtual offsets
+    """
+    def lines(self, vbeg=0, vend=None):
+        beg_coffset, beg_uoffset = vbeg >> 16, vbeg & 0xffff
+        end_coffset, end_uoffset = None, None
+        if vend is not None:
+            end_coffset, end_uoffset = vend >> 16, vend & 0xffff
+
+        rest = b""
+        for coffset, data in self.blocks(beg_coffset, end_coffset):
+            if coffset == end_coffset:
+                data = data[:end_uoffset]
+            if coffset == beg_coffset:
+                data = data[beg_uoffset:]
+            if b"\n" not in data:
+                rest += data
+                continue
+            lines = (rest + data).split(b"\n")
+            rest = lines.pop()
+            for line in lines:
+                yield line + b"\n"
+        if rest:
+            yield rest
+
+
+"""
+"""
+def inflate_block(block):
+    coffset, cdata, isize = block
+    data = zlib.decompress(cdata, -15)
+    if len(data) != isize:
+        raise ValueError("corrupted BGZF block at offset %d" % coffset)
+    return data
+
+
+"""
+tabix (.tbi) index
+"""
+class TabixIndex:
+    def __init__(self, tbi_fname):
+        with gzip.open(tbi_fname, "rb") as fp:
+            data = fp.read()
+        if data[:4] != b"TBI\x01":
+            raise ValueError("%s is not a tabix index" % tbi_fname)
+        n_ref, self.format, self.col_seq, self.col_beg, self.col_end, \
+            meta, self.skip, l_nm = struct.unpack("<8i", data[4:36])
+        self.meta = chr(meta)
+        p = 36
+        self.names = [name.decode() for name in data[p:p+l_nm].split(b"\x00")[:n_ref]]
+        p += l_nm
+
+        self.bins, self.linear = [], []
+        for r in range(n_ref):
+            bins = {}
+            n_bin = struct.unpack("<i", data[p:p+4])[0]
+            p += 4
+            for b in range(n_bin):
+                bin, n_chunk = struct.unpack("<Ii", data[p:p+8])
+                p += 8
+                chunks = struct.unpack("<%dQ" % (n_chunk * 2), data[p:p+16*n_chunk])
+                p += 16 * n_chunk
+                bins[bin] = [(chunks[i], chunks[i+1]) for i in range(0, len(chunks), 2)]
+            n_intv = struct.unpack("<i", data[p:p+4])[0]
+            p += 4
+            self.linear.append(struct.unpack("<%dQ" % n_intv, data[p:p+8*n_intv]))
+            p += 8 * n_intv
+            self.bins.append(bins)
+        self.tid = dict((name, i) for i, name in enumerate(self.names))
+
+    """
+    Merged list of (begin, end) virtual offsets that may hold records overlapping chr:beg-end
+    """
+    def chunks(self, chr, beg, end):
+        tid = self.tid.get(chr)
+        if tid is None:
+            return []
+        bins, linear = self.bins[tid], self.linear[tid]
+        min_off = 0
+        if linear:
+            min_off = linear[min(beg >> 14, len(linear) - 1)]
+
+        chunks = []
+        for bin in reg2bins(beg, end):
+            for cbeg, cend in bins.get(bin, []):
+                if cend > min_off:
+                    chunks.append((max(cbeg, min_off), cend))
+        chunks.sort()
+
+        merged = []
+        for cbeg, cend in chunks:
+            if merged and cbeg <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], cend)
+            else:
+                merged.append([cbeg, cend])
+        return merged
+
+    """
+    0-based, half-open interval of a record split into fields
+    """
+    def interval(self, fields):
+        beg = int(fields[self.col_beg - 1])
+        if not (self.format & TBX_UCSC):
+            beg -= 1
+        if self.format & 0xffff == TBX_VCF:
+            end = beg + len(fields[3])
+        elif self.col_end > 0:
+            end = int(fields[self.col_end - 1])
+        else:
+            end = beg + 1
+        return beg, end
+
+
+"""
+Bins (UCSC binning scheme) that overlap [beg, end)
+"""
+def reg2bins(beg, end):
+    end -= 1
+    end = min(end, (1 << 29) - 1)
+    bins = [0]
+    for shift, offset in [(26, 1), (23, 9), (20, 73), (17, 585), (14, 4681)]:
+        bins.extend(range(offset + (beg >> shift), offset + (end >> shift) + 1))
+    return bins
+
+
+"""
+"""
+def vcf_interval(fields):
+    beg = int(fields[1]) - 1
+    return beg, beg + len(fields[3])
+
+
+"""
+Yield records from lines that overlap one of the (merged) regions, skipping
+those already yielded for an earlier region on the same chromosome
+"""
+def filter_regions(lines, regions, interval=vcf_interval, meta='#'):
+    chr_regions = {}
+    for chr, beg, end in regions:
+        chr_regions.setdefault(chr, []).append((beg, end))
+    for line in lines:
+        if line.startswith(meta):
+            yield line
+            continue
+        fields = line.split('\t', 8)
+        if fields[0] not in chr_regions:
+            continue
+        beg, end = interval(fields)
+        for rbeg, rend in chr_regions[fields[0]]:
+            if beg < rend and end > rbeg:
+                yield line
+                break
+
+
+"""
+Lines of a VCF file (str, with newlines) restricted to the given regions,
+with header lines first.  Plain, gzipped and bgzipped files are accepted;
+the .tbi index of a bgzipped file is used for regions if there is one.
+"""
+def open_lines(fname, regions=None, threads=1):
+    if fname.endswith(".gz") and is_bgzf(fname):
+        reader = BGZFReader(fname, threads)
+        tbi_fname = fname + ".tbi"
+        if regions and os.path.exists(tbi_fname):
+            return tabix_lines(reader, TabixIndex(tbi_fname), regions)
+        lines = decode_lines(reader.lines(), reader)
+    elif fname.endswith(".gz"):
+        lines = gzip.open(fname, "rt")
+    else:
+        lines = open(fname)
+    if regions:
+        return filter_regions(lines, merge_regions(regions))
+    return lines
+
+
+"""
+"""
+def decode_lines(lines, reader=None):
+    for line in lines:
+        yield line.decode()
+    if reader:
+        reader.close()
+
+
+"""
+"""
+def tabix_lines(reader, index, regions):
+    for line in reader.lines():
+        line = line.decode()
+        if not line.startswith(index.meta):
+            break
+        yield line
+
+    regions = merge_regions(regions, index.tid)
+    prev_chr, prev_end = None, -1
+    for chr, beg, end in regions:
+        if chr not in index.tid:
+            print("Warning: %s is not in the index of %s" % (chr, reader.fp.name), file=sys.stderr)
+            continue
+        for vbeg, vend in index.chunks(chr, beg, end):
+            for line in reader.lines(vbeg, vend):
+                line = line.decode()
+                if line.startswith(index.meta):
+                    continue
+                fields = line.split('\t', 8)
+                if fields[0] != chr:
+                    continue
+                rec_beg, rec_end = index.interval(fields)
+                if rec_beg >= end:
+                    break
+                if rec_end <= beg:
+                    continue
+                # Already written for the previous region
+                if chr == prev_chr and rec_beg < prev_end:
+                    continue
+                yield line
+        prev_chr, prev_end = chr, end
+    reader.close()
+
+
+"""
+Write data as BGZF blocks to a binary file object (without the EOF block)
+"""
+class BGZFWriter:
+    def __init__(self, fp, level=6):
+        self.fp = fp
+        self.level = level
+        self.buf = bytearray()
+
+    def write(self, data):
+        self.buf += data
+        if len(self.buf) >= BGZF_BLOCK_SIZE:
+            nblocks = len(self.buf) // BGZF_BLOCK_SIZE
+            for i in range(nblocks):
+                self.write_block(self.buf[i * BGZF_BLOCK_SIZE:(i + 1) * BGZF_BLOCK_SIZE])
+            del self.buf[:nblocks * BGZF_BLOCK_SIZE]
+
+    def write_block(self, data):
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, -15)
+        cdata = compressor.compress(data) + compressor.flush()
+        # BSIZE is the total block size minus 1: 18 bytes of header, 8 of trailer
+        self.fp.write(BGZF_MAGIC + b"\x00\x00\x00\x00\x00\xff\x06\x00BC\x02\x00" +
+                      struct.pack("<H", len(cdata) + 25) + cdata +
+                      struct.pack("<II", zlib.crc32(data), len(data)))
+
+    def flush(self):
+        if self.buf:
+            self.write_block(self.buf)
+            self.buf = bytearray()
+
+    def close(self):
+        self.flush()
+
+
+"""
+Text output file, written plain or compressed (gzip or bgzf) on a background thread.
+
+Files written with eof=False can be put into another OutputFile of the same
+compression type with append_file(), which copies them without recompressing:
+gzip allows several members in one file, and BGZF blocks can be concatenated
+as long as only the last file has the EOF block.
+"""
+class OutputFile:
+    def __init__(self, fname, compress=None, level=6, eof=True):
+        assert compress in (None,) + COMPRESS_TYPES
+        self.fp = open(fname, "wb")
+        self.compress = compress
+        self.level = level
+        self.eof = eof
+        self.stream = self.new_stream()
+        self.pending, self.pending_size = [], 0
+        self.error = None
+        # Bounded, so a slow disk or compressor holds back the producer
+        self.queue = queue.Queue(8)
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def new_stream(self):
+        if self.compress == "gzip":
+            return gzip.GzipFile(fileobj=self.fp, mode="wb", compresslevel=self.level, mtime=0)
+        elif self.compress == "bgzf":
+            return BGZFWriter(self.fp, self.level)
+        return self.fp
+
+    def write(self, text):
+        self.pending.append(text)
+        self.pending_size += len(text)
+        if self.pending_size >= (1 << 20):
+            self.flush_pending()
+
+    def flush_pending(self):
+        if self.error:
+            raise self.error
+        if self.pending:
+            self.queue.put(("data", "".join(self.pending).encode()))
+            self.pending, self.pending_size = [], 0
+
+    """
+    Append the contents of fname (of the same compression type) and remove it
+    """
+    def append_file(self, fname):
+        self.flush_pending()
+        self.queue.put(("file", fname))
+
+    def run(self):
+        while True:
+            kind, item = self.queue.get()
+            if kind == "close":
+                break
+            if self.error:
+                continue
+            try:
+                if kind == "data":
+                    self.stream.write(item)
+                else:
+                    # End the current gzip member or BGZF block before copying
+                    if self.stream is not self.fp:
+                        self.stream.close()
+                    with open(item, "rb") as in_file:
+                        while True:
+                            data = in_file.read(1 << 22)
+                            if not data:
+                                break
+                            self.fp.write(data)
+                    os.remove(item)
+                    self.stream = self.new_stream()
+            except Exception as e:
+                self.error = e
+
+    def close(self):
+        self.flush_pending()
+        self.queue.put(("close", None))
+        self.thread.join()
+        if self.error:
+            raise self.error
+        if self.stream is not self.fp:
+            self.stream.close()
+        if self.compress == "bgzf" and self.eof:
+            self.fp.write(BGZF_EOF)
+        self.fp.close()
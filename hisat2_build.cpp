@@ -35,6 +35,7 @@
 #include "gfm.h"
 #include "hgfm.h"
 #include "rfm.h"
+#include "index_summary.h"
 
 /**
  * \file Driver for the bowtie-build indexing tool.
@@ -45,6 +46,7 @@
 #include <fstream>
 #include <iostream>
 #include <vector>
+#include <sstream>
 
 MemoryTally gMemTally;
 // Build parameters
@@ -659,6 +661,94 @@ static void driver(
     delete gfm;
 }
 
+/**
+ * Print 's' as a JSON string.  Bytes outside printable ASCII are
+ * written as \u00XX, so a reader recovers the exact name by encoding
+ * the decoded string as latin-1.
+ */
+static void printJsonString(ostream& out, const string& s)
+{
+	static const char hex[] = "0123456789abcdef";
+	out << '"';
+	for(size_t i = 0; i < s.length(); i++) {
+		unsigned char c = (unsigned char)s[i];
+		if(c == '"' || c == '\\') {
+			out << '\\' << (char)c;
+		} else if(c < 0x20 || c >= 0x7f) {
+			out << "\\u00" << hex[c >> 4] << hex[c & 0xf];
+		} else {
+			out << (char)c;
+		}
+	}
+	out << '"';
+}
+
+/**
+ * Write <outfile>.meta.json, a small sidecar holding the IndexSummary
+ * of the finished index: its fields, for scripts, and the exact text
+ * "hisat2-inspect -s" prints, so the hisat2-inspect wrapper can answer
+ * -n and -s without loading the index.
+ */
+template <typename index_t>
+static void writeIndexMeta(const string& outfile, bool repeat)
+{
+	const string primary = outfile + ".1." + gfm_ext;
+	const string metafile = outfile + ".meta.json";
+	filesWritten.push_back(metafile);
+
+	IndexSummary<index_t> summary;
+	summary.read(outfile, false);
+	ostringstream summary_text;
+	summary.print(summary_text);
+
+	struct stat st;
+	if(stat(primary.c_str(), &st) != 0) {
+		cerr << "Warning: could not stat " << primary.c_str() << "; not writing " << metafile.c_str() << endl;
+		return;
+	}
+
+	ofstream out(metafile.c_str());
+	if(!out.good()) {
+		cerr << "Warning: could not open " << metafile.c_str() << " for writing" << endl;
+		return;
+	}
+	out << "{" << endl;
+	out << "  \"format\": 1," << endl;
+	out << "  \"index_file\": ";
+	printJsonString(out, primary.substr(primary.find_last_of('/') + 1));
+	out << "," << endl;
+	out << "  \"index_size\": " << st.st_size << "," << endl;
+	out << "  \"version\": \"2." << summary.major << '.' << summary.minor;
+	if(summary.extra_version != "") {
+		out << "-" << summary.extra_version;
+	}
+	out << "\"," << endl;
+	out << "  \"flags\": " << (-summary.flags) << "," << endl;
+	out << "  \"compatible_2_0\": " << (summary.entireReverse ? "true" : "false") << "," << endl;
+	out << "  \"offrate\": " << summary.offRate << "," << endl;
+	out << "  \"ftab_chars\": " << summary.ftabChars << "," << endl;
+	out << "  \"large_index\": " << (sizeof(index_t) == 8 ? "true" : "false") << "," << endl;
+	out << "  \"repeat_index\": " << (repeat ? "true" : "false") << "," << endl;
+	out << "  \"num_snps\": " << summary.numSnps << "," << endl;
+	out << "  \"num_splice_sites\": " << summary.numSpliceSites << "," << endl;
+	out << "  \"num_exons\": " << summary.numExons << "," << endl;
+	out << "  \"names\": [";
+	for(size_t i = 0; i < summary.refnames.size(); i++) {
+		out << (i == 0 ? "" : ",") << endl << "    ";
+		printJsonString(out, summary.refnames[i]);
+	}
+	out << endl << "  ]," << endl;
+	out << "  \"lengths\": [";
+	for(size_t i = 0; i < summary.reflens.size(); i++) {
+		out << (i == 0 ? "" : ",") << endl << "    " << summary.reflens[i];
+	}
+	out << endl << "  ]," << endl;
+	out << "  \"summary\": ";
+	printJsonString(out, summary_text.str());
+	out << endl << "}" << endl;
+	out.close();
+}
+
 static const char *argv0 = NULL;
 
 extern "C" {
@@ -818,6 +908,9 @@ int hisat2_build(int argc, const char **argv) {
                                            &parent_szs,
                                            &parent_refnames);
                 }
+                if(!justRef) {
+                    writeIndexMeta<TIndexOffU>(outfile, repeat_ref_fname.length() > 0);
+                }
             } catch(bad_alloc& e) {
                 if(autoMem) {
                     cerr << "Switching to a packed string representation." << endl;
@@ -20,88 +20,20 @@
 #
 
 from sys import stderr, exit
-from collections import defaultdict as dd, Counter
 from argparse import ArgumentParser, FileType
+from hisat2_gtf import read_gtf_exons, get_exons, print_exons, \
+    extract_exons_and_splice_sites
 
 
 def extract_exons(gtf_file, verbose = False):
-    genes = dd(list)
-    trans = {}
+    gtf = read_gtf_exons(gtf_file)
 
-    # Parse valid exon lines from the GTF file into a dict by transcript_id
-    for line in gtf_file:
-        line = line.strip()
-        if not line or line.startswith('#'):
-            continue
-        if '#' in line:
-            line = line.split('#')[0].strip()
-
-        try:
-            chrom, source, feature, left, right, score, \
-                strand, frame, values = line.split('\t')
-        except ValueError:
-            continue
-        left, right = int(left), int(right)
-
-        if feature != 'exon' or left >= right:
-            continue
-
-        values_dict = {}
-        for attr in values.split(';')[:-1]:
-            attr, _, val = attr.strip().partition(' ')
-            values_dict[attr] = val.strip('"')
-
-        if 'gene_id' not in values_dict or \
-                'transcript_id' not in values_dict:
-            continue
-
-        transcript_id = values_dict['transcript_id']
-        if transcript_id not in trans:
-            trans[transcript_id] = [chrom, strand, [[left, right]]]
-            genes[values_dict['gene_id']].append(transcript_id)
-        else:
-            trans[transcript_id][2].append([left, right])
-
-    # Sort exons and merge where separating introns are <=5 bps
-    for tran, [chrom, strand, exons] in trans.items():
-            exons.sort()
-            tmp_exons = [exons[0]]
-            for i in range(1, len(exons)):
-                if exons[i][0] - tmp_exons[-1][1] <= 5:
-                    tmp_exons[-1][1] = exons[i][1]
-                else:
-                    tmp_exons.append(exons[i])
-            trans[tran] = [chrom, strand, tmp_exons]
-
-    # Calculate and print the unique junctions
-    tmp_exons = set()
-    for chrom, strand, texons in trans.values():
-        for i in range(len(texons)):
-            tmp_exons.add((chrom, texons[i][0], texons[i][1], strand))
-    tmp_exons = sorted(tmp_exons)
-    if len(tmp_exons) <= 0:
+    # Calculate and print the unique exons
+    exons = get_exons(gtf)
+    if len(exons) <= 0:
         return
 
-    exons = [tmp_exons[0]]
-    for exon in tmp_exons[1:]:
-        prev_exon = exons[-1]
-        if exon[0] != prev_exon[0]:
-            exons.append(exon)
-            continue
-        assert prev_exon[1] <= exon[1]
-        if prev_exon[2] < exon[1]:
-            exons.append(exon)
-            continue
-
-        if prev_exon[2] < exon[2]:
-            strand = prev_exon[3]
-            if strand not in "+-":
-                strand = exon[3]
-            exons[-1] = (prev_exon[0], prev_exon[1], exon[2], strand)
-            
-    for chrom, left, right, strand in exons:
-        # Zero-based offset
-        print('{}\t{}\t{}\t{}'.format(chrom, left-1, right-1, strand))
+    print_exons(exons)
         
     # Print some stats if asked
     if verbose:
@@ -147,6 +79,11 @@ if __name__ == '__main__':
         nargs='?',
         type=FileType('r'),
         help='input GTF file (use "-" for stdin)')
+    parser.add_argument('--exons-and-ss',
+        dest='exons_and_ss',
+        type=str,
+        default='',
+        help='write both BASE.exon and BASE.ss from a single pass instead of printing exons')
     parser.add_argument('-v', '--verbose',
         dest='verbose',
         action='store_true',
@@ -156,4 +93,7 @@ if __name__ == '__main__':
     if not args.gtf_file:
         parser.print_help()
         exit(1)
-    extract_exons(args.gtf_file, args.verbose)
+    if args.exons_and_ss:
+        extract_exons_and_splice_sites(args.gtf_file, args.exons_and_ss, args.verbose)
+    else:
+        extract_exons(args.gtf_file, args.verbose)
@@ -20,10 +20,13 @@
 #
 
 
-import sys, subprocess
+import sys, os
 import re
 from argparse import ArgumentParser, FileType
 from functools import cmp_to_key
+from hisat2_genome import read_genome
+from hisat2_bgzf import open_lines
+from hisat2_variant_cache import VariantCache, VariantCacheWriter, cache_fname, genome_checksum
 
 
 """
@@ -54,24 +57,6 @@ def reverse_complement(seq):
     return result
 
 
-"""
-"""
-def read_genome(genome_file):
-    chr_dic = {}
-    chr_name, sequence = "", ""
-    for line in genome_file:
-        if line.startswith(">"):
-            if chr_name and sequence:
-                chr_dic[chr_name] = sequence
-            chr_name = line.strip().split()[0][1:]
-            sequence = ""
-        else:
-            sequence += line.strip()
-    if chr_name and sequence:
-        chr_dic[chr_name] = sequence
-    return chr_dic
-
-
 """
 Compare two variants [chr, pos, type, data, dic]
 """
@@ -325,6 +310,125 @@ def generate_haplotypes(snp_file,
     return num_haplotypes
 
 
+"""
+Set of the SNP IDs seen so far.  dbSNP IDs (rs<number>) are kept as bits of a
+bytearray indexed by the number, so memory depends on the largest rs number
+(about 200 MB for two billion) rather than on the hundreds of millions of
+entries a set of strings would hold; any other IDs go into a set.
+"""
+class SNPIDSet:
+    def __init__(self):
+        self.bits = bytearray()
+        self.others = set()
+
+    def rs_number(self, id):
+        num = id[2:]
+        if id.startswith("rs") and num.isdigit() and num.isascii() and num[0] != '0':
+            return int(num)
+        return -1
+
+    def __contains__(self, id):
+        num = self.rs_number(id)
+        if num < 0:
+            return id in self.others
+        i = num >> 3
+        return i < len(self.bits) and (self.bits[i] >> (num & 7)) & 1 == 1
+
+    def add(self, id):
+        num = self.rs_number(id)
+        if num < 0:
+            self.others.add(id)
+            return
+        i = num >> 3
+        if i >= len(self.bits):
+            self.bits.extend(bytes(max(i + 1 - len(self.bits), len(self.bits))))
+        self.bits[i] |= 1 << (num & 7)
+
+
+snp_cache_columns = [("rec_chr", 'I'),
+                     ("rec_start", 'q'),
+                     ("rec_end", 'q'),
+                     ("rec_done", 'B'),
+                     ("rec_vars", 'Q'),
+                     ("var_pos", 'q'),
+                     ("var_type", 'B'),
+                     ("var_data", "str"),
+                     ("var_id", "str"),
+                     ("var_freq", 'd')]
+
+
+"""
+Write a SNP that got as far as the haplotype grouping, with the variants it added
+"""
+def write_cache_record(cache, cache_rec, snp_list):
+    chr, start, end, done, num_vars = cache_rec
+    cache.append("rec_chr", cache.chr_id(chr))
+    cache.append("rec_start", start)
+    cache.append("rec_end", end)
+    cache.append("rec_done", int(done))
+    for _, pos, type, data, var_dic in snp_list[num_vars:]:
+        cache.append("var_pos", pos)
+        cache.append("var_type", ord(type))
+        cache.append("var_data", str(data))
+        cache.append("var_id", var_dic["id"])
+        cache.append("var_freq", var_dic["freq"])
+    cache.append("rec_vars", cache.counts["var_pos"])
+
+
+"""
+Same as the SNP loop in main, but with the SNPs read from a cache file written by it
+"""
+def extract_cached_snps(cache,
+                        snp_out_file,
+                        haplotype_out_file,
+                        inter_gap,
+                        intra_gap):
+    chrs, columns = cache.chrs, cache.columns
+    rec_chr, rec_start, rec_end, rec_done, rec_vars = \
+        [columns[name] for name in ["rec_chr", "rec_start", "rec_end", "rec_done", "rec_vars"]]
+    var_pos, var_type, var_data, var_id, var_freq = \
+        [columns[name] for name in ["var_pos", "var_type", "var_data", "var_id", "var_freq"]]
+
+    snp_list = []
+    prev_chr, curr_right = "", -1
+    num_haplotypes = 0
+    v = 0
+    for r in range(len(rec_chr)):
+        chr, start, end = chrs[rec_chr[r]], rec_start[r], rec_end[r]
+        if (prev_chr != chr or curr_right + inter_gap < start) and \
+                len(snp_list) > 0:
+            num_haplotypes = generate_haplotypes(snp_out_file,
+                                                 haplotype_out_file,
+                                                 snp_list,
+                                                 inter_gap,
+                                                 intra_gap,
+                                                 num_haplotypes)
+            snp_list = []
+
+        while v < rec_vars[r]:
+            type, data = "%c" % var_type[v], var_data[v]
+            if type == 'D':
+                data = int(data)
+            snp_list.append([chr, var_pos[v], type, data, {"id":var_id[v], "freq":var_freq[v]}])
+            v += 1
+
+        if not rec_done[r]:
+            continue
+        if curr_right < end:
+            curr_right = end
+        if prev_chr != chr:
+            curr_right = end
+        prev_chr = chr
+
+    if len(snp_list) > 0:
+        generate_haplotypes(snp_out_file,
+                            haplotype_out_file,
+                            snp_list,
+                            inter_gap,
+                            intra_gap,
+                            num_haplotypes)
+
+
 """
 """
 def main(genome_file,
@@ -332,11 +436,33 @@ def main(genome_file,
          base_fname,
          inter_gap,
          intra_gap,
+         cache_dir,
          verbose,
          testset):
     # load genomic sequences
     chr_dic = read_genome(genome_file)
 
+    # Parsed SNPs are cached unless test reads are also written
+    cache = None
+    if cache_dir and not testset:
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        genome_sum = genome_checksum(getattr(genome_file, "name", ""), chr_dic)
+        fname = cache_fname(cache_dir, snp_fname, ["UCSC", genome_sum])
+        if os.path.exists(fname):
+            snp_out_file = open(base_fname + ".snp", 'w')
+            haplotype_out_file = open(base_fname + ".haplotype", 'w')
+            extract_cached_snps(VariantCache(fname),
+                                snp_out_file,
+                                haplotype_out_file,
+                                inter_gap,
+                                intra_gap)
+            snp_out_file.close()
+            haplotype_out_file.close()
+            return
+        cache = VariantCacheWriter(fname, snp_cache_columns)
+    cache_rec = None
+
     if testset:
         ref_testset_file = open(base_fname + ".ref.testset.fa", "w")
         alt_testset_file = open(base_fname + ".alt.testset.fa", "w")
@@ -348,16 +474,8 @@ def main(genome_file,
     snp_list = []
     prev_chr, curr_right = "", -1
     num_haplotypes = 0
-    if snp_fname.endswith(".gz"):
-        snp_cmd = ["gzip", "-cd", snp_fname]
-    else:
-        snp_cmd = ["cat", snp_fname]
-    snp_proc = subprocess.Popen(snp_cmd,
-                                universal_newlines=True,
-                                stdout=subprocess.PIPE,
-                                stderr=open("/dev/null", 'w'))
-    ids_seen = set()
-    for line in snp_proc.stdout:
+    ids_seen = SNPIDSet()
+    for line in open_lines(snp_fname):
         if not line or line.startswith('#'):
             continue
 
@@ -410,6 +528,11 @@ def main(genome_file,
             continue
         ids_seen.add(rs_id)
 
+        if cache:
+            if cache_rec:
+                write_cache_record(cache, cache_rec, snp_list)
+            cache_rec = [chr, start, end, False, 0]
+
         if (prev_chr != chr or curr_right + inter_gap < start) and \
                 len(snp_list) > 0:
             num_haplotypes = generate_haplotypes(snp_out_file,
@@ -419,6 +542,8 @@ def main(genome_file,
                                                  intra_gap,
                                                  num_haplotypes)
             snp_list = []
+        if cache:
+            cache_rec[4] = len(snp_list)
 
         observed = observed.upper()
         allele_list = observed.split("/")
@@ -510,6 +635,13 @@ def main(genome_file,
         if prev_chr != chr:
             curr_right = end
         prev_chr = chr
+        if cache:
+            cache_rec[3] = True
+
+    if cache:
+        if cache_rec:
+            write_cache_record(cache, cache_rec, snp_list)
+        cache.close()
 
     if testset:
         ref_testset_file.close()
@@ -554,6 +686,11 @@ if __name__ == '__main__':
                         type=int,
                         default=50,
                         help="Break a haplotype into several haplotypes")
+    parser.add_argument('--variant-cache',
+                        dest='cache_dir',
+                        type=str,
+                        default="",
+                        help='Directory to cache parsed SNPs in, so that later runs on the same SNP file (e.g. with other --inter-gap/--intra-gap) skip parsing it')
     parser.add_argument('-v', '--verbose',
                         dest='verbose',
                         action='store_true',
@@ -574,5 +711,6 @@ if __name__ == '__main__':
          args.base_fname,
          args.inter_gap,
          args.intra_gap,
+         args.cache_dir,
          args.verbose,
          args.testset)
@@ -19,29 +19,37 @@
 #
 
 
-import sys, os, subprocess
+import sys, os, re
+import multiprocessing
+from bisect import bisect_left
+from heapq import heappush, heappop
 from argparse import ArgumentParser, FileType
 from functools import cmp_to_key
+from hisat2_genome import read_genome
+from hisat2_bgzf import open_lines, parse_regions
+from hisat2_variant_cache import VariantCache, VariantCacheWriter, cache_fname, genome_checksum
 
 digit2str = [str(i) for i in range(10)]
 
+# Genotypes read from VCF files are bit-packed into a Python int per variant,
+# bit 2*i (2*i+1) being set when the first (second) chromosome of the i-th
+# genome carries the variant.  digit2bits[d] turns a string of GT alleles
+# into the corresponding string of '0'/'1' bits for allele d.
+digit2bits = [str.maketrans(dict([(chr(c), '1' if chr(c) == digit2str[d] else '0') for c in range(128)]))
+              for d in range(10)]
+
+
 """
+Return the positions of 1 bits in an int, in increasing order
 """
-def read_genome(genome_file):
-    chr_dic = {}
-    chr_name, sequence = "", ""
-    for line in genome_file:
-        if line.startswith(">"):
-            if chr_name and sequence:
-                chr_dic[chr_name] = sequence
-            chr_name = line.strip().split()[0][1:]
-            sequence = ""
-        else:
-            sequence += line.strip()
-    if chr_name and sequence:
-        chr_dic[chr_name] = sequence
-    return chr_dic
-
+def bit_positions(bits):
+    bits = bin(bits)[:1:-1]
+    positions = []
+    i = bits.find('1')
+    while i >= 0:
+        positions.append(i)
+        i = bits.find('1', i + 1)
+    return positions
 
 """
 Compare two variants [chr, pos, type, data, dic]
@@ -159,6 +167,90 @@ def extract_vars(chr_dic, chr, pos, ref_allele, alt_alleles, varID):
     return vars
 
 
+"""
+For each variant v, find the first variant whose scan forward from it reaches v
+(-1 if none).  A scan skips variants that an earlier scan already reached, and
+those always form a contiguous run right after the current variant, so each
+scan resumes from where the previous one stopped.
+"""
+def variant_compatibility(vars):
+    vars_cmpt = [-1 for i in range(len(vars))]
+    frontier = 0
+    for v in range(len(vars)):
+        var_chr, var_pos, var_type, var_data = vars[v][:4]
+        if var_type == 'D':
+            var_pos += (var_data - 1)
+        v2 = max(frontier, v + 1)
+        while v2 < len(vars):
+            var2_chr, var2_pos, var2_type = vars[v2][:3]
+            assert var_chr == var2_chr
+            if var_type == 'D' and var2_type == 'D':
+                if var_pos + 1 < var2_pos:
+                    break
+            else:
+                if var_pos < var2_pos:
+                    break
+            vars_cmpt[v2] = v
+            v2 += 1
+        frontier = v2
+    return vars_cmpt
+
+
+"""
+Give each variant whose genotype_nums entry is None the smallest number in
+[min_num, max_num) not used by an incompatible variant among vars_cmpt[v], ..., v-1.
+
+Earlier variant v2 is incompatible with v when pos(v) <= pos(v2) (+ deletion length),
+so variants are swept in order, keeping the ones that may still be incompatible
+in a heap by that end coordinate, a count of the numbers they use, and a heap
+of the numbers currently free.
+"""
+def assign_genotype_nums(vars, vars_cmpt, genotype_nums, min_num, max_num):
+    genotype_nums = genotype_nums[:]
+    num_used = [0 for i in range(max_num)]
+    free_nums = list(range(min_num, max_num))
+    active = [False for i in range(len(vars))]
+    active_ends = []
+    low = 0
+
+    def deactivate(v2):
+        active[v2] = False
+        num = genotype_nums[v2]
+        num_used[num] -= 1
+        if num_used[num] == 0 and num >= min_num:
+            heappush(free_nums, num)
+
+    for v in range(len(vars)):
+        _, var_pos, var_type, var_data = vars[v][:4]
+        while active_ends and active_ends[0][0] < var_pos:
+            _, v2 = heappop(active_ends)
+            if active[v2]:
+                deactivate(v2)
+        if vars_cmpt[v] >= 0:
+            while low < vars_cmpt[v]:
+                if active[low]:
+                    deactivate(low)
+                low += 1
+
+        if genotype_nums[v] is None:
+            if vars_cmpt[v] < 0:
+                genotype_nums[v] = min_num
+            else:
+                while free_nums and num_used[free_nums[0]] > 0:
+                    heappop(free_nums)
+                assert len(free_nums) > 0
+                genotype_nums[v] = free_nums[0]
+
+        var_end = var_pos
+        if var_type == 'D':
+            var_end += var_data
+        heappush(active_ends, (var_end, v))
+        active[v] = True
+        num_used[genotype_nums[v]] += 1
+
+    return genotype_nums
+
+
 """
 """
 def generate_haplotypes(snp_file,
@@ -208,54 +300,31 @@ def generate_haplotypes(snp_file,
             (varID, type, chr, pos, data), file=snp_file)
 
     # variant compatibility
-    vars_cmpt = [-1 for i in range(len(vars))]
-    for v in range(len(vars)):
-        var_chr, var_pos, var_type, var_data = vars[v][:4]
-        if var_type == 'D':
-            var_pos += (var_data - 1)
-        for v2 in range(v + 1, len(vars)):
-            if vars_cmpt[v2] >= 0:
-                continue
-            var2_chr, var2_pos, var2_type = vars[v2][:3]
-            assert var_chr == var2_chr
-            if var_type == 'D' and var2_type == 'D':
-                if var_pos + 1 < var2_pos:
-                    break
-            else:
-                if var_pos < var2_pos:
-                    break
-            vars_cmpt[v2] = v
+    vars_cmpt = variant_compatibility(vars)
             
     # Assign genotypes for those missing genotypes
     genotypes_list = []
     if num_genomes > 0:
-        max_genotype_num = 1
-        for v in range(len(vars)):
-            var = vars[v]
+        # Assigned genotypes are the same number (>= 2) for every chromosome
+        # and are kept as that single digit rather than as a bitmask
+        genotype_nums = []
+        for var in vars:
             var_dic = var[4]
             if "genotype" not in var_dic:
-                used = [True, True] + [False for i in range(8)]
-                if vars_cmpt[v] >= 0:
-                    v2 = v - 1
-                    while v2 >= vars_cmpt[v]:
-                        var2 = vars[v2]
-                        if not compatible_vars(var2, var):
-                            var2_dic = var2[4]
-                            assert "genotype" in var2_dic
-                            genotype_num = int(var2_dic["genotype"][0])
-                            used[genotype_num] = True
-                        v2 -= 1
-
-                assert False in used
-                for i in range(len(used)):
-                    if not used[i]:                
-                        var_dic["genotype"] = ("%d" % i) * (num_genomes * 2)
-                        if i > max_genotype_num:
-                            max_genotype_num = i
-                        break
+                genotype_nums.append(None)
+            elif isinstance(var_dic["genotype"], str):
+                genotype_nums.append(int(var_dic["genotype"]))
+            else:
+                genotype_nums.append(var_dic["genotype"] & 1)
+        genotype_nums = assign_genotype_nums(vars, vars_cmpt, genotype_nums, 2, 10)
+
+        for v in range(len(vars)):
+            var_dic = vars[v][4]
+            if "genotype" not in var_dic:
+                var_dic["genotype"] = digit2str[genotype_nums[v]]
             genotypes_list.append(var_dic["genotype"])
             
-        num_chromosomes = len(genotypes_list[0])
+        num_chromosomes = num_genomes * 2
         # daehwan - for debugging purposes
         """
         for v in range(len(vars)):
@@ -269,57 +338,36 @@ def generate_haplotypes(snp_file,
             print
         """
 
-        # genotypes_list looks like
+        # genotypes_list looks like (bit i from the right is chromosome i)
         #    Var0: 000001000
         #    Var1: 010000000
         #    Var2: 001100000
-        #    Var3: 222222222
-        # Get haplotypes from genotypes_list
+        #    Var3: '2'
+        # Get haplotypes from genotypes_list by transposing it into a bitmask
+        # of variants per chromosome, visiting only the bits that are set
         haplotypes = set()
-        cnv_genotypes = ["" for i in range(num_chromosomes)]
-        for genotypes in genotypes_list:
-            for i in range(len(genotypes)):
-                genotype = genotypes[i]
-                cnv_genotypes[i] += genotype
-
-        cnv_genotypes = set(cnv_genotypes)
-        for raw_haplotype in cnv_genotypes:
-            for num in range(1, max_genotype_num + 1):
-                num_str = str(num)
-                if num_str not in raw_haplotype:
-                    continue
-                haplotype = ""
-                for i in range(len(raw_haplotype)):
-                    if raw_haplotype[i] == num_str:
-                        if haplotype == "":
-                            haplotype = str(i)
-                        else:
-                            haplotype += ("#%d" % i)                    
-                assert haplotype != ""            
-                haplotypes.add(haplotype)
+        chr_genotypes = [0] * num_chromosomes
+        num_genotypes = {}
+        for v in range(len(genotypes_list)):
+            genotype = genotypes_list[v]
+            if isinstance(genotype, str):
+                num_genotypes[genotype] = num_genotypes.get(genotype, 0) | (1 << v)
+                continue
+            var_bit = 1 << v
+            for i in bit_positions(genotype):
+                chr_genotypes[i] |= var_bit
+
+        for genotype in set(chr_genotypes):
+            if genotype == 0:
+                continue
+            haplotypes.add('#'.join([str(v) for v in bit_positions(genotype)]))
+        for genotype in num_genotypes.values():
+            haplotypes.add('#'.join([str(v) for v in bit_positions(genotype)]))
 
     else:
+        genotypes_list = assign_genotype_nums(vars, vars_cmpt, [None] * len(vars), 0, 100)
         for v in range(len(vars)):
-            var = vars[v]
-            var_dic = var[4]
-            used = [False for i in range(100)]
-            if vars_cmpt[v] >= 0:
-                v2 = v - 1
-                while v2 >= vars_cmpt[v]:
-                    var2 = vars[v2]
-                    if not compatible_vars(var2, var):
-                        var2_dic = var2[4]
-                        assert "genotype" in var2_dic
-                        genotype_num = var2_dic["genotype"]
-                        used[genotype_num] = True
-                    v2 -= 1
-
-            assert False in used
-            for i in range(len(used)):
-                if not used[i]:                
-                    var_dic["genotype"] = i
-                    break
-            genotypes_list.append(var_dic["genotype"])
+            vars[v][4]["genotype"] = genotypes_list[v]
             
         # genotypes_list looks like
         #    Var0: 0
@@ -400,6 +448,11 @@ def generate_haplotypes(snp_file,
     """
 
     # Write haplotypes
+    # A haplotype begins at the smallest end among the preceding haplotypes,
+    # going back until one ends more than inter_gap before it.  prev_ends holds
+    # the suffix minima of the ends seen so far (increasing), so the haplotype
+    # to stop at and the smallest end after it are both found by bisection.
+    prev_ends = []
     for h_i in range(len(haplotypes)):
         h = haplotypes[h_i].split('#')
         chr, h1_locus, _, _, _ = vars[int(h[0])]
@@ -409,17 +462,12 @@ def generate_haplotypes(snp_file,
             h_end += (int(h2_data) - 1)
         assert h_begin <= h_end
         h_new_begin = h_begin
-        for h_j in reversed(range(0, h_i)):
-            hc = haplotypes[h_j].split('#')
-            _, hc_begin, hc_type, hc_data, _ = vars[int(hc[-1])]
-            hc_begin = int(hc_begin)
-            hc_end = hc_begin
-            if hc_type == 'D':
-                hc_end += (int(hc_data) - 1)
-            if hc_end + inter_gap < h_begin:
-                break
-            if h_new_begin > hc_end:
-                h_new_begin = hc_end
+        e = bisect_left(prev_ends, h_begin - inter_gap)
+        if e < len(prev_ends) and h_new_begin > prev_ends[e]:
+            h_new_begin = prev_ends[e]
+        while prev_ends and prev_ends[-1] >= h_end:
+            prev_ends.pop()
+        prev_ends.append(h_end)
         assert h_new_begin <= h_begin
         h_add = []
         for id in h:
@@ -432,6 +480,593 @@ def generate_haplotypes(snp_file,
     return num_haplotypes
 
 
+"""
+Index of gene ranges on a chromosome, {gene: [left, right]}, answering which
+gene's range strictly contains a position.  Where ranges overlap, the gene that
+comes first in the dictionary wins, as with a linear scan over the ranges.
+"""
+class GeneRangeIndex:
+    def __init__(self, gene_ranges):
+        # Breakpoints split the chromosome into atoms: the open gap before
+        # breakpoint k is atom 2k and breakpoint k itself is atom 2k+1
+        self.points = sorted(set([p for range_ in gene_ranges.values() for p in range_]))
+        num_atoms = 2 * len(self.points) + 1
+        self.atom_genes = [None] * num_atoms
+
+        # Give each atom to the first gene covering it, skipping atoms that
+        # are already taken so every atom is visited once
+        next_free = list(range(num_atoms + 1))
+        def find_free(a):
+            root = a
+            while next_free[root] != root:
+                root = next_free[root]
+            while next_free[a] != root:
+                next_free[a], a = root, next_free[a]
+            return root
+
+        for gene, range_ in gene_ranges.items():
+            left, right = range_
+            lo = 2 * bisect_left(self.points, left) + 2
+            hi = 2 * bisect_left(self.points, right)
+            a = find_free(lo)
+            while a <= hi:
+                self.atom_genes[a] = (gene, range_)
+                next_free[a] = a + 1
+                a = find_free(a + 1)
+
+    """
+    Return (gene, [left, right]) with left < pos < right, or None
+    """
+    def find(self, pos):
+        k = bisect_left(self.points, pos)
+        if k < len(self.points) and self.points[k] == pos:
+            return self.atom_genes[2 * k + 1]
+        return self.atom_genes[2 * k]
+
+
+"""
+Return the gene in GENEINFO (e.g. GENEINFO=BRCA1:672|NBR2:10230) that comes first in gene_order, or None
+"""
+geneinfo_re = re.compile(r'(?:^|;)GENEINFO=([^;]*)')
+def find_geneinfo_gene(info, gene_order):
+    geneinfo = geneinfo_re.search(info)
+    if not geneinfo:
+        return None
+    gene, gene_rank = None, -1
+    for token in geneinfo.group(1).split('|'):
+        g = token.split(':')[0]
+        rank = gene_order.get(g, -1)
+        if rank >= 0 and (gene_rank < 0 or rank < gene_rank):
+            gene, gene_rank = g, rank
+    return gene
+
+
+"""
+Read the variants to be genotyped (e.g. ClinVar) in one pass over genotype_vcf.
+Returns the gene list, taken from GENEINFO when genotype_gene_list is empty,
+and the (Likely) pathogenic records as (chr, pos, varID, ref_allele, alt_alleles, GENEINFO, CLNSIG).
+Genes are resolved later, as that needs the whole gene list.
+"""
+def read_genotype_VCF(genotype_vcf,
+                      chr_dic,
+                      genotype_gene_list,
+                      regions=None,
+                      threads=1):
+    genes = set()
+    records = []
+    for line in open_lines(genotype_vcf, regions, threads):
+        if line.startswith("#"):
+            continue
+
+        chr, pos, varID, ref_allele, alt_alleles, qual, filter, info = line.strip().split('\t')
+        if len(genotype_gene_list) == 0 and info.find("GENEINFO=") != -1:
+            gene = info.split("GENEINFO=")[1]
+            gene = gene.split(':')[0]
+            genes.add(gene)
+
+        if chr not in chr_dic:
+            continue
+        geneinfo = geneinfo_re.search(info)
+        if not geneinfo:
+            continue
+
+        CLNSIG = -1
+        for item in info.split(';'):
+            if not item.startswith("CLNSIG"):
+                continue
+            try:
+                key, value = item.split('=')
+                CLNSIG = int(value)
+            except ValueError:
+                continue
+        if CLNSIG not in [4, 5]:
+            continue
+        if CLNSIG == 4:
+            CLNSIG = "Likely pathogenic"
+        else:
+            CLNSIG = "Pathogenic"
+
+        records.append((chr, int(pos) - 1, varID, ref_allele, alt_alleles, geneinfo.group(0), CLNSIG))
+
+    if len(genotype_gene_list) == 0:
+        genotype_gene_list = list(genes)
+    return genotype_gene_list, records
+
+
+"""
+Extract SNPs and haplotypes from one VCF file into SNP_file and haplotype_file.
+Returns the updated numbers of haplotypes and unnamed variants.
+"""
+def extract_VCF(VCF_fname,
+                chr_dic,
+                SNP_file,
+                haplotype_file,
+                inter_gap,
+                intra_gap,
+                only_rs,
+                reference_type,
+                genotype_var_list,
+                genotype_ranges,
+                genotype_gene_list,
+                num_haplotypes,
+                unnamed_var_count,
+                regions=None,
+                threads=1,
+                cache=None):
+    num_genomes = 0
+    genotype_range_index = {}
+    for chr, gene_ranges in genotype_ranges.items():
+        genotype_range_index[chr] = GeneRangeIndex(gene_ranges)
+
+    empty_VCF_file = False
+    if VCF_fname == "/dev/null" or \
+            not os.path.exists(VCF_fname):
+        empty_VCF_file = True
+    
+    if reference_type != "genome" and \
+            len(genotype_gene_list) > 0:
+        return num_haplotypes, unnamed_var_count
+
+    if not empty_VCF_file:
+        VCF_lines = open_lines(VCF_fname, regions, threads)
+
+        genomeIDs = []
+        vars, genotypes_list = [], []
+        prev_varID, prev_chr, prev_pos = "", "", -1
+        reset = False
+        num_lines = 0
+        for line in VCF_lines:
+            num_lines += 1
+            if line.startswith("##"):
+                continue
+
+            fields = line.strip().split('\t')
+
+            chr, pos, varID, ref_allele, alt_alleles, qual, filter, info = fields[:8]
+            if prev_chr != chr:
+                curr_right = -1
+                reset = True
+
+            if len(fields) >= 9:
+                format = fields[8]
+           
+            genotypes = []
+            if len(fields) >= 10:
+                genotypes = fields[9:]
+
+            if line.startswith("#"):
+                genomeIDs = genotypes
+                num_genomes = len(genomeIDs)
+                continue
+
+            assert len(genotypes) == len(genomeIDs)
+
+            if varID == ".":
+                unnamed_var_count += 1
+                varID = "un%d" % unnamed_var_count
+
+            if only_rs and not varID.startswith("rs"):
+                continue
+
+            if ';' in varID:
+                continue
+
+            if varID == prev_varID:
+                continue
+
+            if chr not in chr_dic:
+                continue
+
+            chr_seq = chr_dic[chr]
+            chr_genotype_vars = []
+            chr_genotype_ranges = None
+            if len(genotype_gene_list) > 0:
+                assert chr in genotype_var_list
+                chr_genotype_vars = genotype_var_list[chr]
+                assert chr in genotype_ranges
+                chr_genotype_ranges = genotype_range_index[chr]
+
+            pos = int(pos) - 1
+            offset = 0
+            gene = None
+            if num_lines % 10000 == 1:
+                print("\t%s:%d\r" % (chr, pos), file=sys.stderr)
+
+            if chr_genotype_ranges:
+                gene_range = chr_genotype_ranges.find(pos)
+                if gene_range is None:
+                    continue
+                gene_, range_ = gene_range
+                if len(vars) == 0:
+                    for var in chr_genotype_vars:
+                        var_chr, var_pos, var_type, var_data, var_dic = var
+                        if var_pos < range_[0]:
+                            continue
+                        if var_pos > range_[1]:
+                            break
+                        if reference_type == "gene":
+                            var_pos -= range_[0]
+                        vars.append([gene_, var_pos, var_type, var_data, var_dic])
+                    curr_right = range_[1]
+                if reference_type == "gene":
+                    offset = range_[0]
+                    gene = gene_
+
+            if pos == prev_pos:
+                continue
+
+            if len(vars) > 0 and \
+                    (curr_right + inter_gap < pos or prev_chr != chr):                    
+                num_haplotypes = generate_haplotypes(SNP_file,
+                                                     haplotype_file,
+                                                     vars,
+                                                     inter_gap,
+                                                     intra_gap,
+                                                     num_genomes,
+                                                     num_haplotypes)
+                vars = []
+
+            def add_vars(pos,
+                         offset,
+                         gene,
+                         varID,
+                         ref_allele,
+                         alt_alleles,
+                         vars,
+                         genotypes):
+                tmp_vars = extract_vars(chr_dic, chr, pos, ref_allele, alt_alleles, varID)
+                # Both alleles of every genome, e.g. "0|1" and "1|1" become "0111"
+                alleles = ''.join([genotype[0] + genotype[2] for genotype in genotypes])
+                max_right = -1
+                for v in range(len(tmp_vars)):
+                    var = tmp_vars[v]
+                    _, pos2, type, data = var[:4]
+                    cnv_genotypes = 0
+                    if alleles:
+                        cnv_genotypes = int(alleles.translate(digit2bits[v + 1])[::-1], 2)
+
+                    # Skip SNPs not present in a given population (e.g. 2,504 genomes in 1000 Genomes Project)
+                    if alleles and cnv_genotypes == 0:
+                        continue
+
+                    tmp_varID = var[4]["id2"]
+                    var_dic = {"id":varID, "id2":tmp_varID, "genotype":cnv_genotypes}
+                    if reference_type == "gene":
+                        vars.append([gene, pos2 - offset, type, data, var_dic])
+                    else:
+                        vars.append([chr, pos2, type, data, var_dic])
+                    right = pos2
+                    if type == 'D':
+                        right += (int(data) - 1)
+                    if max_right < right:
+                        max_right = right
+                return max_right
+  
+            num_vars = len(vars)
+            right = add_vars(pos,
+                             offset,
+                             gene,
+                             varID,
+                             ref_allele,
+                             alt_alleles,
+                             vars,
+                             genotypes)
+            if cache:
+                write_VCF_cache_record(cache, chr, pos, right, reset, vars[num_vars:])
+                reset = False
+            if curr_right < right:
+                curr_right = right
+
+            prev_varID = varID
+            prev_chr = chr
+            prev_pos = pos
+
+        if len(vars) > 0:
+            num_haplotypes = generate_haplotypes(SNP_file,
+                                                 haplotype_file,
+                                                 vars,
+                                                 inter_gap,
+                                                 intra_gap,
+                                                 num_genomes,
+                                                 num_haplotypes)
+            vars = []
+
+        if cache:
+            cache.meta["num_genomes"] = num_genomes
+
+    else:            
+        for chr in genotype_var_list.keys():
+            chr_seq = chr_dic[chr]
+            chr_genotype_vars = genotype_var_list[chr]
+            curr_right = -1
+            vars = []
+            for var in chr_genotype_vars:
+                var_chr, var_pos, var_type, var_data, var_dic = var
+                num_genomes = 0
+                if len(vars) > 0 and curr_right + inter_gap < var_pos:
+                    num_haplotypes = generate_haplotypes(SNP_file,
+                                                         haplotype_file,
+                                                         vars,
+                                                         inter_gap,
+                                                         intra_gap,
+                                                         num_genomes,
+                                                         num_haplotypes)
+                    vars = []
+                vars.append([var_chr, var_pos, var_type, var_data, var_dic])
+                curr_right = var_pos
+                if var_type == 'D':
+                    curr_right += (var_data - 1)
+
+            if len(vars) > 0:
+                num_haplotypes = generate_haplotypes(SNP_file,
+                                                     haplotype_file,
+                                                     vars,
+                                                     inter_gap,
+                                                     intra_gap,
+                                                     num_genomes,
+                                                     num_haplotypes)
+                vars = []
+
+    return num_haplotypes, unnamed_var_count
+
+
+VCF_cache_columns = [("rec_chr", 'I'),
+                     ("rec_pos", 'q'),
+                     ("rec_right", 'q'),
+                     ("rec_reset", 'B'),
+                     ("rec_vars", 'Q'),
+                     ("var_pos", 'q'),
+                     ("var_type", 'B'),
+                     ("var_data", "str"),
+                     ("var_id", "str"),
+                     ("var_id2", "str"),
+                     ("var_genotype", "bytes")]
+
+
+"""
+Write a VCF line that got as far as add_vars, with the variants it added
+"""
+def write_VCF_cache_record(cache, chr, pos, right, reset, vars):
+    cache.append("rec_chr", cache.chr_id(chr))
+    cache.append("rec_pos", pos)
+    cache.append("rec_right", right)
+    cache.append("rec_reset", int(reset))
+    for _, pos2, type, data, var_dic in vars:
+        cache.append("var_pos", pos2)
+        cache.append("var_type", ord(type))
+        cache.append("var_data", str(data))
+        cache.append("var_id", var_dic["id"])
+        cache.append("var_id2", var_dic["id2"])
+        genotype = var_dic["genotype"]
+        cache.append("var_genotype", genotype.to_bytes((genotype.bit_length() + 7) // 8, "little"))
+    cache.append("rec_vars", cache.counts["var_pos"])
+
+
+"""
+Same as extract_VCF, but with the variants read from a cache file written by it,
+so only the grouping into haplotypes (which depends on inter_gap and intra_gap) is redone
+"""
+def extract_cached_VCF(cache,
+                       SNP_file,
+                       haplotype_file,
+                       inter_gap,
+                       intra_gap,
+                       num_haplotypes,
+                       unnamed_var_count):
+    meta, chrs, columns = cache.meta, cache.chrs, cache.columns
+    num_genomes = meta["num_genomes"]
+    unnamed_offset = unnamed_var_count - meta["unnamed_offset"]
+    rec_chr, rec_pos, rec_right, rec_reset, rec_vars = \
+        [columns[name] for name in ["rec_chr", "rec_pos", "rec_right", "rec_reset", "rec_vars"]]
+    var_pos, var_type, var_data, var_id, var_id2, var_genotype = \
+        [columns[name] for name in ["var_pos", "var_type", "var_data", "var_id", "var_id2", "var_genotype"]]
+
+    vars = []
+    prev_chr, curr_right = "", -1
+    v = 0
+    for r in range(len(rec_chr)):
+        chr, pos = chrs[rec_chr[r]], rec_pos[r]
+        if rec_reset[r]:
+            curr_right = -1
+        if len(vars) > 0 and \
+                (curr_right + inter_gap < pos or prev_chr != chr):
+            num_haplotypes = generate_haplotypes(SNP_file,
+                                                 haplotype_file,
+                                                 vars,
+                                                 inter_gap,
+                                                 intra_gap,
+                                                 num_genomes,
+                                                 num_haplotypes)
+            vars = []
+
+        while v < rec_vars[r]:
+            type, data = "%c" % var_type[v], var_data[v]
+            if type == 'D':
+                data = int(data)
+            varID, varID2 = var_id[v], var_id2[v]
+            if unnamed_offset != 0 and varID.startswith("un"):
+                varID = renumber_unnamed(varID, unnamed_offset)
+                varID2 = renumber_unnamed(varID2, unnamed_offset)
+            var_dic = {"id":varID, "id2":varID2, "genotype":int.from_bytes(var_genotype[v], "little")}
+            vars.append([chr, var_pos[v], type, data, var_dic])
+            v += 1
+
+        if curr_right < rec_right[r]:
+            curr_right = rec_right[r]
+        prev_chr = chr
+
+    if len(vars) > 0:
+        num_haplotypes = generate_haplotypes(SNP_file,
+                                             haplotype_file,
+                                             vars,
+                                             inter_gap,
+                                             intra_gap,
+                                             num_genomes,
+                                             num_haplotypes)
+
+    return num_haplotypes, unnamed_var_count + meta["unnamed_var_count"]
+
+
+"""
+extract_VCF through the variant cache in cache_dir: read the variants from the cache
+if this VCF file has been parsed with the same genome and settings, otherwise parse
+it and write the cache
+"""
+def extract_VCF_with_cache(cache_dir,
+                           VCF_fname,
+                           chr_dic,
+                           genome_sum,
+                           SNP_file,
+                           haplotype_file,
+                           inter_gap,
+                           intra_gap,
+                           only_rs,
+                           num_haplotypes,
+                           unnamed_var_count,
+                           regions=None,
+                           threads=1):
+    fname = cache_fname(cache_dir, VCF_fname, ["VCF", genome_sum, only_rs, regions])
+    if os.path.exists(fname):
+        return extract_cached_VCF(VariantCache(fname),
+                                  SNP_file,
+                                  haplotype_file,
+                                  inter_gap,
+                                  intra_gap,
+                                  num_haplotypes,
+                                  unnamed_var_count)
+
+    cache = VariantCacheWriter(fname, VCF_cache_columns)
+    cache.meta["unnamed_offset"] = unnamed_var_count
+    try:
+        new_num_haplotypes, new_unnamed_var_count = extract_VCF(VCF_fname,
+                                                                chr_dic,
+                                                                SNP_file,
+                                                                haplotype_file,
+                                                                inter_gap,
+                                                                intra_gap,
+                                                                only_rs,
+                                                                "genome",
+                                                                {},
+                                                                {},
+                                                                [],
+                                                                num_haplotypes,
+                                                                unnamed_var_count,
+                                                                regions,
+                                                                threads,
+                                                                cache)
+    except:
+        cache.abort()
+        raise
+    cache.meta["unnamed_var_count"] = new_unnamed_var_count - unnamed_var_count
+    cache.meta.setdefault("num_genomes", 0)
+    cache.close()
+    return new_num_haplotypes, new_unnamed_var_count
+
+
+"""
+Worker for --threads: extract one VCF file into its own .snp/.haplotype shard
+"""
+def extract_VCF_shard(args):
+    genome_fname, VCF_fname, shard_fname, inter_gap, intra_gap, only_rs, reference_type, regions, \
+        cache_dir, genome_sum = args
+    chr_dic = read_genome(genome_fname)
+    SNP_file = open("%s.snp" % shard_fname, 'w')
+    haplotype_file = open("%s.haplotype" % shard_fname, 'w')
+    if cache_dir:
+        num_haplotypes, unnamed_var_count = extract_VCF_with_cache(cache_dir,
+                                                                   VCF_fname,
+                                                                   chr_dic,
+                                                                   genome_sum,
+                                                                   SNP_file,
+                                                                   haplotype_file,
+                                                                   inter_gap,
+                                                                   intra_gap,
+                                                                   only_rs,
+                                                                   0,
+                                                                   0,
+                                                                   regions)
+        SNP_file.close()
+        haplotype_file.close()
+        return num_haplotypes, unnamed_var_count
+
+    num_haplotypes, unnamed_var_count = extract_VCF(VCF_fname,
+                                                    chr_dic,
+                                                    SNP_file,
+                                                    haplotype_file,
+                                                    inter_gap,
+                                                    intra_gap,
+                                                    only_rs,
+                                                    reference_type,
+                                                    {},
+                                                    {},
+                                                    [],
+                                                    0,
+                                                    0,
+                                                    regions)
+    SNP_file.close()
+    haplotype_file.close()
+    return num_haplotypes, unnamed_var_count
+
+
+"""
+Shift the number of an unnamed variant ID (e.g. un12 or un12.1) by offset
+"""
+unnamed_re = re.compile(r'^un(\d+)(\..*)?$')
+def renumber_unnamed(varID, offset):
+    m = unnamed_re.match(varID)
+    if not m:
+        return varID
+    return "un%d%s" % (int(m.group(1)) + offset, m.group(2) or "")
+
+
+"""
+Concatenate shards in VCF file order, renumbering ht%d and un%d IDs
+so the result is the same as processing the VCF files one after another
+"""
+def merge_VCF_shards(shard_fnames, shard_counts, SNP_file, haplotype_file):
+    num_haplotypes, unnamed_var_count = 0, 0
+    for shard_fname, (shard_num_haplotypes, shard_unnamed_var_count) in zip(shard_fnames, shard_counts):
+        for line in open("%s.snp" % shard_fname):
+            if unnamed_var_count > 0 and line.startswith("un"):
+                varID, rest = line.split('\t', 1)
+                line = "%s\t%s" % (renumber_unnamed(varID, unnamed_var_count), rest)
+            SNP_file.write(line)
+
+        for line in open("%s.haplotype" % shard_fname):
+            htID, chr, left, right, varIDs = line.rstrip('\n').split('\t')
+            if unnamed_var_count > 0 and "un" in varIDs:
+                varIDs = ','.join([renumber_unnamed(varID, unnamed_var_count) for varID in varIDs.split(',')])
+            print("ht%d\t%s\t%s\t%s\t%s" % \
+                (int(htID[2:]) + num_haplotypes, chr, left, right, varIDs), file=haplotype_file)
+
+        os.remove("%s.snp" % shard_fname)
+        os.remove("%s.haplotype" % shard_fname)
+        num_haplotypes += shard_num_haplotypes
+        unnamed_var_count += shard_unnamed_var_count
+
+    return num_haplotypes, unnamed_var_count
+
+
 """
 """
 def main(genome_file,
@@ -444,6 +1079,9 @@ def main(genome_file,
          genotype_vcf,
          genotype_gene_list,
          extra_files,
+         regions,
+         cache_dir,
+         threads,
          verbose):
     # Load genomic sequences
     chr_dic = read_genome(genome_file)
@@ -458,49 +1096,25 @@ def main(genome_file,
     # List of genomic regions to be processed
     genotype_ranges = {}
     if genotype_vcf != "":
-        var_set = set()
-        assert len(genotype_gene_list) > 0
-        if genotype_vcf.endswith(".gz"):
-            vcf_cmd = ["gzip", "-cd", genotype_vcf]
-        else:
-            vcf_cmd = ["cat", genotype_vcf]
-        vcf_proc = subprocess.Popen(vcf_cmd,
-                                    universal_newlines=True,
-                                    stdout=subprocess.PIPE,
-                                    stderr=open("/dev/null", 'w'))
-        for line in vcf_proc.stdout:
-            if line.startswith("#"):
-                continue
-
-            chr, pos, varID, ref_allele, alt_alleles, qual, filter, info = line.strip().split('\t')
-            pos = int(pos) - 1
-            if chr not in chr_dic:
-                continue
+        genotype_gene_list, genotype_records = read_genotype_VCF(genotype_vcf,
+                                                                 chr_dic,
+                                                                 genotype_gene_list,
+                                                                 regions,
+                                                                 threads)
+        if len(genotype_gene_list) == 0:
+            print("Error: please specify --genotype-gene-list.", file=sys.stderr)
+            sys.exit(1)
 
-            gene = None
-            for g in genotype_gene_list:
-                if info.find(g) != -1:
-                    gene = g
-                    break
+        var_set = set()
+        gene_order = {}
+        for g in genotype_gene_list:
+            if g not in gene_order:
+                gene_order[g] = len(gene_order)
+        for chr, pos, varID, ref_allele, alt_alleles, geneinfo, CLNSIG in genotype_records:
+            gene = find_geneinfo_gene(geneinfo, gene_order)
             if not gene:
                 continue
 
-            CLNSIG = -1
-            for item in info.split(';'):
-                if not item.startswith("CLNSIG"):
-                    continue
-                try:
-                    key, value = item.split('=')
-                    CLNSIG = int(value)
-                except ValueError:
-                    continue
-            if CLNSIG not in [4, 5]:
-                continue
-            if CLNSIG == 4:
-                CLNSIG = "Likely pathogenic"
-            else:
-                CLNSIG = "Pathogenic"
-
             vars = extract_vars(chr_dic, chr, pos, ref_allele, alt_alleles, varID)
             if len(vars) == 0:
                 continue
@@ -526,10 +1140,11 @@ def main(genome_file,
                     genotype_ranges[chr][gene][1] = var_pos
                     
                 var_set.add(var_str)
+        genotype_records = None
 
         print("Number of variants in %s is:" % (genotype_vcf), file=sys.stderr)
         for chr, vars in genotype_var_list.items():
-            vars = sorted(vars, cmp=compare_vars)
+            vars = sorted(vars, key=cmp_to_key(compare_vars))
             print("\tChromosome %s: %d variants" % (chr, len(vars)), file=sys.stderr)
 
         for chr, gene_ranges in genotype_ranges.items():
@@ -586,228 +1201,72 @@ def main(genome_file,
             assert reference_type == "genome"
             os.system("cp genome.fa %s_backbone.fa" % base_fname)
             
-    num_genomes = 0
+    # VCF files (e.g. one per chromosome) are independent unless they share
+    # variants from --genotype-vcf, so process them in parallel when asked
+    genome_fname = getattr(genome_file, "name", "")
+    parallel = threads > 1 and len(VCF_fnames) > 1 and \
+        len(genotype_gene_list) == 0 and os.path.isfile(genome_fname)
+    if threads > 1 and not parallel:
+        print("Warning: --threads is only used with multiple VCF files and without --genotype-vcf", file=sys.stderr)
+
+    # Parsed variants are cached unless they are restricted to --genotype-vcf genes
+    genome_sum = None
+    if cache_dir:
+        if len(genotype_gene_list) > 0 or reference_type != "genome":
+            print("Warning: --variant-cache is not used with --genotype-vcf or --reference-type", file=sys.stderr)
+            cache_dir = ""
+        else:
+            if not os.path.exists(cache_dir):
+                os.makedirs(cache_dir)
+            genome_sum = genome_checksum(genome_fname, chr_dic)
+
     num_haplotypes = 0
-    num_unassigned = 0
     unnamed_var_count = 0
+    if parallel:
+        shard_fnames = ["%s.shard%d" % (base_fname, i) for i in range(len(VCF_fnames))]
+        jobs = [(genome_fname, VCF_fname, shard_fname, inter_gap, intra_gap, only_rs, reference_type, regions, cache_dir, genome_sum)
+                for VCF_fname, shard_fname in zip(VCF_fnames, shard_fnames)]
+        pool = multiprocessing.Pool(min(threads, len(jobs)))
+        shard_counts = pool.map(extract_VCF_shard, jobs, chunksize=1)
+        pool.close()
+        pool.join()
+        num_haplotypes, unnamed_var_count = merge_VCF_shards(shard_fnames,
+                                                             shard_counts,
+                                                             SNP_file,
+                                                             haplotype_file)
+        VCF_fnames = []
+
     for VCF_fname in VCF_fnames:
-        empty_VCF_file = False
-        if VCF_fname == "/dev/null" or \
-                not os.path.exists(VCF_fname):
-            empty_VCF_file = True
-        
-        if reference_type != "genome" and \
-                len(genotype_gene_list) > 0:
+        if cache_dir and os.path.exists(VCF_fname):
+            num_haplotypes, unnamed_var_count = extract_VCF_with_cache(cache_dir,
+                                                                       VCF_fname,
+                                                                       chr_dic,
+                                                                       genome_sum,
+                                                                       SNP_file,
+                                                                       haplotype_file,
+                                                                       inter_gap,
+                                                                       intra_gap,
+                                                                       only_rs,
+                                                                       num_haplotypes,
+                                                                       unnamed_var_count,
+                                                                       regions,
+                                                                       threads)
             continue
-
-        if not empty_VCF_file:
-            if VCF_fname.endswith(".gz"):
-                vcf_cmd = ["gzip", "-cd", VCF_fname]
-            else:
-                vcf_cmd = ["cat", VCF_fname]
-            vcf_proc = subprocess.Popen(vcf_cmd,
-                                        universal_newlines=True,
-                                        stdout=subprocess.PIPE,
-                                        stderr=open("/dev/null", 'w'))
-
-            genomeIDs = []
-            vars, genotypes_list = [], []
-            prev_varID, prev_chr, prev_pos = "", "", -1
-            num_lines = 0
-            for line in vcf_proc.stdout:
-                num_lines += 1
-                if line.startswith("##"):
-                    continue
-
-                fields = line.strip().split('\t')
-
-                chr, pos, varID, ref_allele, alt_alleles, qual, filter, info = fields[:8]
-                if prev_chr != chr:
-                    curr_right = -1
-
-                if len(fields) >= 9:
-                    format = fields[8]
-               
-                genotypes = []
-                if len(fields) >= 10:
-                    genotypes = fields[9:]
-
-                if line.startswith("#"):
-                    genomeIDs = genotypes
-                    num_genomes = len(genomeIDs)
-                    continue
-
-                assert len(genotypes) == len(genomeIDs)
-
-                if varID == ".":
-                    unnamed_var_count += 1
-                    varID = "un%d" % unnamed_var_count
-
-                if only_rs and not varID.startswith("rs"):
-                    continue
-
-                if ';' in varID:
-                    continue
-
-                if varID == prev_varID:
-                    continue
-
-                if chr not in chr_dic:
-                    continue
-
-                chr_seq = chr_dic[chr]
-                chr_genotype_vars = []
-                chr_genotype_ranges = {}
-                if len(genotype_gene_list) > 0:
-                    assert chr in genotype_var_list
-                    chr_genotype_vars = genotype_var_list[chr]
-                    assert chr in genotype_ranges
-                    chr_genotype_ranges = genotype_ranges[chr]
-
-                pos = int(pos) - 1
-                offset = 0
-                gene = None
-                if num_lines % 10000 == 1:
-                    print("\t%s:%d\r" % (chr, pos), file=sys.stderr)
-
-                if chr_genotype_ranges:
-                    skip = True
-                    for gene_, range_ in chr_genotype_ranges.items():
-                        if pos > range_[0] and pos < range_[1]:
-                            skip = False
-                            break
-                    if skip:
-                        continue
-                    if len(vars) == 0:
-                        for var in chr_genotype_vars:
-                            var_chr, var_pos, var_type, var_data, var_dic = var
-                            if var_pos < range_[0]:
-                                continue
-                            if var_pos > range_[1]:
-                                break
-                            if reference_type == "gene":
-                                var_pos -= range_[0]
-                            vars.append([gene_, var_pos, var_type, var_data, var_dic])
-                        curr_right = range_[1]
-                    if reference_type == "gene":
-                        offset = range_[0]
-                        gene = gene_
-
-                if pos == prev_pos:
-                    continue
-
-                if len(vars) > 0 and \
-                        (curr_right + inter_gap < pos or prev_chr != chr):                    
-                    num_haplotypes = generate_haplotypes(SNP_file,
-                                                         haplotype_file,
-                                                         vars,
-                                                         inter_gap,
-                                                         intra_gap,
-                                                         num_genomes,
-                                                         num_haplotypes)
-                    vars = []
-
-                def add_vars(pos,
-                             offset,
-                             gene,
-                             varID,
-                             ref_allele,
-                             alt_alleles,
-                             vars,
-                             genotypes):
-                    tmp_vars = extract_vars(chr_dic, chr, pos, ref_allele, alt_alleles, varID)
-                    max_right = -1
-                    for v in range(len(tmp_vars)):
-                        var = tmp_vars[v]
-                        _, pos2, type, data = var[:4]
-                        cnv_genotypes = []
-                        for genotype in genotypes:
-                            P1, P2 = genotype[0], genotype[2]
-                            if P1 == digit2str[v + 1]:
-                                cnv_genotypes.append('1')
-                            else:
-                                cnv_genotypes.append('0')
-                            if P2 == digit2str[v + 1]:
-                                cnv_genotypes.append('1')
-                            else:
-                                cnv_genotypes.append('0')
-
-                        # Skip SNPs not present in a given population (e.g. 2,504 genomes in 1000 Genomes Project)
-                        if cnv_genotypes != [] and \
-                                '1' not in cnv_genotypes:
-                            continue
-
-                        tmp_varID = var[4]["id2"]
-                        var_dic = {"id":varID, "id2":tmp_varID, "genotype":''.join(cnv_genotypes)}
-                        if reference_type == "gene":
-                            vars.append([gene, pos2 - offset, type, data, var_dic])
-                        else:
-                            vars.append([chr, pos2, type, data, var_dic])
-                        right = pos2
-                        if type == 'D':
-                            right += (int(data) - 1)
-                        if max_right < right:
-                            max_right = right
-                    return max_right
-  
-                right = add_vars(pos,
-                                 offset,
-                                 gene,
-                                 varID,
-                                 ref_allele,
-                                 alt_alleles,
-                                 vars,
-                                 genotypes)
-                if curr_right < right:
-                    curr_right = right
-
-                prev_varID = varID
-                prev_chr = chr
-                prev_pos = pos
-
-            if len(vars) > 0:
-                num_haplotypes = generate_haplotypes(SNP_file,
-                                                     haplotype_file,
-                                                     vars,
-                                                     inter_gap,
-                                                     intra_gap,
-                                                     num_genomes,
-                                                     num_haplotypes)
-                vars = []
-
-        else:            
-            for chr in genotype_var_list.keys():
-                chr_seq = chr_dic[chr]
-                chr_genotype_vars = genotype_var_list[chr]
-                curr_right = -1
-                vars = []
-                for var in chr_genotype_vars:
-                    var_chr, var_pos, var_type, var_data, var_dic = var
-                    num_genomes = 0
-                    if len(vars) > 0 and curr_right + inter_gap < var_pos:
-                        num_haplotypes = generate_haplotypes(SNP_file,
-                                                             haplotype_file,
-                                                             vars,
-                                                             inter_gap,
-                                                             intra_gap,
-                                                             num_genomes,
-                                                             num_haplotypes)
-                        vars = []
-                    vars.append([var_chr, var_pos, var_type, var_data, var_dic])
-                    curr_right = var_pos
-                    if var_type == 'D':
-                        curr_right += (var_data - 1)
-
-                if len(vars) > 0:
-                    num_haplotypes = generate_haplotypes(SNP_file,
-                                                         haplotype_file,
-                                                         vars,
-                                                         inter_gap,
-                                                         intra_gap,
-                                                         num_genomes,
-                                                         num_haplotypes)
-                    vars = []
-
+        num_haplotypes, unnamed_var_count = extract_VCF(VCF_fname,
+                                                        chr_dic,
+                                                        SNP_file,
+                                                        haplotype_file,
+                                                        inter_gap,
+                                                        intra_gap,
+                                                        only_rs,
+                                                        reference_type,
+                                                        genotype_var_list,
+                                                        genotype_ranges,
+                                                        genotype_gene_list,
+                                                        num_haplotypes,
+                                                        unnamed_var_count,
+                                                        regions,
+                                                        threads)
 
     SNP_file.close()
     haplotype_file.close()
@@ -865,6 +1324,21 @@ if __name__ == '__main__':
                         dest='extra_files',
                         action='store_true',
                         help='Output extra files such as _backbone.fa and .ref')
+    parser.add_argument('--regions',
+                        dest='regions',
+                        type=str,
+                        default="",
+                        help='A comma-separated list of regions to process (e.g. 22 or 22:16000000-17000000); a .tbi index next to a bgzipped VCF file is used if present (default: empty)')
+    parser.add_argument('--variant-cache',
+                        dest='cache_dir',
+                        type=str,
+                        default="",
+                        help='Directory to cache parsed variants in, so that later runs on the same VCF files (e.g. with other --inter-gap/--intra-gap) skip parsing them (default: empty)')
+    parser.add_argument('-p', '--threads',
+                        dest='threads',
+                        type=int,
+                        default=1,
+                        help='Number of VCF files to process in parallel, or of threads to decompress bgzipped VCF files with (default: 1)')
     parser.add_argument('-v', '--verbose',
                         dest='verbose',
                         action='store_true',
@@ -878,35 +1352,17 @@ if __name__ == '__main__':
         exit(1)
     args.VCF_fnames = args.VCF_fnames.split(',')
 
-    if args.genotype_vcf != "":
-        if args.genotype_gene_list == "":
-            genes = set()
-            if args.genotype_vcf.endswith(".gz"):
-                vcf_cmd = ["gzip", "-cd", args.genotype_vcf]
-            else:
-                vcf_cmd = ["cat", args.genotype_vcf]
-            vcf_proc = subprocess.Popen(vcf_cmd,
-                                        universal_newlines=True,
-                                        stdout=subprocess.PIPE,
-                                        stderr=open("/dev/null", 'w'))
-            for line in vcf_proc.stdout:
-                if line.startswith("#"):
-                    continue
-
-                info = line.strip().split()[-1]
-                if info.find("GENEINFO=") == -1:
-                    continue
-                gene = info.split("GENEINFO=")[1]
-                gene = gene.split(':')[0]
-                genes.add(gene)
-            args.genotype_gene_list = list(genes)
-        else:
-            args.genotype_gene_list = args.genotype_gene_list.split(',')
-
-        if len(args.genotype_gene_list) == 0:
-            print("Error: please specify --genotype-gene-list.", file=sys.stderr)
+    regions = []
+    if args.regions != "":
+        try:
+            regions = parse_regions(args.regions)
+        except ValueError as e:
+            print("Error: %s" % e, file=sys.stderr)
             sys.exit(1)
 
+    # An empty gene list with --genotype-vcf means the genes in its GENEINFO
+    if args.genotype_vcf != "" and args.genotype_gene_list != "":
+        args.genotype_gene_list = args.genotype_gene_list.split(',')
     else:
         args.genotype_gene_list = []
 
@@ -919,5 +1375,8 @@ if __name__ == '__main__':
          args.reference_type,
          args.genotype_vcf,
          args.genotype_gene_list,
-         args.extra_files,         
+         args.extra_files,
+         regions,
+         args.cache_dir,
+         args.threads,
          args.verbose)
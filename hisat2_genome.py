@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+
+#
+# Copyright 2015, Daehwan Kim <infphilo@gmail.com>
+#
+# This file is part of HISAT 2.
+#
+# HISAT 2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# HISAT 2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with HISAT 2.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+# Shared genome access for the HISAT2 Python tools.
+#
+# read_genome() returns a dict of chromosome name -> sequence, just like the
+# loaders that used to live in every script.  When the genome is a plain
+# FASTA file on disk, the sequences are lazy ChrSeq objects backed by a
+# memory-mapped file and a samtools-compatible .fai index, so only the bases
+# that are actually sliced are ever read.  Other inputs (stdin, pipes, FASTA
+# files with irregular line lengths) fall back to loading into memory.
+# The evaluation scripts still run under Python 2, so keep this module
+# compatible with both.
+
+from __future__ import print_function
+import os, sys, mmap
+from collections import OrderedDict
+
+
+"""
+"""
+def _to_str(s):
+    if isinstance(s, str):
+        return s
+    return s.decode("latin-1")
+
+
+"""
+Lazy chromosome sequence that supports len(), indexing and slicing
+"""
+class ChrSeq(object):
+    def __init__(self, mm, length, offset, line_bases, line_width):
+        self.mm = mm
+        self.length = length
+        self.offset = offset
+        self.line_bases = line_bases
+        self.line_width = line_width
+
+    def __len__(self):
+        return self.length
+
+    def file_offset(self, pos):
+        return self.offset + \
+            (pos // self.line_bases) * self.line_width + \
+            pos % self.line_bases
+
+    def fetch(self, start, end):
+        if start >= end:
+            return ""
+        seq = self.mm[self.file_offset(start):self.file_offset(end - 1) + 1]
+        if end - start != len(seq):
+            seq = seq.replace(b"\n", b"").replace(b"\r", b"")
+        return _to_str(seq)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, end, step = key.indices(self.length)
+            if step != 1:
+                return self.fetch(0, self.length)[key]
+            return self.fetch(start, end)
+        if key < 0:
+            key += self.length
+        if key < 0 or key >= self.length:
+            raise IndexError("sequence index out of range")
+        return self.fetch(key, key + 1)
+
+    def __str__(self):
+        return self.fetch(0, self.length)
+
+
+"""
+Scan a FASTA file and return a list of [name, length, offset, line_bases, line_width]
+in the .fai layout used by samtools faidx
+"""
+def build_fai(fasta_fname):
+    fai = []
+    with open(fasta_fname, "rb") as fasta_file:
+        offset = 0
+        entry, short_line = None, False
+        for line in fasta_file:
+            if line.startswith(b">"):
+                if entry:
+                    fai.append(entry)
+                name = _to_str(line[1:].strip().split()[0])
+                entry = [name, 0, offset + len(line), 0, 0]
+                short_line = False
+            elif entry:
+                bases = len(line.rstrip(b"\r\n"))
+                if bases > 0:
+                    if short_line:
+                        raise ValueError("%s has lines of different lengths in %s" % (fasta_fname, entry[0]))
+                    if entry[3] == 0:
+                        entry[3], entry[4] = bases, len(line)
+                    elif bases > entry[3]:
+                        raise ValueError("%s has lines of different lengths in %s" % (fasta_fname, entry[0]))
+                    entry[1] += bases
+                if bases < entry[3] or bases == 0:
+                    short_line = True
+            offset += len(line)
+        if entry:
+            fai.append(entry)
+    return fai
+
+
+"""
+"""
+def read_fai(fai_fname):
+    fai = []
+    with open(fai_fname) as fai_file:
+        for line in fai_file:
+            fields = line.rstrip("\r\n").split("\t")
+            if len(fields) < 5:
+                raise ValueError("%s is not a valid FASTA index" % fai_fname)
+            fai.append([fields[0]] + [int(f) for f in fields[1:5]])
+    return fai
+
+
+"""
+Load the .fai index next to fasta_fname, building (and trying to save) it if missing or stale
+"""
+def load_fai(fasta_fname):
+    fai_fname = fasta_fname + ".fai"
+    if os.path.exists(fai_fname) and \
+            os.path.getmtime(fai_fname) >= os.path.getmtime(fasta_fname):
+        return read_fai(fai_fname)
+
+    fai = build_fai(fasta_fname)
+    try:
+        with open(fai_fname, "w") as fai_file:
+            for name, length, offset, line_bases, line_width in fai:
+                fai_file.write("%s\t%d\t%d\t%d\t%d\n" % (name, length, offset, line_bases, line_width))
+    except (IOError, OSError):
+        pass
+    return fai
+
+
+"""
+Old-style loader that keeps every chromosome in memory
+"""
+def read_genome_in_memory(genome_file):
+    chr_dic = OrderedDict()
+    chr_name, sequence = "", []
+    for line in genome_file:
+        line = _to_str(line)
+        if line.startswith(">"):
+            if chr_name and sequence:
+                chr_dic[chr_name] = "".join(sequence)
+            chr_name = line.strip().split()[0][1:]
+            sequence = []
+        else:
+            sequence.append(line.strip())
+    if chr_name and sequence:
+        chr_dic[chr_name] = "".join(sequence)
+    return chr_dic
+
+
+"""
+Return a dict of chromosome name -> sequence.
+genome_file is either a filename or an open file object.
+"""
+def read_genome(genome_file):
+    if isinstance(genome_file, str):
+        fasta_fname = genome_file
+    else:
+        fasta_fname = getattr(genome_file, "name", "")
+
+    fai = None
+    if fasta_fname and os.path.isfile(fasta_fname) and \
+            not fasta_fname.endswith(".gz") and \
+            os.path.getsize(fasta_fname) > 0:
+        try:
+            fai = load_fai(fasta_fname)
+        except ValueError as e:
+            print("Warning: %s; loading the genome into memory" % e, file=sys.stderr)
+
+    if fai is None:
+        if isinstance(genome_file, str):
+            with open(genome_file) as fp:
+                return read_genome_in_memory(fp)
+        return read_genome_in_memory(genome_file)
+
+    with open(fasta_fname, "rb") as fasta_file:
+        mm = mmap.mmap(fasta_file.fileno(), 0, access=mmap.ACCESS_READ)
+    chr_dic = OrderedDict()
+    for name, length, offset, line_bases, line_width in fai:
+        if length <= 0:
+            continue
+        chr_dic[name] = ChrSeq(mm, length, offset, line_bases, line_width)
+    return chr_dic
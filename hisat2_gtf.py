@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+
+#
+# Copyright 2015, Daehwan Kim <infphilo@gmail.com>
+#
+# This file is part of HISAT 2.
+#
+# HISAT 2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# HISAT 2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with HISAT 2.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+# Streaming GTF reader shared by hisat2_extract_splice_sites.py and
+# hisat2_extract_exons.py.  Only exon rows are kept, only gene_id and
+# transcript_id are parsed out of the attribute column, and exon
+# coordinates are stored in per-chromosome arrays rather than in lists
+# of lists, so one pass over the GTF serves both splice sites and exons.
+
+import re
+from sys import stderr
+from array import array
+from collections import defaultdict as dd, Counter
+
+
+gene_id_re = re.compile(r'(?:^|;)\s*gene_id\s+"?([^";]*)"?')
+transcript_id_re = re.compile(r'(?:^|;)\s*transcript_id\s+"?([^";]*)"?')
+
+
+"""
+Exon coordinates (1-based, as in the GTF file) grouped by chromosome
+"""
+class GTFExons:
+    def __init__(self):
+        self.genes = dd(list)
+        self.trans_ids = []
+        self.trans_info = []    # [chrom, strand] by transcript index
+        self.trans_index = {}
+        self.chr_exons = {}     # chrom -> [transcript index, left, right] arrays
+
+    def add_exon(self, chrom, strand, left, right, gene_id, transcript_id):
+        t = self.trans_index.get(transcript_id)
+        if t is None:
+            t = len(self.trans_ids)
+            self.trans_index[transcript_id] = t
+            self.trans_ids.append(transcript_id)
+            self.trans_info.append([chrom, strand])
+            self.genes[gene_id].append(transcript_id)
+        else:
+            chrom = self.trans_info[t][0]
+
+        exons = self.chr_exons.get(chrom)
+        if exons is None:
+            exons = self.chr_exons[chrom] = [array('L'), array('L'), array('L')]
+        exons[0].append(t)
+        exons[1].append(left)
+        exons[2].append(right)
+
+    def num_transcripts(self):
+        return len(self.trans_ids)
+
+    """
+    Yield [chrom, strand, exons] for each transcript with its exons sorted
+    and merged where separating introns are <=5 bps
+    """
+    def transcripts(self):
+        for chrom, (trans, lefts, rights) in self.chr_exons.items():
+            # Sort by (transcript, left, right) through a single packed key
+            keys = [(t << 64) | (l << 32) | r for t, l, r in zip(trans, lefts, rights)]
+            keys.sort()
+
+            cur_t, exons = -1, []
+            for key in keys:
+                t, left, right = key >> 64, (key >> 32) & 0xffffffff, key & 0xffffffff
+                if t != cur_t:
+                    if exons:
+                        yield self.trans_info[cur_t][0], self.trans_info[cur_t][1], exons
+                    cur_t, exons = t, [[left, right]]
+                elif left - exons[-1][1] <= 5:
+                    exons[-1][1] = right
+                else:
+                    exons.append([left, right])
+            if exons:
+                yield self.trans_info[cur_t][0], self.trans_info[cur_t][1], exons
+
+
+"""
+Parse valid exon lines from the GTF file
+"""
+def read_gtf_exons(gtf_file):
+    gtf = GTFExons()
+    for line in gtf_file:
+        if not line or line[0] == '#':
+            continue
+        if '#' in line:
+            line = line.split('#')[0]
+        line = line.strip()
+
+        fields = line.split('\t')
+        if len(fields) != 9 or fields[2] != 'exon':
+            continue
+        chrom, source, feature, left, right, score, \
+            strand, frame, values = fields
+        try:
+            left, right = int(left), int(right)
+        except ValueError:
+            continue
+        if left >= right:
+            continue
+
+        gene_id = gene_id_re.search(values)
+        transcript_id = transcript_id_re.search(values)
+        if not gene_id or not transcript_id:
+            continue
+
+        gtf.add_exon(chrom, strand, left, right, gene_id.group(1), transcript_id.group(1))
+
+    return gtf
+
+
+"""
+"""
+def get_splice_sites(gtf):
+    junctions = set()
+    for chrom, strand, exons in gtf.transcripts():
+        for i in range(1, len(exons)):
+            junctions.add((chrom, exons[i-1][1], exons[i][0], strand))
+    return sorted(junctions)
+
+
+"""
+"""
+def get_exons(gtf):
+    tmp_exons = set()
+    for chrom, strand, texons in gtf.transcripts():
+        for left, right in texons:
+            tmp_exons.add((chrom, left, right, strand))
+    tmp_exons = sorted(tmp_exons)
+    if len(tmp_exons) <= 0:
+        return []
+
+    exons = [tmp_exons[0]]
+    for exon in tmp_exons[1:]:
+        prev_exon = exons[-1]
+        if exon[0] != prev_exon[0]:
+            exons.append(exon)
+            continue
+        assert prev_exon[1] <= exon[1]
+        if prev_exon[2] < exon[1]:
+            exons.append(exon)
+            continue
+
+        if prev_exon[2] < exon[2]:
+            strand = prev_exon[3]
+            if strand not in "+-":
+                strand = exon[3]
+            exons[-1] = (prev_exon[0], prev_exon[1], exon[2], strand)
+    return exons
+
+
+"""
+"""
+def print_splice_sites(junctions, out_file=None):
+    for chrom, left, right, strand in junctions:
+        # Zero-based offset
+        print('{}\t{}\t{}\t{}'.format(chrom, left-1, right-1, strand), file=out_file)
+
+
+"""
+"""
+def print_exons(exons, out_file=None):
+    for chrom, left, right, strand in exons:
+        # Zero-based offset
+        print('{}\t{}\t{}\t{}'.format(chrom, left-1, right-1, strand), file=out_file)
+
+
+"""
+"""
+def print_stats(gtf):
+    exon_lengths, intron_lengths, trans_lengths = \
+        Counter(), Counter(), Counter()
+    for chrom, strand, exons in gtf.transcripts():
+        tran_len = 0
+        for i, exon in enumerate(exons):
+            exon_len = exon[1]-exon[0]+1
+            exon_lengths[exon_len] += 1
+            tran_len += exon_len
+            if i == 0:
+                continue
+            intron_lengths[exon[0] - exons[i-1][1]] += 1
+        trans_lengths[tran_len] += 1
+
+    num_trans = gtf.num_transcripts()
+    genes = gtf.genes
+    print('genes: {}, genes with multiple isoforms: {}'.format(
+            len(genes), sum(len(v) > 1 for v in genes.values())),
+          file=stderr)
+    print('transcripts: {}, transcript avg. length: {:.0f}'.format(
+            num_trans, sum(trans_lengths.elements())//num_trans),
+          file=stderr)
+    print('exons: {}, exon avg. length: {:.0f}'.format(
+            sum(exon_lengths.values()),
+            sum(exon_lengths.elements())//sum(exon_lengths.values())),
+          file=stderr)
+    print('introns: {}, intron avg. length: {:.0f}'.format(
+            sum(intron_lengths.values()),
+            sum(intron_lengths.elements())//sum(intron_lengths.values())),
+          file=stderr)
+    print('average number of exons per transcript: {:.0f}'.format(
+            sum(exon_lengths.values())//num_trans),
+          file=stderr)
+
+
+"""
+Write <base_fname>.exon and <base_fname>.ss from a single pass over the GTF file
+"""
+def extract_exons_and_splice_sites(gtf_file, base_fname, verbose=False):
+    gtf = read_gtf_exons(gtf_file)
+    with open(base_fname + ".exon", 'w') as exon_file:
+        print_exons(get_exons(gtf), exon_file)
+    with open(base_fname + ".ss", 'w') as ss_file:
+        print_splice_sites(get_splice_sites(gtf), ss_file)
+    if verbose:
+        print_stats(gtf)
@@ -28,6 +28,7 @@
 #include "reference.h"
 #include "ds.h"
 #include "alt.h"
+#include "index_summary.h"
 
 using namespace std;
 
@@ -579,68 +580,9 @@ static void print_index_summary(
 	const string& fname,
 	ostream& fout)
 {
-    int major, minor;
-    string extra_version;
-	int32_t flags = GFM<index_t>::readVersionFlags(fname, major, minor, extra_version);
-	bool entireReverse = false;    
-    ALTDB<index_t> altdb;
-	GFM<index_t> gfm(
-                     fname,
-                     &altdb,
-                     NULL,
-                     NULL,
-                     -1,                   // don't require entire reverse
-                     true,                 // index is for the forward direction
-                     -1,                   // offrate (-1 = index default)
-                     0,                    // offrate-plus (0 = index default)
-                     false,                // use memory-mapped IO
-                     false,                // use shared memory
-                     false,                // sweep memory-mapped memory
-                     true,                 // load names?
-                     false,                // load SA sample?
-                     false,                // load ftab?
-                     false,                // load rstarts?
-                     true,                 // load splice sites?
-                     verbose,              // be talkative?
-                     verbose,              // be talkative at startup?
-                     false,                // pass up memory exceptions?
-                     false,                // sanity check?
-                     false);               // use haplotypes?
-	EList<string> p_refnames;
-	readEbwtRefnames<index_t>(fname, p_refnames);
-    cout << "Index version" << "\t2." << major << '.' << minor;
-    if(extra_version != "") {
-        cout << "-" << extra_version;
-    }
-    cout << endl;
-	cout << "Flags" << '\t' << (-flags) << endl;
-	cout << "2.0-compatible" << '\t' << (entireReverse ? "1" : "0") << endl;
-	cout << "SA-Sample" << "\t1 in " << (1 << gfm.gh().offRate()) << endl;
-	cout << "FTab-Chars" << '\t' << gfm.gh().ftabChars() << endl;
-	assert_eq(gfm.nPat(), p_refnames.size());
-	for(size_t i = 0; i < p_refnames.size(); i++) {
-		cout << "Sequence-" << (i+1)
-		     << '\t' << p_refnames[i].c_str()
-		     << '\t' << gfm.plen()[i]
-		     << endl;
-	}
-    index_t numSnps = 0, numSpliceSites = 0, numExons = 0;
-    const EList<ALT<index_t> >& alts = altdb.alts();
-    for(size_t i = 0; i < alts.size(); i++) {
-        const ALT<index_t>& alt = alts[i];
-        if(alt.snp()) {
-            numSnps++;
-        } else if(alt.splicesite()) {
-            if(alt.left < alt.right) {
-                numSpliceSites++;
-            }
-        } else if(alt.exon()) {
-            numExons++;
-        }
-    }
-    cout << "Num. SNPs: " << numSnps << endl;
-    cout << "Num. Splice Sites: " << numSpliceSites << endl;
-    cout << "Num. Exons: " << numExons << endl;
+	IndexSummary<index_t> summary;
+	summary.read(fname, verbose);
+	summary.print(fout);
 }
 
 extern void initializeCntLut();
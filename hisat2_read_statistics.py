@@ -19,7 +19,11 @@
 # along with HISAT 2.  If not, see <http://www.gnu.org/licenses/>.
 #
 
-import os, sys, math, gzip, bz2
+import os, sys, math, bz2, zlib, struct, queue, threading, re, json, hashlib
+from collections import Counter
+from itertools import repeat
+from operator import methodcaller, itemgetter, add, mul, floordiv
+from hisat2_bgzf import BGZF_MAGIC, BGZFReader, inflate_block, is_bgzf
 from argparse import ArgumentParser, FileType
 """
 """
@@ -35,82 +39,214 @@ FASTA_EXTENSIONS = ["fa", "fasta", "fna"]
 FASTQ_EXTENSIONS = ["fq", "fastq"]
 
 MAX_SKIP_LINES = 10000
-"""
-"""
-def parser_FQ(fp):
-    # skip empty line
-    skip_line_count = 0
-    while skip_line_count < MAX_SKIP_LINES:
-        line = fp.readline()
 
-        if line == "":
-            # end of file
-            return
+# --sample: number of evenly spaced positions, and bytes first read at each
+SAMPLE_POSITIONS = 64
+SAMPLE_CHUNK_SIZE = 1 << 18
 
-        if line[0] == '@':
-            break
-
-        skip_line_count += 1
+# --profile: reads sampled for the duplicate rate and 5' k-mers, and k-mer size
+PROFILE_SAMPLE_READS = 1000000
+PROFILE_KMER_LEN = 10
 
-    if skip_line_count == MAX_SKIP_LINES:
-        raise ValueError("Invalid file format")
+# Size of the (compressed) blocks read at a time
+BLOCK_SIZE = 1 << 22
 
-    while True:
-        id = line[1:].split()[0]
-        seq = ""
+"""
+Decompressed blocks of a read file.  Decompression runs on a separate thread
+(zlib and bz2 release the GIL), so it overlaps with scanning the blocks.
+"""
+class BlockReader:
+    def __init__(self, fname, compression_type):
+        self.fp = open(fname, 'rb')
+        self.compression_type = compression_type
+        self.queue = queue.Queue(4)
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def new_decompressor(self):
+        if self.compression_type == COMPRESSION_GZIP:
+            return zlib.decompressobj(16 + zlib.MAX_WBITS)
+        assert self.compression_type == COMPRESSION_BZIP2
+        return bz2.BZ2Decompressor()
+
+    def run(self):
+        try:
+            decompressor = None
+            consumed = False
+            if self.compression_type != COMPRESSION_NON:
+                decompressor = self.new_decompressor()
+            while not self.stop.is_set():
+                data = self.fp.read(BLOCK_SIZE)
+                if not data:
+                    break
+                if not decompressor:
+                    self.queue.put(data)
+                    continue
+                while data:
+                    # Concatenated gzip members or bzip2 streams
+                    if decompressor.eof:
+                        decompressor = self.new_decompressor()
+                    out = decompressor.decompress(data)
+                    if out:
+                        self.queue.put(out)
+                    data = b""
+                    if decompressor.eof:
+                        data = decompressor.unused_data
+                    consumed = True
+            if consumed and not decompressor.eof and not self.stop.is_set():
+                raise EOFError("Compressed file ended before the end-of-stream marker was reached")
+            self.queue.put(None)
+        except Exception as e:
+            self.queue.put(e)
+
+    def __iter__(self):
+        while True:
+            data = self.queue.get()
+            if data is None:
+                return
+            if isinstance(data, Exception):
+                raise data
+            yield data
+
+    def close(self):
+        self.stop.set()
+        while self.thread.is_alive():
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                self.thread.join(0.01)
+        self.fp.close()
 
-        line = fp.readline()
-        if line == "":
-            return
 
-        seq = line.strip()
-        yield id, seq
+"""
+Lists of complete lines (without newlines) from blocks.
+Trailing empty lines are held back until more lines follow, so they are never
+taken for records at the end of a file.
+"""
+def block_lines(blocks):
+    rest, blanks = b"", 0
+    for data in blocks:
+        if b"\r" in data:
+            data = data.replace(b"\r", b"")
+        lines = data.split(b"\n")
+        lines[0] = rest + lines[0]
+        rest = lines.pop()
+        n = len(lines)
+        while n > 0 and not lines[n - 1]:
+            n -= 1
+        if n == 0:
+            blanks += len(lines)
+            continue
+        trailing = len(lines) - n
+        del lines[n:]
+        if blanks:
+            lines[0:0] = [b""] * blanks
+        blanks = trailing
+        yield lines
+
+    if rest:
+        yield [b""] * blanks + [rest]
 
-        line = fp.readline()  # '+'
-        line = fp.readline()  # quality
-        line = fp.readline()  # next ID
-        if line == "":
-            return
 
 """
+Skip lines up to the first one starting with marker
 """
-def parser_FA(fp):
-    # skip empty line
+def skip_lines(lines_iter, marker):
     skip_line_count = 0
-    while skip_line_count < MAX_SKIP_LINES:
-        line = fp.readline()
+    for lines in lines_iter:
+        for i in range(len(lines)):
+            if lines[i].startswith(marker):
+                yield lines[i:]
+                yield from lines_iter
+                return
+            skip_line_count += 1
+            if skip_line_count >= MAX_SKIP_LINES:
+                raise ValueError("Invalid file format")
 
-        if line == "":
-            # end of file
-            return
 
-        if line[0] == '>':
-            break
-
-        skip_line_count += 1
-
-    if skip_line_count == MAX_SKIP_LINES:
-        raise ValueError("Invalid file format")
+"""
+Lists of read lengths of FASTQ records (4 lines each)
+"""
+def parser_FQ(blocks):
+    phase = 0  # line of the current record that starts the block
+    for lines in skip_lines(block_lines(blocks), b'@'):
+        yield list(map(len, lines[(1 - phase) % 4::4]))
+        phase = (phase + len(lines)) % 4
 
-    while True:
-        id = line[1:].split()[0]
-        seq = ""
 
-        while True:
-            line = fp.readline()
-            if line == "":
-                break
+"""
+Lists of read lengths of FASTA records, whose sequences may span several lines
+"""
+def parser_FA(blocks):
+    is_header = methodcaller("startswith", b'>')
+    seq_len = None  # length of the current record so far
+    for lines in skip_lines(block_lines(blocks), b'>'):
+        lengths = []
+        # Single-line records: headers and sequences alternate
+        if len(lines) % 2 == 0 and \
+                all(map(is_header, lines[0::2])) and \
+                not any(map(is_header, lines[1::2])):
+            if seq_len is not None:
+                lengths.append(seq_len)
+            lengths.extend(map(len, lines[1::2]))
+            # The last sequence may go on in the next block
+            seq_len = lengths.pop()
+        else:
+            for line in lines:
+                if line.startswith(b'>'):
+                    if seq_len is not None:
+                        lengths.append(seq_len)
+                    seq_len = 0
+                else:
+                    seq_len += len(line.strip())
+        yield lengths
 
-            if line[0] == '>':
-                break
+    if seq_len is not None:
+        yield [seq_len]
 
-            seq += line.strip()
 
-        yield id, seq
+"""
+Header, sequence and quality lines of FASTQ records, as lists per block.
+A record may be split between blocks, so the lists of a block need not line up.
+"""
+def records_FQ(blocks):
+    phase = 0
+    for lines in skip_lines(block_lines(blocks), b'@'):
+        yield lines[-phase % 4::4], lines[(1 - phase) % 4::4], lines[(3 - phase) % 4::4]
+        phase = (phase + len(lines)) % 4
 
-        if line == "":
-            return
 
+"""
+Header and sequence lines of FASTA records, as lists per block (no qualities)
+"""
+def records_FA(blocks):
+    is_header = methodcaller("startswith", b'>')
+    seq_parts = None  # lines of the current record so far
+    for lines in skip_lines(block_lines(blocks), b'>'):
+        if len(lines) % 2 == 0 and \
+                all(map(is_header, lines[0::2])) and \
+                not any(map(is_header, lines[1::2])):
+            seqs = lines[1::2]
+            if seq_parts is not None:
+                seqs.insert(0, b"".join(seq_parts))
+            seq_parts = [seqs.pop()]
+            yield lines[0::2], seqs, []
+        else:
+            headers, seqs = [], []
+            for line in lines:
+                if line.startswith(b'>'):
+                    headers.append(line)
+                    if seq_parts is not None:
+                        seqs.append(b"".join(seq_parts))
+                    seq_parts = []
+                else:
+                    seq_parts.append(line.strip())
+            yield headers, seqs, []
+
+    if seq_parts is not None:
+        yield [], [b"".join(seq_parts)], []
 
 """
 """
@@ -163,44 +299,194 @@ def generate_stats(length_map):
     return cnt, mn, mx, avg
 
 """
+Read lengths of up to batch FASTQ records in data, which starts at an arbitrary
+position unless at_begin, and the number of bytes these records take
 """
-def reads_stat(read_file, read_count):
-    length_map = {}
-    try:
-        sequence_type, compression_type = parse_type(read_file)
+def sample_chunk_FQ(data, batch, at_begin, at_end):
+    lines = data.split(b"\n")
+    # Complete lines only
+    first, last = (0 if at_begin else 1), len(lines) - 1
+    if at_end and lines[-1]:
+        last += 1
+
+    # Resynchronize on a header line: @, sequence, + and a quality of the same length
+    i = first
+    while i + 3 < last:
+        if lines[i].startswith(b'@') and lines[i+2].startswith(b'+') and \
+                len(lines[i+1]) == len(lines[i+3]):
+            break
+        i += 1
+
+    lengths, nbytes = [], 0
+    while i + 3 < last and len(lengths) < batch and lines[i].startswith(b'@'):
+        lengths.append(len(lines[i+1].rstrip(b"\r")))
+        nbytes += len(lines[i]) + len(lines[i+1]) + len(lines[i+2]) + len(lines[i+3]) + 4
+        i += 4
+    return lengths, nbytes
 
-        if compression_type == COMPRESSION_GZIP:
-            fp = gzip.open(read_file, 'rt')
-        elif compression_type == COMPRESSION_BZIP2:
-            fp = bz2.open(read_file, 'rt')
+
+"""
+Same as sample_chunk_FQ for FASTA records; a record counts only if its end is in data
+"""
+def sample_chunk_FA(data, batch, at_begin, at_end):
+    lines = data.split(b"\n")
+    first, last = (0 if at_begin else 1), len(lines) - 1
+    if at_end:
+        last += 1
+
+    i = first
+    while i < last and not lines[i].startswith(b'>'):
+        i += 1
+
+    lengths, nbytes = [], 0
+    seq_len, rec_bytes = None, 0
+    for line in lines[i:last]:
+        if line.startswith(b'>'):
+            if seq_len is not None:
+                lengths.append(seq_len)
+                nbytes += rec_bytes
+                if len(lengths) >= batch:
+                    return lengths, nbytes
+            seq_len, rec_bytes = 0, 0
         else:
-            assert (compression_type == COMPRESSION_NON)
-            fp = open(read_file, 'r')
+            seq_len += len(line.strip())
+        rec_bytes += len(line) + 1
+    if at_end and seq_len is not None:
+        lengths.append(seq_len)
+        nbytes += rec_bytes
+    return lengths, nbytes
+
+
+"""
+Uncompressed data from the first BGZF block at or after offset, at least size bytes
+if not at the end.  Returns (data, at begin, at end, compressed bytes read).
+"""
+def read_bgzf_chunk(reader, offset, size):
+    fp = reader.fp
+    # Look for a block header (BGZF blocks are at most 64 KB) followed by another
+    # one or the end of the file, so that compressed data is not taken for one
+    fp.seek(offset)
+    window = fp.read(1 << 17)
+    coffset = None
+    i = window.find(BGZF_MAGIC)
+    while 0 <= i and i + 18 <= len(window):
+        if window[i+10:i+14] == b"\x06\x00BC":
+            next_i = i + struct.unpack("<H", window[i+16:i+18])[0] + 1
+            if next_i >= len(window) or window[next_i:next_i+4] == BGZF_MAGIC:
+                coffset = offset + i
+                break
+        i = window.find(BGZF_MAGIC, i + 1)
+    if coffset is None:
+        return b"", offset == 0, True, 0
+
+    fp.seek(coffset)
+    datas, total, at_end = [], 0, False
+    while total < size:
+        block = reader.read_raw_block()
+        if block is None:
+            at_end = True
+            break
+        data = inflate_block(block)
+        datas.append(data)
+        total += len(data)
+    if not at_end and fp.read(1) == b"":
+        at_end = True
+    return b"".join(datas), coffset == 0, at_end, fp.tell() - coffset
+
+
+"""
+Sample read lengths at SAMPLE_POSITIONS evenly spaced offsets of a plain or BGZF file,
+taking about read_count reads in all.  Each sampled read stands for the reads of
+its share of the file, estimated from the bytes its batch takes, so regions with
+longer reads are not over-represented.  Returns the estimated number of reads of
+each length in the file.
+"""
+def sample_lengths(read_file, sequence_type, bgzf, read_count):
+    if sequence_type == SEQUENCE_FASTA:
+        sample_chunk = sample_chunk_FA
+    else:
+        sample_chunk = sample_chunk_FQ
+    file_size = os.path.getsize(read_file)
+    batch = max(1, (read_count + SAMPLE_POSITIONS - 1) // SAMPLE_POSITIONS)
+
+    length_map = Counter()
+    range_size = file_size / SAMPLE_POSITIONS
+    reader = BGZFReader(read_file) if bgzf else open(read_file, 'rb')
+    try:
+        for k in range(SAMPLE_POSITIONS):
+            offset = file_size * k // SAMPLE_POSITIONS
+            # Read more at a position whose records (e.g. long reads) do not fit
+            chunk_size = SAMPLE_CHUNK_SIZE
+            while True:
+                if bgzf:
+                    data, at_begin, at_end, cbytes = read_bgzf_chunk(reader, offset, chunk_size)
+                else:
+                    reader.seek(offset)
+                    data = reader.read(chunk_size)
+                    at_begin, at_end, cbytes = offset == 0, offset + len(data) >= file_size, len(data)
+                lengths, nbytes = sample_chunk(data, batch, at_begin, at_end)
+                if lengths or at_end or chunk_size >= (1 << 24):
+                    break
+                chunk_size *= 4
+            if not lengths:
+                continue
+            # Uncompressed bytes in this position's share of the file
+            data_size = range_size
+            if bgzf:
+                data_size *= len(data) / cbytes
+            weight = data_size / nbytes
+            for length in lengths:
+                length_map[length] += weight
+    finally:
+        reader.close()
+
+    return length_map
+
+
+"""
+"""
+def reads_stat(read_file, read_count, sample=False):
+    length_map = Counter()
+    sampled = False
+    try:
+        sequence_type, compression_type = parse_type(read_file)
 
         if sequence_type == SEQUENCE_FASTA:
-            fstream = parser_FA(fp)
+            parser = parser_FA
         elif sequence_type == SEQUENCE_FASTQ:
-            fstream = parser_FQ(fp)
+            parser = parser_FQ
         else:
             raise ValueError("Unsupported file format")
 
-        cnt = 0
-        for id, seq in fstream:
-            l = len(seq)
-            if l in length_map:
-                length_map[l] += 1
-            else:
-                length_map[l] = 1
-
-            cnt += 1
-            if read_count > 0 and cnt >= read_count:
-                break
-
-        fp.close()
+        # Sampling needs random access: plain or BGZF files larger than what it would read.
+        # Otherwise the whole file is read.
+        bgzf = compression_type == COMPRESSION_GZIP and is_bgzf(read_file)
+        if sample and read_count > 0 and \
+                (compression_type == COMPRESSION_NON or bgzf) and \
+                os.path.getsize(read_file) > SAMPLE_POSITIONS * SAMPLE_CHUNK_SIZE:
+            length_map = sample_lengths(read_file, sequence_type, bgzf, read_count)
+            sampled = True
+        else:
+            if sample:
+                read_count = 0
+            fp = BlockReader(read_file, compression_type)
+            try:
+                cnt = 0
+                for lengths in parser(fp):
+                    if read_count > 0 and cnt + len(lengths) >= read_count:
+                        length_map.update(lengths[:read_count - cnt])
+                        break
+                    length_map.update(lengths)
+                    cnt += len(lengths)
+            finally:
+                fp.close()
 
     except BaseException as e:
         print("Warning: {}".format(e), file=sys.stderr)
 
+    if sampled:
+        # Estimated (fractional) counts
+        length_map = Counter(dict((k, int(round(v))) for k, v in length_map.items() if round(v) > 0))
     cnt, mn, mx, avg =  generate_stats(length_map)
     # sort by (read count, read length)
     length_map = sorted(length_map.items(), key=lambda t: (t[1], t[0]), reverse=True)
@@ -209,6 +495,179 @@ def reads_stat(read_file, read_count):
     print(cnt, mn, mx, avg, ",".join([str(k) for (k,v) in length_map]))
 
 
+
+"""
+Quality encoding from the range of quality characters: phred33, phred64 or solexa
+(Solexa+64 goes down to ';').  High Phred+33 qualities alone are taken as phred33.
+"""
+def quality_encoding(min_qual, max_qual):
+    if min_qual > max_qual:
+        return None
+    if min_qual < ord(';'):
+        return "phred33"
+    if max_qual > ord('J'):
+        return "solexa" if min_qual < ord('@') else "phred64"
+    return "phred33"
+
+
+"""
+Read statistics for --profile, gathered block by block
+"""
+class ReadProfile:
+    def __init__(self):
+        self.length_map = Counter()
+        self.bases, self.n_bases, self.gc_bases = 0, 0, 0
+        self.reads_with_n = 0
+        self.gc_map = Counter()  # GC percentage -> number of reads
+        self.min_qual, self.max_qual = 127, 32
+        self.sample_reads = 0
+        self.seq_hashes = set()
+        self.kmers = Counter()
+        self.num_names = 0
+        self.names_digest = hashlib.sha1()
+
+    def add(self, headers, seqs, quals):
+        lengths = list(map(len, seqs))
+        self.length_map.update(lengths)
+        self.bases += sum(lengths)
+
+        seqs = list(map(bytes.upper, seqs))
+        n_counts = list(map(methodcaller("count", b'N'), seqs))
+        self.n_bases += sum(n_counts)
+        self.reads_with_n += len(n_counts) - n_counts.count(0)
+        gc_counts = list(map(add,
+                             map(methodcaller("count", b'G'), seqs),
+                             map(methodcaller("count", b'C'), seqs)))
+        self.gc_bases += sum(gc_counts)
+        self.gc_map.update(map(floordiv, map(mul, gc_counts, repeat(100)), map(max, lengths, repeat(1))))
+
+        # Only look for quality characters outside the range seen so far
+        if quals:
+            qual_str = b"".join(quals)
+            for q in range(33, self.min_qual):
+                if bytes([q]) in qual_str:
+                    self.min_qual = q
+                    break
+            for q in range(126, self.max_qual, -1):
+                if bytes([q]) in qual_str:
+                    self.max_qual = q
+                    break
+
+        # Duplicates and 5' k-mers among the first reads
+        if self.sample_reads < PROFILE_SAMPLE_READS:
+            sample = seqs[:PROFILE_SAMPLE_READS - self.sample_reads]
+            self.sample_reads += len(sample)
+            self.seq_hashes.update(map(hash, sample))
+            self.kmers.update(map(itemgetter(slice(0, PROFILE_KMER_LEN)), sample))
+
+        # Digest of read names without comments and /1, /2 suffixes
+        if headers:
+            self.num_names += len(headers)
+            names = b"\n".join(headers) + b"\n"
+            names = re.sub(rb"[ \t][^\n]*", b"", names)
+            names = re.sub(rb"/[12]\n", b"\n", names)
+            self.names_digest.update(names[1:].replace(b"\n@", b"\n").replace(b"\n>", b"\n"))
+
+    def report(self):
+        cnt, mn, mx, avg = generate_stats(self.length_map)
+        report = {"reads": cnt,
+                  "min_length": mn,
+                  "max_length": mx,
+                  "avg_length": avg,
+                  "lengths": dict((str(k), v) for k, v in sorted(self.length_map.items())),
+                  "bases": self.bases,
+                  "n_bases": self.n_bases,
+                  "n_fraction": self.n_bases / max(self.bases, 1),
+                  "reads_with_n": self.reads_with_n,
+                  "gc_fraction": self.gc_bases / max(self.bases, 1),
+                  "gc_histogram": [self.gc_map[i] for i in range(101)],
+                  "quality_encoding": quality_encoding(self.min_qual, self.max_qual),
+                  "duplicate_sample_reads": self.sample_reads,
+                  "duplicate_rate": 1.0 - len(self.seq_hashes) / max(self.sample_reads, 1),
+                  "kmer_length": PROFILE_KMER_LEN,
+                  "top_5prime_kmers": [[kmer.decode(), count / max(self.sample_reads, 1)]
+                                       for kmer, count in self.kmers.most_common(10)]}
+        if self.min_qual <= self.max_qual:
+            report["min_quality_char"] = chr(self.min_qual)
+            report["max_quality_char"] = chr(self.max_qual)
+        return report
+
+
+"""
+Profile the first read_count reads (all if 0) of read_file
+"""
+def profile_file(read_file, read_count):
+    profile = ReadProfile()
+    sequence_type, compression_type = parse_type(read_file)
+    if sequence_type == SEQUENCE_FASTA:
+        records = records_FA
+    elif sequence_type == SEQUENCE_FASTQ:
+        records = records_FQ
+    else:
+        raise ValueError("Unsupported file format")
+
+    fp = BlockReader(read_file, compression_type)
+    try:
+        cnt = 0
+        for headers, seqs, quals in records(fp):
+            if read_count > 0 and cnt + len(seqs) >= read_count:
+                n = read_count - cnt
+                profile.add(headers[:n], seqs[:n], quals[:n])
+                break
+            profile.add(headers, seqs, quals)
+            cnt += len(seqs)
+    finally:
+        fp.close()
+    return profile, sequence_type
+
+
+"""
+Profile read files (the two mates of paired-end reads) concurrently and print
+a JSON report, including hisat2 options matching the reads
+"""
+def reads_profile(read_files, read_count):
+    results = [None] * len(read_files)
+    def run(i):
+        try:
+            results[i] = profile_file(read_files[i], read_count)
+        except BaseException as e:
+            results[i] = e
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(len(read_files))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    report = {"files": []}
+    options = []
+    for read_file, result in zip(read_files, results):
+        if isinstance(result, BaseException):
+            report["files"].append({"file": read_file, "error": str(result)})
+            continue
+        profile, sequence_type = result
+        file_report = {"file": read_file,
+                       "format": "fasta" if sequence_type == SEQUENCE_FASTA else "fastq"}
+        file_report.update(profile.report())
+        report["files"].append(file_report)
+        if sequence_type == SEQUENCE_FASTA:
+            option = "-f"
+        else:
+            option = "--" + {"phred33": "phred33",
+                             "phred64": "phred64",
+                             "solexa": "solexa-quals"}.get(file_report["quality_encoding"], "phred33")
+        if option not in options:
+            options.append(option)
+
+    if len(read_files) == 2 and not any(isinstance(result, BaseException) for result in results):
+        profile1, profile2 = results[0][0], results[1][0]
+        report["paired"] = {"same_count": sum(profile1.length_map.values()) == sum(profile2.length_map.values()),
+                            "same_names": profile1.num_names == profile2.num_names and
+                                          profile1.names_digest.digest() == profile2.names_digest.digest()}
+    report["hisat2_options"] = options
+    print(json.dumps(report, indent=2))
+
+
 if __name__ == '__main__':
 
     parser = ArgumentParser(
@@ -219,12 +678,27 @@ if __name__ == '__main__':
                         type=str,
                         help='reads file')
 
+    parser.add_argument('read_file2',
+                        nargs='?',
+                        type=str,
+                        help='reads file of the second mates (with --profile)')
+
     parser.add_argument('-n',
                         dest='read_count',
                         action='store',
                         type=int,
                         default=10000,
-                        help='reads count (default: 10000)')
+                        help='reads count, 0 for all reads (default: 10000)')
+
+    parser.add_argument('--sample',
+                        dest='sample',
+                        action='store_true',
+                        help='sample about -n reads at evenly spaced positions of the whole file and estimate the number of reads (plain or BGZF files; others are read in full)')
+
+    parser.add_argument('--profile',
+                        dest='profile',
+                        action='store_true',
+                        help='print a JSON profile of the reads (quality encoding, N and GC content, duplicate rate, 5\' k-mers, and for two files whether their records match)')
 
     args = parser.parse_args()
 
@@ -232,5 +706,8 @@ if __name__ == '__main__':
         parser.print_help()
         exit(1)
 
-    reads_stat(args.read_file, args.read_count)
+    if args.profile:
+        reads_profile([f for f in [args.read_file, args.read_file2] if f], args.read_count)
+    else:
+        reads_stat(args.read_file, args.read_count, args.sample)
 
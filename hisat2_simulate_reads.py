@@ -18,37 +18,23 @@
 # along with HISAT 2.  If not, see <http://www.gnu.org/licenses/>.
 #
 
-import os, sys, math, random, re
+import os, sys, math, random, re, hashlib
+import multiprocessing
+from bisect import bisect_left
+from array import array
 from collections import defaultdict, Counter
 from argparse import ArgumentParser, FileType
+import hisat2_genome
+from hisat2_bgzf import OutputFile, COMPRESS_TYPES, open_lines
+from hisat2_variant_cache import VariantCache, VariantCacheWriter, StrColumn, cache_fname
 
 
+complement_table = str.maketrans("ACGTacgt", "TGCAtgca")
+
 """
 """
 def reverse_complement(seq):
-    result = ""
-    for nt in seq:
-        base = nt
-        if nt == 'A':
-            base = 'T'
-        elif nt == 'a':
-            base = 't'
-        elif nt == 'C':
-            base = 'G'
-        elif nt == 'c':
-            base = 'g'
-        elif nt == 'G':
-            base = 'C'
-        elif nt == 'g':
-            base = 'c'
-        elif nt == 'T':
-            base = 'A'
-        elif nt == 't':
-            base = 'a'
-        
-        result = base + result
-    
-    return result
+    return seq.translate(complement_table)[::-1]
 
 
 """
@@ -58,19 +44,65 @@ def myrandint(m, x):
     s = x - m + 1
     return m + int(random.random() * s)
 
+
 """
-Random source for sequencing errors
+python2 style shuffle (random.shuffle no longer takes a random function)
+"""
+def myshuffle(x):
+    for i in reversed(range(1, len(x))):
+        j = int(random.random() * (i + 1))
+        x[i], x[j] = x[j], x[i]
+
+"""
+Random source for sequencing errors.
+
+With a quality profile (see read_quality_profile), each read gets a Phred quality
+string drawn cycle by cycle from the profile, and errors where the drawn quality
+says so; otherwise errors come at a uniform rate and qualities are all 'I'.
 """
 class ErrRandomSource:
-    def __init__(self, prob = 0.0, size = 1 << 20):
+    def __init__(self, prob = 0.0, size = 1 << 20, qual_profile = None):
+        self.cycles = None
+        if qual_profile:
+            # (quality, error) outcomes of each cycle, drawn from one alias table
+            self.cycles = []
+            for qual_counts in qual_profile:
+                outcomes, weights = [], []
+                for qual, count in sorted(qual_counts.items()):
+                    err_prob = 10.0 ** (-qual / 10.0)
+                    outcomes.append((chr(qual + 33), False))
+                    weights.append(count * (1.0 - err_prob))
+                    outcomes.append((chr(qual + 33), True))
+                    weights.append(count * err_prob)
+                self.cycles.append([AliasSampler(weights), outcomes])
+            self.read_errs = []
+            size = 0
+
         self.size = size
-        self.rands = []
-        for i in range(self.size):
-            if random.random() < prob:
-                self.rands.append(1)
-            else:
-                self.rands.append(0)
+        self.rands = [1 if random.random() < prob else 0 for i in range(self.size)]
+        self.err_pos = [i for i in range(self.size) if self.rands[i] == 1]
         self.cur = 0
+
+    """
+    Start a read of read_len bases, returning its quality string in sequencing order.
+    reverse tells that the read is written reverse-complemented,
+    so its last base (in reference order) is the first one sequenced.
+    """
+    def newRead(self, read_len, reverse):
+        if not self.cycles:
+            return "I" * read_len
+        quals, errs = [], []
+        last_cycle = len(self.cycles) - 1
+        for c in range(read_len):
+            sampler, outcomes = self.cycles[min(c, last_cycle)]
+            qual, err = outcomes[sampler.sample()]
+            quals.append(qual)
+            if err:
+                errs.append(c)
+        if reverse:
+            errs = [read_len - 1 - c for c in reversed(errs)]
+        self.read_errs = errs
+        return "".join(quals)
         
     def getRand(self):
         assert self.cur < len(self.rands)
@@ -78,31 +110,87 @@ class ErrRandomSource:
         self.cur = (self.cur + 1) % len(self.rands)
         return rand
 
+    """
+    Same as calling getRand() num times, but returns the (increasing) indexes
+    of the calls that would have returned 1.
+    With a quality profile, returns the errors of the current read among
+    its num bases from read_offset on.
+    """
+    def getErrors(self, num, read_offset = 0):
+        if self.cycles:
+            return [c - read_offset for c in self.read_errs if read_offset <= c < read_offset + num]
+
+        errs, base = [], 0
+        while num > 0:
+            n = min(num, self.size - self.cur)
+            lo = bisect_left(self.err_pos, self.cur)
+            hi = bisect_left(self.err_pos, self.cur + n, lo)
+            for i in range(lo, hi):
+                errs.append(self.err_pos[i] - self.cur + base)
+            base += n
+            num -= n
+            self.cur = (self.cur + n) % self.size
+        return errs
+
 
 """
+Read a quality profile: counts of Phred qualities at each cycle, as a list of
+{quality: count} by cycle.  The file is either FASTQ (Phred+33, possibly gzipped),
+whose first max_reads reads are counted, or a table of cycle (1-based),
+quality and count per line.
 """
-def read_genome(genome_file):
-    chr_dic = {}
-    
-    chr_name, sequence = "", ""
-    for line in genome_file:
-        if line[0] == ">":
-            if chr_name and sequence:
-                chr_dic[chr_name] = sequence
-            chr_name = line.strip().split()[0][1:]
-            sequence = ""
+def read_quality_profile(profile_fname, max_reads = 200000):
+    profile = []
+    def add(cycle, qual, count):
+        while len(profile) <= cycle:
+            profile.append(Counter())
+        profile[cycle][qual] += count
+
+    lines = open_lines(profile_fname)
+    is_fastq, num_reads = None, 0
+    for line_num, line in enumerate(lines):
+        if is_fastq is None:
+            if not line.strip() or line.startswith('#'):
+                continue
+            is_fastq = line.startswith('@')
+            first_line = line_num
+        if is_fastq:
+            if (line_num - first_line) % 4 != 3:
+                continue
+            for cycle, qual in enumerate(line.rstrip('\r\n')):
+                add(cycle, ord(qual) - 33, 1)
+            num_reads += 1
+            if num_reads >= max_reads:
+                break
         else:
-            sequence += line[:-1]
+            if not line.strip() or line.startswith('#'):
+                continue
+            cycle, qual, count = line.split()
+            add(int(cycle) - 1, int(qual), int(count))
+
+    # Cycles without data take the distribution of the previous one
+    for cycle in range(len(profile)):
+        if not profile[cycle]:
+            if cycle == 0:
+                print("Error: no quality values for the first cycle in %s" % profile_fname, file=sys.stderr)
+                sys.exit(1)
+            profile[cycle] = profile[cycle - 1]
+    if not profile:
+        print("Error: no quality values in %s" % profile_fname, file=sys.stderr)
+        sys.exit(1)
+    return profile
 
-    if chr_name and sequence:
-        chr_dic[chr_name] = sequence
 
+"""
+"""
+def read_genome(genome_file):
+    chr_dic = hisat2_genome.read_genome(genome_file)
 
     chr_filter = [str(x) for x in list(range(1, 23)) + ['X', 'Y']]
     #chr_filter = None
 
     if chr_filter:
-        for chr_id, chr_seq in chr_dic.items():
+        for chr_id in list(chr_dic.keys()):
             if not chr_id in chr_filter: 
                 chr_dic.pop(chr_id, None)
     
@@ -174,10 +262,63 @@ def read_transcript(genome_seq, gtf_file, frag_len):
     return genes, transcripts
     
 
+snp_types = ["single", "deletion", "insertion"]
+
 """
+SNPs of one chromosome, sorted by position, as a range [lo, hi) of flat columns:
+pos, end (pos plus the deletion length), type (index into snp_types),
+data (base or inserted sequence) and snp ID.
+Indexing returns [snpID, type, pos, data] as in a .snp file.
 """
-def read_snp(snp_file):
-    snps = defaultdict(list)
+class ChrSNPs:
+    def __init__(self, columns, lo, hi):
+        self.pos, self.end, self.type = columns["pos"], columns["end"], columns["type"]
+        self.data, self.ids = columns["data"], columns["id"]
+        self.lo, self.hi = lo, hi
+
+    def __len__(self):
+        return self.hi - self.lo
+
+    def __getitem__(self, i):
+        i += self.lo
+        type = snp_types[self.type[i]]
+        if type == "deletion":
+            data = self.end[i] - self.pos[i]
+        else:
+            data = self.data[i]
+        return [self.ids[i], type, self.pos[i], data]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+snp_cache_columns = [
+    ("pos", 'q'),
+    ("end", 'q'),
+    ("type", 'B'),
+    ("data", "str"),
+    ("id", "str"),
+]
+
+"""
+Read a .snp file into {chr: ChrSNPs}.  With cache_dir, the columns are also
+written to a cache file there, which later runs memory-map instead of parsing.
+"""
+def read_snp(snp_file, cache_dir=""):
+    snp_fname = getattr(snp_file, "name", "")
+    fname = None
+    if cache_dir and os.path.isfile(snp_fname):
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        fname = cache_fname(cache_dir, snp_fname, ["SNP"])
+        if os.path.exists(fname):
+            cache = VariantCache(fname)
+            return dict((chr, ChrSNPs(cache.columns, lo, hi))
+                        for chr, (lo, hi) in cache.meta["chr_ranges"].items())
+
+    # Per chromosome: pos, end and type arrays, and offsets and heaps of data and IDs
+    chr_cols = {}
     for line in snp_file:
         line = line.strip()
         if not line or line.startswith('#'):
@@ -187,12 +328,56 @@ def read_snp(snp_file):
         except ValueError:
             continue
 
-        assert type in ["single", "deletion", "insertion"]
+        assert type in snp_types
+        pos = int(pos)
+        cols = chr_cols.get(chr)
+        if cols is None:
+            cols = chr_cols[chr] = [array('q'), array('q'), array('B'),
+                                    array('Q', [0]), bytearray(), array('Q', [0]), bytearray()]
+        cols[0].append(pos)
         if type == "deletion":
-            data = int(data)
-        snps[chr].append([snpID, type, int(pos), data])
-
-    return snps
+            cols[1].append(pos + int(data))
+        else:
+            cols[1].append(pos)
+            cols[4] += data.encode()
+        cols[2].append(snp_types.index(type))
+        cols[3].append(len(cols[4]))
+        cols[6] += snpID.encode()
+        cols[5].append(len(cols[6]))
+
+    # Concatenate chromosomes into flat columns, sorting them by position (stable)
+    columns = dict((name, array(kind)) for name, kind in snp_cache_columns if kind != "str")
+    data_offsets, data_heap = array('Q', [0]), bytearray()
+    id_offsets, id_heap = array('Q', [0]), bytearray()
+    chr_ranges = {}
+    for chr, (pos, end, type, d_off, d_heap, i_off, i_heap) in chr_cols.items():
+        lo = len(columns["pos"])
+        order = range(len(pos))
+        if any(pos[i] > pos[i+1] for i in range(len(pos) - 1)):
+            order = sorted(order, key=pos.__getitem__)
+        for i in order:
+            columns["pos"].append(pos[i])
+            columns["end"].append(end[i])
+            columns["type"].append(type[i])
+            data_heap += d_heap[d_off[i]:d_off[i+1]]
+            data_offsets.append(len(data_heap))
+            id_heap += i_heap[i_off[i]:i_off[i+1]]
+            id_offsets.append(len(id_heap))
+        chr_ranges[chr] = [lo, len(columns["pos"])]
+    del chr_cols
+    columns["data"] = StrColumn(bytes(data_heap), data_offsets, 0, True)
+    columns["id"] = StrColumn(bytes(id_heap), id_offsets, 0, True)
+
+    if fname:
+        cache = VariantCacheWriter(fname, snp_cache_columns)
+        cache.meta["chr_ranges"] = chr_ranges
+        for name, kind in snp_cache_columns:
+            column = columns[name]
+            for i in range(len(columns["pos"])):
+                cache.append(name, column[i])
+        cache.close()
+
+    return dict((chr, ChrSNPs(columns, lo, hi)) for chr, (lo, hi) in chr_ranges.items())
 
 
 """
@@ -250,8 +435,10 @@ def sanity_check_input(genome_seq, genes, transcripts, snps, frag_len):
 def generate_rna_expr_profile(expr_profile_type, num_transcripts = 10000):
     # Modelling and simulating generic RNA-Seq experiments with the flux simulator
     # http://nar.oxfordjournals.org/content/suppl/2012/06/29/gks666.DC1/nar-02667-n-2011-File002.pdf
+    # The curve is fitted to 10,000 transcripts; stretch it over more than that
+    scale = max(1.0, num_transcripts / 10000.0)
     def calc_expr(x, a):
-        x, a, b = float(x), 9500.0, 9500.0
+        x, a, b = float(x), 9500.0 * scale, 9500.0 * scale
         k = -0.6
         return (x**k) * math.exp(x/a * (x/b)**2)
     
@@ -270,6 +457,54 @@ def generate_rna_expr_profile(expr_profile_type, num_transcripts = 10000):
     return expr_profile
 
 
+"""
+Read an expression profile from a table of transcript IDs and TPM values, such as
+quant.sf (Salmon), abundance.tsv (kallisto) or isoforms.results (RSEM).  The TPM
+column is found by its name (in any case) in a header line, or is the second column
+without one.  A first line whose second column is not a number is taken as a header.
+Returns the transcript IDs that are in transcripts, and their shares of fragments,
+which are proportional to TPM times transcript length.
+"""
+def read_expr_table(expr_fname, transcripts):
+    transcript_ids, expr_profile = [], []
+    tpm_col, num_unknown = None, 0
+    for line in open(expr_fname):
+        if not line.strip() or line.startswith('#'):
+            continue
+        fields = line.split()
+        if tpm_col is None:
+            names = [field.lower() for field in fields]
+            if "tpm" in names:
+                tpm_col = names.index("tpm")
+                continue
+            tpm_col = 1
+            try:
+                float(fields[tpm_col])
+            except (IndexError, ValueError):
+                continue
+        try:
+            transcript_id, tpm = fields[0], float(fields[tpm_col])
+        except (IndexError, ValueError):
+            print("Error: no TPM value in line of %s: %s" % (expr_fname, line.rstrip()), file=sys.stderr)
+            sys.exit(1)
+        if transcript_id not in transcripts:
+            num_unknown += 1
+            continue
+        if tpm <= 0.0:
+            continue
+        transcript_ids.append(transcript_id)
+        expr_profile.append(tpm * transcripts[transcript_id][2])
+
+    if num_unknown > 0:
+        print("Warning: %d transcripts in %s are not in the GTF file or shorter than the fragment length" % (num_unknown, expr_fname), file=sys.stderr)
+    if not expr_profile:
+        print("Error: no expressed transcripts in %s" % expr_fname, file=sys.stderr)
+        sys.exit(1)
+    expr_sum = sum(expr_profile)
+    expr_profile = [expr / expr_sum for expr in expr_profile]
+    return transcript_ids, expr_profile
+
+
 """
 """
 def generate_dna_expr_profile(genome_seq):
@@ -283,35 +518,23 @@ def generate_dna_expr_profile(genome_seq):
 
 
 """
+SNPs starting in [left, right), up to the first one that ends at or after right,
+leaving out those that overlap the previous one (e.g. a deletion)
 """
 def getSNPs(chr_snps, left, right):
-    low, high = 0, len(chr_snps)
-    while low < high:
-        mid = (low + high) // 2
-        snpID, type, pos, data = chr_snps[mid]
-        if pos < left:
-            low = mid + 1
-        else:
-            high = mid - 1
-
     snps = []
-    for snp in chr_snps[low:]:
-        snpID, type, pos, data = snp
-        pos2 = pos
-        if type == "deletion":
-            pos2 += data
-        if pos2 >= right:
+    if len(chr_snps) == 0:
+        return snps
+    snp_pos, snp_end = chr_snps.pos, chr_snps.end
+    prev_end = -1
+    for i in range(bisect_left(snp_pos, left, chr_snps.lo, chr_snps.hi), chr_snps.hi):
+        pos, end = snp_pos[i], snp_end[i]
+        if end >= right:
             break
-        if pos >= left:
-            if len(snps) > 0:
-                _, prev_type, prev_pos, prev_data = snps[-1]
-                assert prev_pos <= pos
-                prev_pos2 = prev_pos
-                if prev_type == "deletion":
-                    prev_pos2 += prev_data
-                if pos <= prev_pos2:
-                    continue
-            snps.append(snp)
+        if pos <= prev_end:
+            continue
+        snps.append(chr_snps[i - chr_snps.lo])
+        prev_end = end
 
     return snps
 
@@ -373,21 +596,21 @@ def getSamAlignment(rna, exons, chr_seq, trans_seq, frag_pos, read_len, chr_snps
             
         # Simulate mismatches due to sequencing errors
         mms = []
-        for i in range(e_left, min(e[1], e_left + tmp_read_len - 1)):
-            if err_rand_src.getRand() == 1:
-                assert i < len(chr_seq)
-                err_base = "A"
-                #rand = random.randint(0, 2)
-                rand = myrandint(0, 2)
-                if chr_seq[i] == "A":
-                    err_base = "GCT"[rand]
-                elif chr_seq[i] == "C":
-                    err_base = "AGT"[rand]
-                elif chr_seq[i] == "G":
-                    err_base = "ACT"[rand]
-                else:
-                    err_base = "ACG"[rand]                    
-                mms.append(["", "single", i, err_base])
+        for i in err_rand_src.getErrors(min(e[1], e_left + tmp_read_len - 1) - e_left, read_len - tmp_read_len):
+            i += e_left
+            assert i < len(chr_seq)
+            err_base = "A"
+            #rand = random.randint(0, 2)
+            rand = myrandint(0, 2)
+            if chr_seq[i] == "A":
+                err_base = "GCT"[rand]
+            elif chr_seq[i] == "C":
+                err_base = "AGT"[rand]
+            elif chr_seq[i] == "G":
+                err_base = "ACT"[rand]
+            else:
+                err_base = "ACG"[rand]                    
+            mms.append(["", "single", i, err_base])
 
         tmp_diffs = snps + mms
 #        def diff_sort(a , b):
@@ -690,81 +913,42 @@ def samRepOk(genome_seq, read_seq, chr, pos, cigar, XM, NM, MD, Zs, max_mismatch
         
         
 """
+Simulate fragments for pieces of the expression profile, [t, number of fragments] each,
+numbering reads from first_read_id
 """
-def simulate_reads(genome_file, gtf_file, snp_file, base_fname,
-                   rna, paired_end, read_len, frag_len,
-                   num_frag, expr_profile_type, repeat_fname,
-                   error_rate, max_mismatch,
-                   random_seed, snp_prob, sanity_check, verbose):
-    random.seed(random_seed, version=1)
-    err_rand_src = ErrRandomSource(error_rate / 100.0)
-    
-    if read_len > frag_len:
-        frag_len = read_len
-
-    genome_seq = read_genome(genome_file)
-    if rna:
-        genes, transcripts = read_transcript(genome_seq, gtf_file, frag_len)
-    else:
-        genes, transcripts = {}, {}
-    snps = read_snp(snp_file)
-
-    if sanity_check:
-        sanity_check_input(genome_seq, genes, transcripts, snps, frag_len)
-
-    if rna:
-        num_transcripts = min(len(transcripts), 10000)
-        expr_profile = generate_rna_expr_profile(expr_profile_type, num_transcripts)
+def simulate_fragments(pieces, first_read_id,
+                       genome_seq, transcripts, transcript_ids, chr_ids, snps, repeat_loci,
+                       rna, paired_end, read_len, frag_len,
+                       snp_prob, err_rand_src, max_mismatch, sanity_check,
+                       interleave, out_format, sam_file, read_file, read2_file):
+    if out_format == "fastq":
+        read_fmt = "@{}\n{}\n+\n{}\n"
     else:
-        expr_profile = generate_dna_expr_profile(genome_seq)
-
-    expr_profile = [int(expr_profile[i] * num_frag) for i in range(len(expr_profile))]
-    assert num_frag >= sum(expr_profile)
-    while sum(expr_profile) < num_frag:
-        for i in range(min(num_frag - sum(expr_profile), len(expr_profile))):
-            expr_profile[i] += 1
-    assert num_frag == sum(expr_profile)
-    
-    repeat_loci = {}
-    if repeat_fname != "" and os.path.exists(repeat_fname):
-        for line in open(repeat_fname):
-            if line.startswith('>'):
-                continue
-            coords = line.strip().split()
-            for coord in coords:
-                chr, pos, strand = coord.split(':')
-                if chr not in repeat_loci:
-                    repeat_loci[chr] = []
-                repeat_loci[chr].append([int(pos), strand])
-
-    if rna:
-        transcript_ids = sorted(list(transcripts.keys()))
-        random.shuffle(transcript_ids, random=random.random)
-        assert len(transcript_ids) >= len(expr_profile)
-    else:
-        chr_ids = list(genome_seq.keys())
-
-    sam_file = open(base_fname + ".sam", "w")
-
-    # Write SAM header
-    print("@HD\tVN:1.0\tSO:unsorted", file=sam_file)
-    for chr in genome_seq.keys():
-        print("@SQ\tSN:%s\tLN:%d" % (chr, len(genome_seq[chr])), file=sam_file)
-    
-    read_file = open(base_fname + "_1.fa", "w")
-    if paired_end:
-        read2_file = open(base_fname + "_2.fa", "w")
-
-    cur_read_id = 1
-    for t in range(len(expr_profile)):
-        t_num_frags = expr_profile[t]
+        read_fmt = ">{}\n{}\n"
+
+    # Reads and alignments are written in blocks rather than one print per line
+    read_buf, read2_buf, sam_buf = [], [], []
+    def flush_bufs():
+        read_file.write("".join(read_buf))
+        sam_file.write("".join(sam_buf))
+        if paired_end:
+            read2_file.write("".join(read2_buf))
+        del read_buf[:], read2_buf[:], sam_buf[:]
+
+    # Transcript sequences, kept for a while as interleaved pieces come back to them
+    t_seqs = {}
+
+    cur_read_id = first_read_id
+    for t, t_num_frags in pieces:
         if rna:
             transcript_id = transcript_ids[t]
             chr, strand, transcript_len, exons = transcripts[transcript_id]
-            print(transcript_id, t_num_frags, file=sys.stderr)
+            if not interleave:
+                print(transcript_id, t_num_frags, file=sys.stderr)
         else:
             chr = chr_ids[t]
-            print(chr, t_num_frags, file=sys.stderr)
+            if not interleave:
+                print(chr, t_num_frags, file=sys.stderr)
 
         assert chr in genome_seq
         chr_seq = genome_seq[chr]
@@ -775,11 +959,16 @@ def simulate_reads(genome_file, gtf_file, snp_file, base_fname,
             chr_repeat_loci = []
             
         if rna:
-            t_seq = ""
-            for e in exons:
-                assert e[0] < e[1]
-                t_seq += chr_seq[e[0]:e[1]+1]
-            assert len(t_seq) == transcript_len
+            t_seq = t_seqs.get(t)
+            if t_seq is None:
+                t_seq = ""
+                for e in exons:
+                    assert e[0] < e[1]
+                    t_seq += chr_seq[e[0]:e[1]+1]
+                assert len(t_seq) == transcript_len
+                if len(t_seqs) >= 1024:
+                    t_seqs.clear()
+                t_seqs[t] = t_seq
         else:
             t_seq = chr_seq
             exons = [[0, chr_len - 1]]
@@ -787,7 +976,7 @@ def simulate_reads(genome_file, gtf_file, snp_file, base_fname,
         if chr in snps:
             chr_snps = snps[chr]
         else:
-            chr_snps = []
+            chr_snps = ()
 
         for f in range(t_num_frags):
             if rna:
@@ -808,7 +997,10 @@ def simulate_reads(genome_file, gtf_file, snp_file, base_fname,
             # SAM specification (v1.4)
             # http://samtools.sourceforge.net/
             flag, flag2 = 99, 163  # 83, 147
+            # The left read is written as it is, the right one reverse-complemented
+            qual = err_rand_src.newRead(read_len, False)
             pos, cigars, cigar_descs, MD, XM, NM, Zs, read_seq = getSamAlignment(rna, exons, chr_seq, t_seq, frag_pos, read_len, chr_snps, snp_prob, err_rand_src, max_mismatch)
+            qual2 = err_rand_src.newRead(read_len, True)
             pos2, cigars2, cigar2_descs, MD2, XM2, NM2, Zs2, read2_seq = getSamAlignment(rna, exons, chr_seq, t_seq, frag_pos+frag_len-read_len, read_len, chr_snps, snp_prob, err_rand_src, max_mismatch)
             swapped = False
             if paired_end:
@@ -821,6 +1013,7 @@ def simulate_reads(genome_file, gtf_file, snp_file, base_fname,
                     cigars, cigars2 = cigars2, cigars
                     cigar_descs, cigar2_descs = cigar2_descs, cigar_descs
                     read_seq, read2_seq = read2_seq, read_seq
+                    qual, qual2 = qual2, qual
                     XM, XM2 = XM2, XM
                     NM, NM2 = NM2, NM
                     MD, MD2 = MD2, MD
@@ -842,22 +1035,275 @@ def simulate_reads(genome_file, gtf_file, snp_file, base_fname,
             else:
                 XS, TI = "", ""                
 
-            print(">{}".format(cur_read_id), file=read_file)
             if swapped:
-                print(reverse_complement(read_seq), file=read_file)
+                read_buf.append(read_fmt.format(cur_read_id, reverse_complement(read_seq), qual))
             else:
-                print(read_seq, file=read_file)
-            print("{}\t{}\t{}\t{}\t255\t{}\t{}\t{}\t0\t{}\t*\tXM:i:{}\tNM:i:{}\tMD:Z:{}{}{}{}".format(cur_read_id, flag, chr, pos + 1, cigar_str, chr, pos2 + 1, read_seq, XM, NM, MD, Zs, XS, TI), file=sam_file)
+                read_buf.append(read_fmt.format(cur_read_id, read_seq, qual))
+            sam_buf.append("{}\t{}\t{}\t{}\t255\t{}\t{}\t{}\t0\t{}\t*\tXM:i:{}\tNM:i:{}\tMD:Z:{}{}{}{}\n".format(cur_read_id, flag, chr, pos + 1, cigar_str, chr, pos2 + 1, read_seq, XM, NM, MD, Zs, XS, TI))
             if paired_end:
-                print(">{}".format(cur_read_id), file=read2_file)
                 if swapped:
-                    print(read2_seq, file=read2_file)
+                    read2_buf.append(read_fmt.format(cur_read_id, read2_seq, qual2))
                 else:
-                    print(reverse_complement(read2_seq), file=read2_file)
-                print("{}\t{}\t{}\t{}\t255\t{}\t{}\t{}\t0\t{}\t*\tXM:i:{}\tNM:i:{}\tMD:Z:{}{}{}{}".format(cur_read_id, flag2, chr, pos2 + 1, cigar2_str, chr, pos + 1, read2_seq, XM2, NM2, MD2, Zs2, XS, TI), file=sam_file)
+                    read2_buf.append(read_fmt.format(cur_read_id, reverse_complement(read2_seq), qual2))
+                sam_buf.append("{}\t{}\t{}\t{}\t255\t{}\t{}\t{}\t0\t{}\t*\tXM:i:{}\tNM:i:{}\tMD:Z:{}{}{}{}\n".format(cur_read_id, flag2, chr, pos2 + 1, cigar2_str, chr, pos + 1, read2_seq, XM2, NM2, MD2, Zs2, XS, TI))
 
             cur_read_id += 1
+            if len(read_buf) >= 10000:
+                flush_bufs()
             
+    flush_bufs()
+
+
+"""
+Walker's alias method: draws an index i with probability weights[i] / sum(weights)
+from a single random number
+"""
+class AliasSampler:
+    def __init__(self, weights):
+        n = len(weights)
+        weight_sum = float(sum(weights))
+        probs = [w * n / weight_sum for w in weights]
+        self.prob, self.alias = [1.0] * n, list(range(n))
+        small = [i for i in range(n) if probs[i] < 1.0]
+        large = [i for i in range(n) if probs[i] >= 1.0]
+        while small and large:
+            s, l = small.pop(), large[-1]
+            self.prob[s], self.alias[s] = probs[s], l
+            probs[l] -= 1.0 - probs[s]
+            if probs[l] < 1.0:
+                small.append(large.pop())
+        # Left over (within rounding) are kept with probability 1
+
+    def sample(self):
+        u = random.random() * len(self.prob)
+        i = int(u)
+        if u - i < self.prob[i]:
+            return i
+        return self.alias[i]
+
+
+"""
+Draw num_frags fragments from sampler, yielding pieces of [t, 1]
+"""
+def sample_pieces(sampler, num_frags):
+    for f in range(num_frags):
+        yield [sampler.sample(), 1]
+
+
+"""
+Split expr_profile into num_shards runs of (nearly) the same number of fragments.
+Returns [pieces, first read ID] for each shard, where pieces are [t, number of fragments].
+"""
+def split_expr_profile(expr_profile, num_shards):
+    num_frag = sum(expr_profile)
+    shards = []
+    t, t_used, read_id = 0, 0, 1
+    for k in range(num_shards):
+        shard_frags = (k + 1) * num_frag // num_shards - k * num_frag // num_shards
+        pieces, first_read_id = [], read_id
+        while shard_frags > 0:
+            n = min(shard_frags, expr_profile[t] - t_used)
+            if n > 0:
+                pieces.append([t, n])
+            shard_frags -= n
+            t_used += n
+            read_id += n
+            if t_used == expr_profile[t]:
+                t, t_used = t + 1, 0
+        shards.append([pieces, first_read_id])
+    return shards
+
+
+"""
+Seed for a shard, derived from the --random-seed value
+"""
+def shard_seed(random_seed, shard):
+    return int(hashlib.sha1(("%d:%d" % (random_seed, shard)).encode()).hexdigest()[:15], 16)
+
+
+"""
+Names of the SAM, first and second read files for base_fname,
+e.g. base.sam, base_1.fa and base_2.fa, or base.sam.gz, base_1.fq.gz and base_2.fq.gz
+"""
+def output_fnames(base_fname, out_format, compress):
+    read_ext = ".fq" if out_format == "fastq" else ".fa"
+    gz_ext = ".gz" if compress else ""
+    return base_fname + ".sam" + gz_ext, \
+        base_fname + "_1" + read_ext + gz_ext, \
+        base_fname + "_2" + read_ext + gz_ext
+
+
+# Inputs shared with the worker processes of --threads (inherited by fork)
+shard_inputs = {}
+
+"""
+Worker for --threads: simulate one shard into its own SAM and read files,
+compressed the same way as the final output so they can be appended as they are
+"""
+def simulate_shard(args):
+    seed, pieces, first_read_id, shard_fname = args
+    inputs = shard_inputs
+    random.seed(seed, version=1)
+    interleave = inputs["sampler"] is not None
+    if interleave:
+        # pieces is the number of fragments to draw
+        pieces = sample_pieces(inputs["sampler"], pieces)
+    err_rand_src = ErrRandomSource(inputs["error_rate"] / 100.0, qual_profile=inputs["qual_profile"])
+    paired_end = inputs["paired_end"]
+    compress, compress_level = inputs["compress"], inputs["compress_level"]
+    sam_fname, read_fname, read2_fname = output_fnames(shard_fname, inputs["out_format"], compress)
+    sam_file = OutputFile(sam_fname, compress, compress_level, eof=False)
+    read_file = OutputFile(read_fname, compress, compress_level, eof=False)
+    read2_file = None
+    if paired_end:
+        read2_file = OutputFile(read2_fname, compress, compress_level, eof=False)
+    simulate_fragments(pieces, first_read_id,
+                       inputs["genome_seq"], inputs["transcripts"], inputs["transcript_ids"],
+                       inputs["chr_ids"], inputs["snps"], inputs["repeat_loci"],
+                       inputs["rna"], paired_end, inputs["read_len"], inputs["frag_len"],
+                       inputs["snp_prob"], err_rand_src, inputs["max_mismatch"], inputs["sanity_check"],
+                       interleave, inputs["out_format"], sam_file, read_file, read2_file)
+    sam_file.close()
+    read_file.close()
+    if paired_end:
+        read2_file.close()
+
+
+"""
+"""
+def simulate_reads(genome_file, gtf_file, snp_file, base_fname,
+                   rna, paired_end, read_len, frag_len,
+                   num_frag, expr_profile_type, repeat_fname,
+                   error_rate, qual_profile_fname, max_mismatch,
+                   random_seed, snp_prob, sanity_check, cache_dir, interleave,
+                   out_format, compress, compress_level, threads, verbose):
+    random.seed(random_seed, version=1)
+    qual_profile = None
+    if qual_profile_fname:
+        qual_profile = read_quality_profile(qual_profile_fname)
+    err_rand_src = ErrRandomSource(error_rate / 100.0, qual_profile=qual_profile)
+    
+    if read_len > frag_len:
+        frag_len = read_len
+
+    genome_seq = read_genome(genome_file)
+    if rna:
+        genes, transcripts = read_transcript(genome_seq, gtf_file, frag_len)
+    else:
+        genes, transcripts = {}, {}
+    snps = read_snp(snp_file, cache_dir)
+
+    if sanity_check:
+        sanity_check_input(genome_seq, genes, transcripts, snps, frag_len)
+
+    transcript_ids = None
+    if rna:
+        if expr_profile_type in ["flux", "constant"]:
+            expr_profile = generate_rna_expr_profile(expr_profile_type, len(transcripts))
+        else:
+            transcript_ids, expr_profile = read_expr_table(expr_profile_type, transcripts)
+    else:
+        expr_profile = generate_dna_expr_profile(genome_seq)
+
+    # Fragments are either drawn one by one from the profile,
+    # or apportioned to transcripts (chromosomes) up front
+    sampler = None
+    if interleave:
+        sampler = AliasSampler(expr_profile)
+    else:
+        expr_profile = [int(expr_profile[i] * num_frag) for i in range(len(expr_profile))]
+        assert num_frag >= sum(expr_profile)
+        while sum(expr_profile) < num_frag:
+            for i in range(min(num_frag - sum(expr_profile), len(expr_profile))):
+                expr_profile[i] += 1
+        assert num_frag == sum(expr_profile)
+    
+    repeat_loci = {}
+    if repeat_fname != "" and os.path.exists(repeat_fname):
+        for line in open(repeat_fname):
+            if line.startswith('>'):
+                continue
+            coords = line.strip().split()
+            for coord in coords:
+                chr, pos, strand = coord.split(':')
+                if chr not in repeat_loci:
+                    repeat_loci[chr] = []
+                repeat_loci[chr].append([int(pos), strand])
+
+    chr_ids = None
+    if rna:
+        if transcript_ids is None:
+            transcript_ids = sorted(list(transcripts.keys()))
+            myshuffle(transcript_ids)
+        assert len(transcript_ids) >= len(expr_profile)
+    else:
+        chr_ids = list(genome_seq.keys())
+
+    # Output is compressed (if asked) and written on background threads
+    sam_fname, read_fname, read2_fname = output_fnames(base_fname, out_format, compress)
+    sam_file = OutputFile(sam_fname, compress, compress_level)
+
+    # Write SAM header
+    sam_file.write("@HD\tVN:1.0\tSO:unsorted\n")
+    for chr in genome_seq.keys():
+        sam_file.write("@SQ\tSN:%s\tLN:%d\n" % (chr, len(genome_seq[chr])))
+    
+    read_file = OutputFile(read_fname, compress, compress_level)
+    read2_file = None
+    if paired_end:
+        read2_file = OutputFile(read2_fname, compress, compress_level)
+
+    if threads <= 1:
+        if interleave:
+            pieces = sample_pieces(sampler, num_frag)
+        else:
+            pieces = [[t, expr_profile[t]] for t in range(len(expr_profile))]
+        simulate_fragments(pieces, 1,
+                           genome_seq, transcripts, transcript_ids, chr_ids, snps, repeat_loci,
+                           rna, paired_end, read_len, frag_len,
+                           snp_prob, err_rand_src, max_mismatch, sanity_check,
+                           interleave, out_format, sam_file, read_file, read2_file)
+    else:
+        # Each shard is a run of consecutive read IDs simulated by its own process
+        # with a seed derived from random_seed, so output depends on (seed, threads)
+        shard_inputs.update({"genome_seq": genome_seq,
+                             "transcripts": transcripts,
+                             "transcript_ids": transcript_ids,
+                             "chr_ids": chr_ids,
+                             "snps": snps,
+                             "repeat_loci": repeat_loci,
+                             "rna": rna,
+                             "paired_end": paired_end,
+                             "read_len": read_len,
+                             "frag_len": frag_len,
+                             "snp_prob": snp_prob,
+                             "error_rate": error_rate,
+                             "qual_profile": qual_profile,
+                             "max_mismatch": max_mismatch,
+                             "sanity_check": sanity_check,
+                             "sampler": sampler,
+                             "out_format": out_format,
+                             "compress": compress,
+                             "compress_level": compress_level})
+        shard_fnames = ["%s.shard%d" % (base_fname, k) for k in range(threads)]
+        if interleave:
+            shards = [[(k + 1) * num_frag // threads - k * num_frag // threads, k * num_frag // threads + 1]
+                      for k in range(threads)]
+        else:
+            shards = split_expr_profile(expr_profile, threads)
+        jobs = [[shard_seed(random_seed, k), pieces, first_read_id, shard_fnames[k]]
+                for k, (pieces, first_read_id) in enumerate(shards)]
+        pool = multiprocessing.get_context("fork").Pool(threads)
+        pool.map(simulate_shard, jobs, chunksize=1)
+        pool.close()
+        pool.join()
+        for shard_fname in shard_fnames:
+            shard_sam_fname, shard_read_fname, shard_read2_fname = output_fnames(shard_fname, out_format, compress)
+            sam_file.append_file(shard_sam_fname)
+            read_file.append_file(shard_read_fname)
+            if paired_end:
+                read2_file.append_file(shard_read2_fname)
+
     sam_file.close()
     read_file.close()
     if paired_end:
@@ -916,7 +1362,11 @@ if __name__ == '__main__':
                         action='store',
                         type=str,
                         default='flux',
-                        help='expression profile: flux or constant (default: flux)')
+                        help='expression profile: flux, constant, or a table of transcript IDs and TPM values (e.g. Salmon quant.sf) (default: flux)')
+    parser.add_argument('--interleave',
+                        dest='interleave',
+                        action='store_true',
+                        help='draw the transcript (chromosome) of each fragment from the expression profile, so that reads are not grouped by transcript')
     parser.add_argument('--repeat-info',
                         dest='repeat_fname',
                         action='store',
@@ -929,6 +1379,12 @@ if __name__ == '__main__':
                         type=float,
                         default=0.0,
                         help='per-base sequencing error rate (%%) (default: 0.0)')
+    parser.add_argument('--quality-profile',
+                        dest='qual_profile_fname',
+                        action='store',
+                        type=str,
+                        default='',
+                        help='draw base qualities, and sequencing errors to match them, from per-cycle quality counts learned from a FASTQ file or given as a table of cycle, quality and count (overrides --error-rate)')
     parser.add_argument('--max-mismatch',
                         dest='max_mismatch',
                         action='store',
@@ -947,6 +1403,35 @@ if __name__ == '__main__':
                         type=float,
                         default=1.0,
                         help='probability of a read including a snp when the read spans the snp ranging from 0.0 to 1.0 (default: 1.0)')
+    parser.add_argument('--variant-cache',
+                        dest='cache_dir',
+                        type=str,
+                        default="",
+                        help='Directory to cache parsed SNPs in, so that later runs on the same SNP file load them instantly')
+    parser.add_argument('--out-format',
+                        dest='out_format',
+                        action='store',
+                        choices=['fasta', 'fastq'],
+                        default='fasta',
+                        help='format of the read files: fasta or fastq (default: fasta)')
+    parser.add_argument('--compress',
+                        dest='compress',
+                        action='store',
+                        choices=COMPRESS_TYPES,
+                        default=None,
+                        help='compress the read and SAM files with gzip or bgzf, adding .gz to their names (default: no compression)')
+    parser.add_argument('--compress-level',
+                        dest='compress_level',
+                        action='store',
+                        type=int,
+                        default=6,
+                        help='compression level from 1 to 9 (default: 6)')
+    parser.add_argument('-p', '--threads',
+                        dest='threads',
+                        action='store',
+                        type=int,
+                        default=1,
+                        help='number of processes to simulate reads with; output is reproducible for a given random seed and number of processes (default: 1)')
     parser.add_argument('--sanity-check',
                         dest='sanity_check',
                         action='store_true',
@@ -964,8 +1449,14 @@ if __name__ == '__main__':
         exit(1)
     if not args.rna:
         args.expr_profile = "constant"
+    if args.expr_profile not in ["flux", "constant"] and not os.path.isfile(args.expr_profile):
+        parser.error("--expr-profile must be flux, constant, or an existing file: %s" % args.expr_profile)
+    if not 1 <= args.compress_level <= 9:
+        print("Error: --compress-level must be between 1 and 9", file=sys.stderr)
+        exit(1)
     simulate_reads(args.genome_file, args.gtf_file, args.snp_file, args.base_fname,
                    args.rna, args.paired_end, args.read_len, args.frag_len,
                    args.num_frag, args.expr_profile, args.repeat_fname,
-                   args.error_rate, args.max_mismatch,
-                   args.random_seed, args.snp_prob, args.sanity_check, args.verbose)
+                   args.error_rate, args.qual_profile_fname, args.max_mismatch,
+                   args.random_seed, args.snp_prob, args.sanity_check, args.cache_dir, args.interleave,
+                   args.out_format, args.compress, args.compress_level, args.threads, args.verbose)
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+
+#
+# Copyright 2015, Daehwan Kim <infphilo@gmail.com>
+#
+# This file is part of HISAT 2.
+#
+# HISAT 2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# HISAT 2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with HISAT 2.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+# Columnar cache of the variants parsed out of a VCF or dbSNP file, so that
+# rebuilding SNP indexes with other --inter-gap/--intra-gap settings can skip
+# parsing the input again.
+#
+# A cache file is named after the checksums of the input file, the genome and
+# the parsing options.  It holds a JSON header followed by one array per
+# column; numeric columns are read back as memoryviews over a memory-mapped
+# file, and string/bytes columns as offsets into a memory-mapped heap.
+
+import os, json, mmap, hashlib
+from array import array
+
+
+CACHE_MAGIC = b"HT2VARC\x01"
+
+# Column kinds: array typecodes, or "str"/"bytes" for variable-length values
+STR_KINDS = ("str", "bytes")
+
+
+"""
+"""
+def file_checksum(fname):
+    h = hashlib.sha1()
+    with open(fname, "rb") as fp:
+        while True:
+            data = fp.read(1 << 22)
+            if not data:
+                break
+            h.update(data)
+    return h.hexdigest()
+
+
+"""
+Checksum of a genome: of its file if there is one, otherwise of its chromosome names and lengths
+"""
+def genome_checksum(genome_fname, chr_dic):
+    if genome_fname and os.path.isfile(genome_fname):
+        return file_checksum(genome_fname)
+    h = hashlib.sha1()
+    for chr, seq in chr_dic.items():
+        h.update(("%s\t%d\n" % (chr, len(seq))).encode())
+    return h.hexdigest()
+
+
+"""
+Cache file name for input_fname parsed with the given (repr-able) settings
+"""
+def cache_fname(cache_dir, input_fname, settings):
+    h = hashlib.sha1(CACHE_MAGIC)
+    h.update(file_checksum(input_fname).encode())
+    h.update(repr(settings).encode())
+    return os.path.join(cache_dir, "%s.%s.vcache" % (os.path.basename(input_fname), h.hexdigest()[:16]))
+
+
+"""
+Write columns to per-column temporary files as they grow, and put them
+together into the cache file on close()
+"""
+class VariantCacheWriter:
+    def __init__(self, fname, columns):
+        self.fname = fname
+        self.tmp_fname = "%s.tmp%d" % (fname, os.getpid())
+        self.meta = {}
+        self.chrs, self.chr_index = [], {}
+        self.columns = []
+        self.kinds = {}
+        self.buffers = {}
+        self.files = {}
+        self.offset_files = {}
+        self.counts = {}
+        self.heap_sizes = {}
+        for name, kind in columns:
+            self.columns.append(name)
+            self.kinds[name] = kind
+            self.files[name] = open("%s.%s" % (self.tmp_fname, name), "wb")
+            self.counts[name] = 0
+            if kind in STR_KINDS:
+                self.buffers[name] = [array('Q', [0]), bytearray()]
+                self.heap_sizes[name] = 0
+            else:
+                self.buffers[name] = array(kind)
+
+    def chr_id(self, chr):
+        i = self.chr_index.get(chr)
+        if i is None:
+            i = self.chr_index[chr] = len(self.chrs)
+            self.chrs.append(chr)
+        return i
+
+    def append(self, name, value):
+        self.counts[name] += 1
+        buf = self.buffers[name]
+        kind = self.kinds[name]
+        if kind in STR_KINDS:
+            if kind == "str":
+                value = value.encode()
+            offsets, heap = buf
+            heap += value
+            offsets.append(self.heap_sizes[name] + len(heap))
+            if len(heap) >= (1 << 20):
+                self.flush(name)
+        else:
+            buf.append(value)
+            if len(buf) >= (1 << 16):
+                self.flush(name)
+
+    def flush(self, name):
+        buf = self.buffers[name]
+        if self.kinds[name] in STR_KINDS:
+            # offsets go to their own file; the heap to the column file
+            offsets, heap = buf
+            if name not in self.offset_files:
+                self.offset_files[name] = open("%s.%s.off" % (self.tmp_fname, name), "wb")
+            offsets.tofile(self.offset_files[name])
+            self.files[name].write(heap)
+            self.heap_sizes[name] += len(heap)
+            buf[0], buf[1] = array('Q'), bytearray()
+        else:
+            buf.tofile(self.files[name])
+            self.buffers[name] = array(self.kinds[name])
+
+    def remove_tmp_files(self):
+        for name in self.columns:
+            for suffix in ("", ".off"):
+                fname = "%s.%s%s" % (self.tmp_fname, name, suffix)
+                if os.path.exists(fname):
+                    os.remove(fname)
+
+    def abort(self):
+        for fp in list(self.files.values()) + list(self.offset_files.values()):
+            fp.close()
+        self.remove_tmp_files()
+        if os.path.exists(self.tmp_fname):
+            os.remove(self.tmp_fname)
+
+    def close(self):
+        for name in self.columns:
+            self.flush(name)
+            self.files[name].close()
+            if name in self.offset_files:
+                self.offset_files[name].close()
+
+        # Lay out the columns (8-byte aligned) after the header
+        layout, offset = [], 0
+        for name in self.columns:
+            kind = self.kinds[name]
+            column = {"name": name, "kind": kind, "count": self.counts[name], "offset": offset}
+            if kind in STR_KINDS:
+                offset += (self.counts[name] + 1) * 8
+                column["heap_offset"] = offset
+                offset += self.heap_sizes[name]
+            else:
+                offset += self.counts[name] * array(kind).itemsize
+            offset = (offset + 7) & ~7
+            layout.append(column)
+
+        meta = dict(self.meta)
+        meta["chrs"] = self.chrs
+        header = json.dumps({"meta": meta, "columns": layout}).encode()
+        data_begin = (len(CACHE_MAGIC) + 8 + len(header) + 7) & ~7
+
+        with open(self.tmp_fname, "wb") as out:
+            out.write(CACHE_MAGIC)
+            out.write(len(header).to_bytes(8, "little"))
+            out.write(header)
+            for column in layout:
+                name = column["name"]
+                out.write(b"\0" * (data_begin + column["offset"] - out.tell()))
+                parts = ["%s.%s" % (self.tmp_fname, name)]
+                if column["kind"] in STR_KINDS:
+                    parts.insert(0, "%s.%s.off" % (self.tmp_fname, name))
+                for part in parts:
+                    with open(part, "rb") as fp:
+                        while True:
+                            data = fp.read(1 << 22)
+                            if not data:
+                                break
+                            out.write(data)
+        self.remove_tmp_files()
+        os.rename(self.tmp_fname, self.fname)
+
+
+"""
+"""
+class StrColumn:
+    def __init__(self, mm, offsets, heap_offset, decode):
+        self.mm = mm
+        self.offsets = offsets
+        self.heap_offset = heap_offset
+        self.decode = decode
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        value = self.mm[self.heap_offset + self.offsets[i]:self.heap_offset + self.offsets[i+1]]
+        if self.decode:
+            return value.decode()
+        return value
+
+
+"""
+Memory-mapped cache file; columns[name] supports len() and indexing
+"""
+class VariantCache:
+    def __init__(self, fname):
+        with open(fname, "rb") as fp:
+            if fp.read(len(CACHE_MAGIC)) != CACHE_MAGIC:
+                raise ValueError("%s is not a variant cache file" % fname)
+            header_len = int.from_bytes(fp.read(8), "little")
+            header = json.loads(fp.read(header_len).decode())
+            self.mm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        data_begin = (len(CACHE_MAGIC) + 8 + header_len + 7) & ~7
+
+        self.meta = header["meta"]
+        self.chrs = self.meta["chrs"]
+        self.columns = {}
+        view = memoryview(self.mm)
+        for column in header["columns"]:
+            kind, count = column["kind"], column["count"]
+            offset = data_begin + column["offset"]
+            if kind in STR_KINDS:
+                offsets = view[offset:offset + (count + 1) * 8].cast('Q')
+                self.columns[column["name"]] = StrColumn(self.mm,
+                                                         offsets,
+                                                         data_begin + column["heap_offset"],
+                                                         kind == "str")
+            else:
+                itemsize = array(kind).itemsize
+                self.columns[column["name"]] = view[offset:offset + count * itemsize].cast(kind)
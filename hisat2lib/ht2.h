@@ -42,8 +42,9 @@ typedef void* ht2_handle_t;
 struct ht2_options {
     int offRate;
 
-    int useMm;
-    int useShmem;
+    int useMm;              /* memory-map the index files; processes share the page cache */
+    int useShmem;           /* load the index once into SysV shared memory; later handles attach to it.
+                               segments persist after ht2_close() until removed with ipcrm */
     int mmSweep;
     int noRefNames;
     int noSplicedAlignment;
@@ -52,6 +53,9 @@ struct ht2_options {
     int sanityCheck;
     
     int useHaplotype;
+
+    int nthreads;           /* number of threads for batch queries */
+    int khits;              /* maximum number of alignments reported per read (hisat2 -k) */
 };
 
 typedef struct ht2_options ht2_option_t;
@@ -64,6 +68,14 @@ typedef struct ht2_options ht2_option_t;
  *
  **************************************************************************/
 
+/**
+ * @brief 
+ *
+ * @param name              index base name
+ * @param options           options or NULL for defaults
+ *
+ * @return handle, or NULL if the index can't be loaded with the given options
+ */
 ht2_handle_t ht2_init(const char *name, ht2_option_t *options);
 void ht2_close(ht2_handle_t);
 
@@ -76,6 +88,12 @@ ht2_error_t ht2_init_options(ht2_option_t *options);
  *
  **************************************************************************/
 
+struct ht2_position {
+    uint32_t chr_id;
+    int direction;  /* 0 - forward, 1 - reverse */
+    uint64_t pos;   /* 0-based */
+};
+
 const char* ht2_index_getrefnamebyid(ht2_handle_t handle, uint32_t chr_id);  
 
 struct ht2_index_getrefnames_result {
@@ -93,6 +111,84 @@ struct ht2_index_getrefnames_result {
  */
 ht2_error_t ht2_index_getrefnames(ht2_handle_t handle, struct ht2_index_getrefnames_result **result_ptr);
 
+/**
+ * @brief
+ *
+ * @param handle
+ * @param chr_id
+ *
+ * @return length of the reference sequence, 0 if there is no such sequence
+ */
+uint64_t ht2_index_getreflength(ht2_handle_t handle, uint32_t chr_id);
+
+struct ht2_index_getsequence_result {
+    uint64_t len;
+    uint8_t bases[0];   /* one base per byte. 0 - A, 1 - C, 2 - G, 3 - T, 4 - N */
+};
+
+/**
+ * @brief Get a stretch of reference sequence from the index
+ *
+ * @param handle
+ * @param chr_id
+ * @param start             0-based
+ * @param len               start + len must not exceed the reference length
+ * @param result_ptr        pointer to result. caller must release memory by free().
+ *
+ * @return
+ */
+ht2_error_t ht2_index_getsequence(ht2_handle_t handle,
+        uint32_t chr_id,
+        uint64_t start,
+        uint64_t len,
+        struct ht2_index_getsequence_result **result_ptr);
+
+/**
+ * @brief Count exact occurrences of a sequence on the forward strand
+ *        without resolving their positions.
+ *        The sequence must be at least ht2_index_minlength() long.
+ *
+ * @param handle
+ * @param seq
+ * @param count             number of occurrences. in a graph index with SNPs
+ *                          a position can be counted once per path through it,
+ *                          so this is an upper bound on ht2_index_locate().
+ *
+ * @return HT2_ERR if the sequence is too short
+ */
+ht2_error_t ht2_index_count(ht2_handle_t handle, const char *seq, uint64_t *count);
+
+/**
+ * @brief
+ *
+ * @param handle
+ *
+ * @return shortest sequence ht2_index_count() and ht2_index_locate() accept
+ */
+uint32_t ht2_index_minlength(ht2_handle_t handle);
+
+struct ht2_index_locate_result {
+    uint64_t num_hits;      /* same as ht2_index_count() */
+    int count;
+    struct ht2_position positions[0];
+};
+
+/**
+ * @brief Find exact occurrences of a sequence on the forward strand.
+ *        Occurrences spanning two reference sequences are skipped.
+ *
+ * @param handle
+ * @param seq
+ * @param max_hits          maximum number of positions to report
+ * @param result_ptr        pointer to result. caller must release memory by free().
+ *
+ * @return HT2_ERR if the sequence is too short
+ */
+ht2_error_t ht2_index_locate(ht2_handle_t handle,
+        const char *seq,
+        uint64_t max_hits,
+        struct ht2_index_locate_result **result_ptr);
+
 
 /**************************************************************************
  *
@@ -100,12 +196,6 @@ ht2_error_t ht2_index_getrefnames(ht2_handle_t handle, struct ht2_index_getrefna
  *
  **************************************************************************/
 
-struct ht2_position {
-    uint32_t chr_id;
-    int direction;  /* 0 - forward, 1 - reverse */
-    uint64_t pos;   /* 0-based */
-};
-
 struct ht2_repeat_expand_result {
     int count;
     struct ht2_position positions[0];
@@ -122,7 +212,7 @@ struct ht2_repeat_expand_result {
  * @param result_ptr        pointer to result. caller must release memory by free(). 
  *                          ex) free(result_ptr);
  *
- * @return 
+ * @return HT2_ERR_NOT_REPEAT if there is no such repeat or range
  */
 ht2_error_t ht2_repeat_expand(ht2_handle_t handle, 
         const char *repeat_name, 
@@ -130,12 +220,103 @@ ht2_error_t ht2_repeat_expand(ht2_handle_t handle,
         uint64_t repeat_len, 
         struct ht2_repeat_expand_result **result_ptr);
 
+/**
+ * @brief 
+ *
+ * @param handle
+ * @param repeat_name
+ * @param rep_id            repeat id for ht2_repeat_expand_many()
+ *
+ * @return HT2_ERR_NOT_REPEAT if there is no such repeat
+ */
+ht2_error_t ht2_repeat_getid(ht2_handle_t handle,
+        const char *repeat_name,
+        uint32_t *rep_id);
+
+struct ht2_repeat_expand_many_result {
+    size_t count;           /* number of queries */
+    size_t num_positions;
+
+    /* positions of query i are at [offsets[i], offsets[i + 1]) */
+    uint64_t *offsets;      /* count + 1 entries */
+    uint64_t *positions;    /* 0-based */
+    uint32_t *chr_ids;
+    uint8_t *directions;    /* 0 - forward, 1 - reverse */
+};
+
+/**
+ * @brief Expand many repeat coordinates at once. Queries that are not
+ *        repeats get an empty range.
+ *
+ * @param handle
+ * @param count             number of queries
+ * @param rep_ids           repeat ids from ht2_repeat_getid()
+ * @param repeat_pos        repeat positions on repeat sequences(0-based)
+ * @param repeat_len
+ * @param result_ptr        pointer to result. all arrays are in the same allocation,
+ *                          so caller must release memory by a single free(). 
+ *
+ * @return 
+ */
+ht2_error_t ht2_repeat_expand_many(ht2_handle_t handle,
+        size_t count,
+        const uint32_t *rep_ids,
+        const uint64_t *repeat_pos,
+        const uint64_t *repeat_len,
+        struct ht2_repeat_expand_many_result **result_ptr);
+
 /**************************************************************************
  *
  * Alignment APIs
  *
  **************************************************************************/
-/* TODO */
+
+struct ht2_alignment {
+    uint32_t read_id;       /* index of the read in the batch */
+    uint32_t chr_id;
+    uint64_t pos;           /* 0-based, leftmost aligned base */
+    uint16_t flag;          /* SAM FLAG. 0x10 - reverse strand, 0x100 - secondary */
+    uint8_t mapq;
+    char xs;                /* XS:A, strand of the splice sites. '+', '-' or 0 if unknown */
+    int32_t score;          /* AS:i */
+    uint32_t nm;            /* NM:i, edits to the reference except introns and known SNPs */
+    uint32_t nh;            /* NH:i, number of alignments reported for the read */
+    uint32_t cigar_offset;  /* the CIGAR is cigar[cigar_offset, cigar_offset + cigar_count) */
+    uint32_t cigar_count;
+};
+
+struct ht2_align_batch_result {
+    size_t count;           /* number of alignments */
+    size_t num_cigar_ops;
+
+    struct ht2_alignment *alignments;   /* ordered by read_id, primary first */
+    uint32_t *cigar;        /* BAM encoding. length << 4 | op, op is the index in "MIDNSHP=X" */
+};
+
+/**
+ * @brief Align a batch of unpaired reads with the HISAT2 spliced aligner,
+ *        as hisat2 does with default options and --no-temp-splicesite.
+ *        Reads are distributed over options->nthreads threads and at
+ *        most options->khits alignments are reported per read.
+ *        Reads that don't align have no record.
+ *        Like the read name in hisat2, the index of a read in the batch
+ *        seeds the random choice among equally good alignments.
+ *
+ * @param handle
+ * @param count             number of reads
+ * @param seqs              read sequences
+ * @param quals             phred+33 qualities with one character per base of
+ *                          seqs[i], or NULL to treat every base as 'I'
+ * @param result_ptr        pointer to result. all arrays are in the same allocation,
+ *                          so caller must release memory by a single free().
+ *
+ * @return HT2_ERR if a quality string doesn't match its read
+ */
+ht2_error_t ht2_align_batch(ht2_handle_t handle,
+        size_t count,
+        const char **seqs,
+        const char **quals,
+        struct ht2_align_batch_result **result_ptr);
 
 
 /**************************************************************************
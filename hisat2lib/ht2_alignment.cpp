@@ -17,4 +17,647 @@
  * along with HISAT 2.  If not, see <http://www.gnu.org/licenses/>.
  */
 
+#include <iostream>
+#include <algorithm>
 
+#include "ds.h"
+#include "repeat.h"
+#include "rfm.h"
+#include "threading.h"
+#include "pat.h"
+#include "outq.h"
+#include "aln_sink.h"
+#include "splice_site.h"
+#include "spliced_aligner.h"
+#include "aligner_seed_policy.h"
+#include "unique.h"
+#include "pe.h"
+#include "tp.h"
+#include "gp.h"
+
+#include "ht2.h"
+#include "ht2_handle.h"
+
+using namespace std;
+
+// declared in search_globals.h; hisat2-align defines them in hisat2.cpp.
+// hisat2lib keeps the hisat2 defaults
+bool gColor             = false;
+bool gReportOverhangs   = false;
+int  gVerbose           = 0;
+int  gQuiet             = false;
+bool gNofw              = false;
+bool gNorc              = false;
+bool gMate1fw           = true;
+bool gMate2fw           = false;
+int  gMinInsert         = 0;
+int  gMaxInsert         = 1000;
+int  gTrim5             = 0;
+int  gTrim3             = 0;
+int  gGapBarrier        = 4;
+
+/* number of reads a worker claims from the batch at a time */
+static const size_t ALIGN_CHUNK_SIZE = 256;
+
+/* CIGAR operations in BAM order */
+static const char CIGAR_OPS[] = "MIDNSHP=X";
+
+/**
+ * Everything hisat2 sets up once before it starts aligning: the scoring
+ * scheme and policies for the default options, the repeat reference and
+ * the splice sites stored in the index.
+ */
+struct ht2_aligner {
+    BitPairReference*   rref;
+    SpliceSiteDB*       ssdb;
+
+    EList<string>       refnames;
+    EList<string>       repnames;
+
+    Scoring*            sc;
+    TranscriptomePolicy tpol;
+    GraphPolicy         gpol;
+    PairedEndPolicy     pepol;
+};
+
+/**
+ * Collects the alignments AlnSinkWrap reports for each read as
+ * ht2_alignment records instead of SAM text.  Every thread appends to
+ * its own lists.
+ */
+class AlnSinkBatch : public AlnSink<index_t> {
+public:
+    AlnSinkBatch(
+            OutputQueue& oq,
+            struct ht2_handle *hp,
+            size_t nthreads) :
+        AlnSink<index_t>(
+                oq,
+                hp->aligner->refnames,
+                hp->aligner->repnames,
+                true,
+                hp->altdb,
+                hp->aligner->ssdb),
+        alignments_(),
+        cigars_()
+    {
+        alignments_.resize(nthreads);
+        cigars_.resize(nthreads);
+        for(size_t i = 0; i < nthreads; i++) {
+            alignments_[i].clear();
+            cigars_[i].clear();
+        }
+    }
+
+    virtual ~AlnSinkBatch() { }
+
+    virtual void append(
+        BTString&             o,
+        StackedAln&           staln,
+        size_t                threadId,
+        const Read           *rd1,
+        const Read           *rd2,
+        const TReadId         rdid,
+        AlnRes               *rs1,
+        AlnRes               *rs2,
+        const AlnSetSumm&     summ,
+        const SeedAlSumm&     ssm1,
+        const SeedAlSumm&     ssm2,
+        const AlnFlags*       flags1,
+        const AlnFlags*       flags2,
+        const PerReadMetrics& prm,
+        const Mapq&           mapq,
+        const Scoring&        sc,
+        bool                  report2)
+    {
+        assert(rd1 != NULL);
+        assert(flags1 != NULL);
+        if(rs1 == NULL) {
+            // unaligned
+            return;
+        }
+
+        EList<struct ht2_alignment>& alignments = alignments_[threadId];
+        EList<uint32_t>& cigar = cigars_[threadId];
+
+        staln.reset();
+        rs1->initStacked(*rd1, staln);
+        staln.leftAlign(false /* not past MMs */);
+        staln.buildCigar(false);
+
+        alignments.expand();
+        struct ht2_alignment& aln = alignments.back();
+        memset(&aln, 0, sizeof(aln));   // no stale padding in results
+
+        aln.read_id = (uint32_t)rdid;
+        aln.chr_id = (uint32_t)rs1->refid();
+        aln.pos = (uint64_t)rs1->refoff();
+        if(!rs1->fw()) {
+            aln.flag |= SAM_FLAG_QUERY_STRAND;
+        }
+        if(!flags1->isPrimary()) {
+            aln.flag |= SAM_FLAG_NOT_PRIMARY;
+        }
+
+        char mapqInps[1024];
+        aln.mapq = (uint8_t)min<TMapq>(mapq.mapq(summ, *flags1, rd1->mate < 2, rd1->length(), 0, mapqInps), 255);
+
+        uint8_t whichsense = rs1->spliced_whichsense_transcript();
+        if(whichsense == SPL_FW || whichsense == SPL_SEMI_FW) {
+            aln.xs = '+';
+        } else if(whichsense == SPL_RC || whichsense == SPL_SEMI_RC) {
+            aln.xs = '-';
+        }
+
+        aln.score = (int32_t)rs1->score().score();
+        for(size_t i = 0; i < rs1->ned().size(); i++) {
+            if(rs1->ned()[i].type != EDIT_TYPE_SPL &&
+               rs1->ned()[i].snpID >= altdb_->alts().size()) {
+                aln.nm++;
+            }
+        }
+        aln.nh = (uint32_t)summ.numAlns1();
+
+        aln.cigar_offset = (uint32_t)cigar.size();
+        const EList<char>& ops = staln.cigarOps();
+        const EList<size_t>& runs = staln.cigarRuns();
+        for(size_t i = 0; i < ops.size(); i++) {
+            if(runs[i] == 0) {
+                continue;
+            }
+            const char *op = strchr(CIGAR_OPS, ops[i]);
+            assert(op != NULL);
+            cigar.push_back((uint32_t)(runs[i] << 4) | (uint32_t)(op - CIGAR_OPS));
+            aln.cigar_count++;
+        }
+    }
+
+    const EList<struct ht2_alignment>& alignments(size_t tid) const { return alignments_[tid]; }
+    const EList<uint32_t>& cigar(size_t tid) const { return cigars_[tid]; }
+
+private:
+    EList<EList<struct ht2_alignment> > alignments_;
+    EList<EList<uint32_t> >             cigars_;
+};
+
+/**
+ * A batch of reads shared by all worker threads.  Workers claim
+ * chunks of ALIGN_CHUNK_SIZE reads, so the only shared state is the
+ * next unclaimed read.
+ */
+struct align_batch {
+    struct ht2_handle *hp;
+
+    size_t count;
+    const char **seqs;
+    const char **quals;
+
+    size_t next;
+    MUTEX_T mutex;
+
+    AlnSinkBatch *sink;
+};
+
+struct align_worker {
+    struct align_batch *batch;
+    int tid;
+};
+
+/**
+ * Fill 'rd' from a read sequence as the FASTA reader of hisat2 does.
+ * The read is named after its index in the batch.
+ */
+static void install_read(Read& rd, TReadId rdid, const char *seq, const char *qual)
+{
+    rd.reset();
+    for(size_t i = 0; seq[i] != '\0'; i++) {
+        int c = (unsigned char)seq[i];
+        if(asc2dnacat[c] > 0) {
+            rd.patFw.append(asc2dna[c]);
+            rd.qual.append(qual != NULL ? qual[i] : 'I');
+        }
+    }
+
+    char buf[20];
+    itoa10<TReadId>(rdid, buf);
+    rd.name.install(buf);
+
+    rd.rdid = rd.endid = rdid;
+    rd.mate = 0;
+    rd.finalize();
+    rd.seed = genRandSeed(rd.patFw, rd.qual, rd.name, 0);
+}
+
+/**
+ * Align reads until the batch runs out.  This is the unpaired part of
+ * multiseedSearchWorker_hisat2() in hisat2.cpp.
+ */
+static void align_batch_worker(void *vp)
+{
+    struct align_worker *worker = (struct align_worker *)vp;
+    struct align_batch *batch = worker->batch;
+    struct ht2_handle *hp = batch->hp;
+    struct ht2_aligner *al = hp->aligner;
+    const Scoring& sc = *(al->sc);
+    const bool noSplicedAlignment = hp->options.noSplicedAlignment;
+
+    THitInt khits = hp->options.khits;
+    ReportingParams rp(
+            khits,                          // -k
+            max<THitInt>(5, khits * 2),     // --max-seeds
+            0,                              // -m/-M
+            0,                              // penalty gap (not used now)
+            false,                          // -M not specified
+            true,                           // report discordant paired-end alignments
+            true,                           // report unpaired alignments for paired reads
+            false,                          // secondary alignments
+            false,                          // local alignment
+            0,                              // no Bowtie2 dynamic programming
+            false,                          // --sensitive
+            false);                         // report repeat alignments
+
+    auto_ptr<Mapq> bmapq(new_mapq(2, sc.scoreMin, sc));
+
+    AlnSinkWrap<index_t> msinkwrap(
+            *(batch->sink),
+            rp,
+            *bmapq.get(),
+            (size_t)worker->tid,
+            false,
+            noSplicedAlignment ? NULL : al->ssdb,
+            0);
+
+    SplicedAligner<index_t, local_index_t> splicedAligner(
+            *(hp->gfm),
+            true,                           // anchor stop
+            0);
+
+    SwAligner sw;
+    WalkMetrics wlm;
+    SwMetrics swmSeed;
+    ReportingMetrics rpm;
+    HIMetrics him;
+    PerReadMetrics prm;
+    RandomSource rnd;
+    Read rd;
+
+    while(true) {
+        size_t begin, end;
+        {
+            ThreadSafe ts(&batch->mutex);
+            begin = batch->next;
+            end = min(begin + ALIGN_CHUNK_SIZE, batch->count);
+            batch->next = end;
+        }
+        if(begin >= end) {
+            break;
+        }
+
+        for(size_t i = begin; i < end; i++) {
+            install_read(rd, (TReadId)i, batch->seqs[i], batch->quals != NULL ? batch->quals[i] : NULL);
+
+            prm.reset();
+            prm.doFmString = false;
+
+            const size_t rdlen = rd.length();
+            msinkwrap.nextRead(&rd, NULL, (TReadId)i, sc.qualitiesMatter());
+
+            // Calculate the minimum valid score threshold for the read
+            TAlScore minsc = sc.scoreMin.f<TAlScore>(rdlen);
+            if(minsc > 0) {
+                minsc = 0;
+            }
+
+            // N filter, score filter and length filter
+            size_t readns[2] = {0, 0};
+            bool nfilt[2] = {true, true};
+            sc.nFilterPair(&rd.patFw, NULL, readns[0], readns[1], nfilt[0], nfilt[1]);
+            bool scfilt = sc.scoreFilter(minsc, rdlen);
+            bool lenfilt = rdlen > (size_t)DEFAULT_SEEDMMS && rdlen >= 2;
+            bool filt = nfilt[0] && scfilt && lenfilt;
+
+            rnd.init(rd.seed);
+            if(filt) {
+                splicedAligner.initRead(&rd, gNofw, gNorc, minsc, 0, false);
+                splicedAligner.go(
+                        sc,
+                        al->pepol,
+                        al->tpol,
+                        al->gpol,
+                        *(hp->gfm),
+                        hp->rgfm,
+                        *(hp->altdb),
+                        *(hp->repeatdb),
+                        *(hp->raltdb),
+                        *(hp->ref),
+                        al->rref,
+                        sw,
+                        *(al->ssdb),
+                        wlm,
+                        prm,
+                        swmSeed,
+                        him,
+                        rnd,
+                        msinkwrap);
+            }
+
+            msinkwrap.finishRead(
+                    NULL,
+                    NULL,
+                    false,                  // exhausted seed hits for mate 1?
+                    false,                  // exhausted seed hits for mate 2?
+                    nfilt[0],
+                    nfilt[1],
+                    scfilt,
+                    true,
+                    lenfilt,
+                    true,
+                    true,                   // qc filter
+                    true,
+                    true,                   // prioritize alignments by score
+                    rnd,
+                    rpm,
+                    prm,
+                    sc,
+                    true,                   // suppress seed summaries
+                    false,                  // suppress alignments
+                    true);                  // template length adjustment
+        }
+    }
+}
+
+/**
+ * Set up the aligner state of a handle as the driver() of hisat2 does.
+ * Called once the index and reference are loaded.
+ */
+void init_aligner(struct ht2_handle *hp)
+{
+    struct ht2_options *opt = &hp->options;
+
+    hp->aligner = new ht2_aligner();
+    struct ht2_aligner *al = hp->aligner;
+
+    // Load the repeat reference for resolving repeat alignments
+    al->rref = new BitPairReference(
+            hp->ht2_idx_name + ".rep",
+            &hp->rgfm->getRepeatIncluded(),
+            false,
+            opt->sanityCheck,
+            NULL,
+            NULL,
+            false,
+            opt->useMm,
+            opt->useShmem,
+            opt->mmSweep,
+            opt->gVerbose,
+            opt->startVerbose);
+    if(!al->rref->loaded()) {
+        throw 1;
+    }
+
+    readEbwtRefnames<index_t>(hp->ht2_idx_name, al->refnames);
+    hp->rgfm->getReferenceNames(al->repnames);
+
+    // Default end-to-end scoring
+    int bonusMatchType, bonusMatch;
+    int penMmcType, penMmcMax, penMmcMin;
+    int penScMax, penScMin;
+    int penNType, penN;
+    int penRdGapConst, penRfGapConst, penRdGapLinear, penRfGapLinear;
+    SimpleFunc scoreMin, nCeil, msIval;
+    bool penNCatPair;
+    int multiseedMms, multiseedLen;
+    size_t failStreak = 0, nSeedRounds = 2;
+    SimpleFunc penCanIntronLen, penNoncanIntronLen;
+    penCanIntronLen.init(SIMPLE_FUNC_LOG, -8, 1);
+    penNoncanIntronLen.init(SIMPLE_FUNC_LOG, -8, 1);
+
+    SeedAlignmentPolicy::parseString(
+            "",
+            false,                          // local alignment
+            false,                          // noisy homopolymers
+            false,                          // ignore qualities
+            bonusMatchType,
+            bonusMatch,
+            penMmcType,
+            penMmcMax,
+            penMmcMin,
+            penScMax,
+            penScMin,
+            penNType,
+            penN,
+            penRdGapConst,
+            penRfGapConst,
+            penRdGapLinear,
+            penRfGapLinear,
+            scoreMin,
+            nCeil,
+            penNCatPair,
+            multiseedMms,
+            multiseedLen,
+            msIval,
+            failStreak,
+            nSeedRounds,
+            &penCanIntronLen,
+            &penNoncanIntronLen);
+
+    al->sc = new Scoring(
+            bonusMatch,
+            penMmcType,
+            penMmcMax,
+            penMmcMin,
+            penScMax,
+            penScMin,
+            scoreMin,
+            nCeil,
+            penNType,
+            penN,
+            penNCatPair,
+            penRdGapConst,
+            penRfGapConst,
+            penRdGapLinear,
+            penRfGapLinear,
+            gGapBarrier,
+            0,                              // canonical splicing penalty
+            12,                             // non-canonical splicing penalty
+            1000000,                        // conflicting splice site penalty
+            &penCanIntronLen,
+            &penNoncanIntronLen);
+
+    al->tpol.init(
+            20,                             // minimum intron length
+            500000,                         // maximum intron length
+            7,
+            14,
+            opt->noSplicedAlignment,
+            false,                          // transcriptome mapping only
+            false,                          // transcript assembly
+            false,                          // XS only
+            false);                         // avoid pseudogenes
+
+    al->gpol.init(
+            16,                             // maximum number of alts tried
+            opt->useHaplotype,
+            hp->altdb->haplotypes().size() > 0 && opt->useHaplotype,
+            false);                         // CODIS
+
+    al->pepol.init(
+            PE_POLICY_FR,
+            gMaxInsert,
+            gMinInsert,
+            false,
+            false,
+            false,
+            true,
+            true,
+            true);
+
+    // Splice sites from the index only, as with --no-temp-splicesite,
+    // so an alignment doesn't depend on the other reads of the batch
+    init_junction_prob();
+    al->ssdb = new SpliceSiteDB(
+            *(hp->ref),
+            al->refnames,
+            true,                           // thread-safe
+            false,                          // write?
+            hp->altdb->hasSpliceSites());   // read?
+    al->ssdb->read(*(hp->gfm), hp->altdb->alts());
+}
+
+void free_aligner(struct ht2_handle *hp)
+{
+    struct ht2_aligner *al = hp->aligner;
+
+    if(al == NULL) {
+        return;
+    }
+
+    if(al->ssdb) {
+        delete al->ssdb;
+    }
+
+    if(al->sc) {
+        delete al->sc;
+    }
+
+    if(al->rref) {
+        delete al->rref;
+    }
+
+    delete al;
+    hp->aligner = NULL;
+}
+
+static bool aln_read_lt(const struct ht2_alignment& a, const struct ht2_alignment& b)
+{
+    return a.read_id < b.read_id;
+}
+
+EXPORT
+ht2_error_t ht2_align_batch(ht2_handle_t handle,
+        size_t count,
+        const char **seqs,
+        const char **quals,
+        struct ht2_align_batch_result **result_ptr)
+{
+    struct ht2_handle *hp = (struct ht2_handle *)handle;
+
+    if(hp == NULL || hp->aligner == NULL || seqs == NULL || hp->options.khits <= 0) {
+        return HT2_ERR;
+    }
+
+    if(quals != NULL) {
+        for(size_t i = 0; i < count; i++) {
+            size_t len = strlen(seqs[i]);
+            if(strlen(quals[i]) != len) {
+                return HT2_ERR;
+            }
+            for(size_t j = 0; j < len; j++) {
+                if(quals[i][j] < 33 || quals[i][j] > 126) {
+                    return HT2_ERR;
+                }
+            }
+        }
+    }
+
+    int nthreads = max(hp->options.nthreads, 1);
+    if((size_t)nthreads > (count + ALIGN_CHUNK_SIZE - 1) / ALIGN_CHUNK_SIZE) {
+        nthreads = max((int)((count + ALIGN_CHUNK_SIZE - 1) / ALIGN_CHUNK_SIZE), 1);
+    }
+
+    // Records go to the sink.  The output queue only sees empty strings
+    OutFileBuf *obuf = new OutFileBuf();
+    OutputQueue oq(*obuf, false, nthreads, nthreads > 1, 0);
+    AlnSinkBatch sink(oq, hp, nthreads);
+
+    struct align_batch batch;
+    batch.hp = hp;
+    batch.count = count;
+    batch.seqs = seqs;
+    batch.quals = quals;
+    batch.next = 0;
+    batch.sink = &sink;
+
+    AutoArray<struct align_worker> workers(nthreads);
+    for(int i = 0; i < nthreads; i++) {
+        workers[i].batch = &batch;
+        workers[i].tid = i;
+    }
+
+    if(nthreads == 1) {
+        align_batch_worker((void *)&workers[0]);
+    } else {
+        AutoArray<tthread::thread*> threads(nthreads);
+        for(int i = 0; i < nthreads; i++) {
+            threads[i] = new tthread::thread(align_batch_worker, (void *)&workers[i]);
+        }
+        for(int i = 0; i < nthreads; i++) {
+            threads[i]->join();
+            delete threads[i];
+        }
+    }
+    delete obuf;
+
+    /* build result */
+    size_t num_alignments = 0;
+    size_t num_cigar_ops = 0;
+    for(int i = 0; i < nthreads; i++) {
+        num_alignments += sink.alignments(i).size();
+        num_cigar_ops += sink.cigar(i).size();
+    }
+
+    size_t result_size = sizeof(struct ht2_align_batch_result)
+        + num_alignments * sizeof(struct ht2_alignment)
+        + num_cigar_ops * sizeof(uint32_t);
+    struct ht2_align_batch_result *result = (struct ht2_align_batch_result *)malloc(result_size);
+    if(result == NULL) {
+        return HT2_ERR;
+    }
+
+    result->count = num_alignments;
+    result->num_cigar_ops = num_cigar_ops;
+    result->alignments = (struct ht2_alignment *)(result + 1);
+    result->cigar = (uint32_t *)(result->alignments + num_alignments);
+
+    struct ht2_alignment *dst = result->alignments;
+    uint32_t *cigar_dst = result->cigar;
+    for(int i = 0; i < nthreads; i++) {
+        const EList<struct ht2_alignment>& alignments = sink.alignments(i);
+        const EList<uint32_t>& cigar = sink.cigar(i);
+        uint32_t cigar_base = (uint32_t)(cigar_dst - result->cigar);
+
+        for(size_t j = 0; j < alignments.size(); j++) {
+            *dst = alignments[j];
+            dst->cigar_offset += cigar_base;
+            dst++;
+        }
+        for(size_t j = 0; j < cigar.size(); j++) {
+            *cigar_dst++ = cigar[j];
+        }
+    }
+    // A thread reports the reads of a chunk in order
+    stable_sort(result->alignments, result->alignments + num_alignments, aln_read_lt);
+
+    *(result_ptr) = result;
+    return HT2_OK;
+}
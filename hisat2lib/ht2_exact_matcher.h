@@ -0,0 +1,232 @@
+/*
+ * Copyright 2018, Chanhee Park <parkchanhee@gmail.com> and Daehwan Kim <infphilo@gmail.com>
+ *
+ * This file is part of HISAT 2.
+ *
+ * HISAT 2 is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * HISAT 2 is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with HISAT 2.  If not, see <http://www.gnu.org/licenses/>.
+ */
+
+#ifndef __HT2_EXACT_MATCHER_H__
+#define __HT2_EXACT_MATCHER_H__
+
+#include "gfm.h"
+#include "reference.h"
+#include "group_walk.h"
+
+/**
+ * State for looking up exact occurrences of a sequence in the GFM for
+ * ht2_index_count() and ht2_index_locate().  A sequence with an N never
+ * matches.  Ranges are found by backward search over the whole
+ * sequence, and the text offsets are resolved with the same GroupWalk
+ * machinery HI_Aligner uses for its seed hits.
+ */
+class ExactMatcher {
+public:
+    ExactMatcher(
+            const GFM<index_t>& gfm,
+            const BitPairReference& ref) :
+        _gfm(gfm),
+        _ref(ref),
+        _gwstate(GW_CAT)
+    {
+        _rnd.init(0);
+    }
+
+    /**
+     * Look up 'seq' on the forward strand only.  Return the number of
+     * occurrences and append at most 'maxelt' of them to 'positions'.
+     */
+    index_t locate(
+            const char *seq,
+            index_t maxelt,
+            EList<struct ht2_position>& positions)
+    {
+        _seq.installChars(seq, strlen(seq));
+        if(!search(_seq, _range, _node_range)) {
+            return 0;
+        }
+
+        if(maxelt > 0) {
+            report(_range, _node_range, maxelt, positions);
+        }
+        return _node_range.second - _node_range.first;
+    }
+
+private:
+    /**
+     * Backward search 'seq' through the GFM.  Return true iff the whole
+     * sequence matches, leaving the BWT range in 'range' and the
+     * corresponding node range in 'node_range'.
+     */
+    bool search(
+            const BTDnaString& seq,
+            pair<index_t, index_t>& range,
+            pair<index_t, index_t>& node_range)
+    {
+        const index_t ftabLen = _gfm.gh().ftabChars();
+        const bool linearFM = _gfm.gh().linearFM();
+        const index_t len = (index_t)seq.length();
+
+        if(len < ftabLen + 1) {
+            return false;
+        }
+        for(index_t i = 0; i < ftabLen; i++) {
+            if(seq[len - 1 - i] > 3) {
+                return false;
+            }
+        }
+        if(!_gfm.ftabLoHi(seq, len - ftabLen, false, range.first, range.second)) {
+            return false;
+        }
+
+        SideLocus<index_t> tloc, bloc;
+        for(index_t dep = ftabLen; dep < len; dep++) {
+            if(range.first >= range.second) {
+                return false;
+            }
+            if(range.second - range.first == 1) {
+                tloc.initFromRow(range.first, _gfm.gh(), _gfm.gfm());
+                bloc.invalidate();
+            } else {
+                SideLocus<index_t>::initFromTopBot(range.first, range.second, _gfm.gh(), _gfm.gfm(), tloc, bloc);
+            }
+
+            int c = seq[len - dep - 1];
+            if(c > 3) {
+                return false;
+            }
+            if(bloc.valid()) {
+                if(linearFM) {
+                    range = _gfm.mapLF(tloc, bloc, c, &node_range);
+                } else {
+                    range = _gfm.mapGLF(tloc, bloc, c, &node_range);
+                }
+            } else {
+                range = _gfm.mapGLF1(range.first, tloc, c, &node_range);
+            }
+        }
+
+        return range.first < range.second && node_range.first < node_range.second;
+    }
+
+    /**
+     * Resolve the reference coordinates of the nodes in the given range
+     * and append up to 'maxelt' distinct positions to 'positions'.  Return
+     * the number of positions added.
+     */
+    index_t report(
+            const pair<index_t, index_t>& range,
+            const pair<index_t, index_t>& node_range,
+            index_t maxelt,
+            EList<struct ht2_position>& positions)
+    {
+        const index_t len = (index_t)_seq.length();
+
+        _node_iedge_count.clear();
+        if(node_range.second - node_range.first < range.second - range.first) {
+            _gfm.getInEdgeCount(range.first, range.second, _node_iedge_count);
+        }
+
+        const size_t first = positions.size();
+        index_t added = 0;
+        index_t edgeIdx = 0;
+        index_t top = range.first;
+        for(index_t node = node_range.first; node < node_range.second && added < maxelt; node++) {
+            index_t bot = top + 1;
+            _tmp_node_iedge_count.clear();
+            if(edgeIdx < _node_iedge_count.size() &&
+               node - node_range.first == _node_iedge_count[edgeIdx].first) {
+                bot += _node_iedge_count[edgeIdx].second;
+                _tmp_node_iedge_count.expand();
+                _tmp_node_iedge_count.back().first = 0;
+                _tmp_node_iedge_count.back().second = _node_iedge_count[edgeIdx].second;
+                edgeIdx++;
+            }
+
+            _offs.resize(1);
+            _offs.fill((index_t)INDEX_MAX);
+            _sas.init(
+                    top,
+                    bot,
+                    node,
+                    node + 1,
+                    _tmp_node_iedge_count,
+                    len,
+                    EListSlice<index_t, 16>(_offs, 0, 1));
+            _gws.init(_gfm, _ref, _sas, _rnd, _wlm);
+
+            WalkResult<index_t> wr;
+            _gws.advanceElement(0, _gfm, _ref, _sas, _gwstate, wr, _wlm, _prm);
+            top = bot;
+
+            index_t tidx = 0, toff = 0, tlen = 0;
+            bool straddled = false;
+            _gfm.joinedToTextOff(
+                    wr.elt.len,
+                    wr.toff,
+                    tidx,
+                    toff,
+                    tlen,
+                    true,       // reject straddlers
+                    straddled);
+            if(tidx == (index_t)INDEX_MAX) {
+                continue;
+            }
+
+            // In a graph index, nodes that differ only beyond the end of
+            // the read resolve to the same reference position
+            bool dup = false;
+            for(size_t i = first; i < positions.size(); i++) {
+                if(positions[i].chr_id == tidx && positions[i].pos == toff) {
+                    dup = true;
+                    break;
+                }
+            }
+            if(dup) {
+                continue;
+            }
+
+            positions.expand();
+            struct ht2_position& p = positions.back();
+            memset(&p, 0, sizeof(p));   // no stale padding in results
+            p.chr_id = tidx;
+            p.direction = 0;
+            p.pos = toff;
+            added++;
+        }
+
+        return added;
+    }
+
+    const GFM<index_t>&         _gfm;
+    const BitPairReference&     _ref;
+
+    BTDnaString                 _seq;
+    pair<index_t, index_t>      _range;
+    pair<index_t, index_t>      _node_range;
+
+    EList<pair<index_t, index_t> > _node_iedge_count;
+    EList<pair<index_t, index_t> > _tmp_node_iedge_count;
+
+    EList<index_t, 16>                                 _offs;
+    SARangeWithOffs<EListSlice<index_t, 16>, index_t>  _sas;
+    GroupWalk2S<index_t, EListSlice<index_t, 16>, 16>  _gws;
+    GroupWalkState<index_t>                            _gwstate;
+
+    RandomSource                _rnd;
+    WalkMetrics                 _wlm;
+    PerReadMetrics              _prm;
+};
+
+#endif /* __HT2_EXACT_MATCHER_H__ */
@@ -37,11 +37,19 @@ struct ht2_handle {
     HGFM<TIndexOffU, local_index_t>* gfm;
     RFM<TIndexOffU> *rgfm;
 
+    BitPairReference* ref;
+
     string tmp_str;
 
     string ht2_idx_name;
 
     struct ht2_options options; 
+
+    struct ht2_aligner *aligner;
 };
 
+/* ht2_alignment.cpp */
+void init_aligner(struct ht2_handle *hp);
+void free_aligner(struct ht2_handle *hp);
+
 #endif /* __HT2_HANDLE_H__ */
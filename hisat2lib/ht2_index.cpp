@@ -25,6 +25,7 @@
 
 #include "ht2.h"
 #include "ht2_handle.h"
+#include "ht2_exact_matcher.h"
 
 
 EXPORT
@@ -78,3 +79,129 @@ ht2_error_t ht2_index_getrefnames(ht2_handle_t handle, struct ht2_index_getrefna
 
     return HT2_OK;
 }
+
+
+EXPORT
+uint64_t ht2_index_getreflength(ht2_handle_t handle, uint32_t chr_id)
+{
+    struct ht2_handle *hp = (struct ht2_handle *)handle;
+
+    if(chr_id >= hp->gfm->nPat()) {
+        return 0;
+    }
+
+    return hp->gfm->plen()[chr_id];
+}
+
+
+EXPORT
+ht2_error_t ht2_index_getsequence(ht2_handle_t handle,
+        uint32_t chr_id,
+        uint64_t start,
+        uint64_t len,
+        struct ht2_index_getsequence_result **result_ptr)
+{
+    struct ht2_handle *hp = (struct ht2_handle *)handle;
+
+    if(hp->ref == NULL || chr_id >= hp->gfm->nPat()) {
+        return HT2_ERR;
+    }
+
+    uint64_t reflen = hp->gfm->plen()[chr_id];
+    if(start > reflen || len > reflen - start) {
+        return HT2_ERR;
+    }
+
+    /* getStretch() needs some room around the bases it writes */
+    struct ht2_index_getsequence_result *result =
+        (struct ht2_index_getsequence_result *)malloc(sizeof(struct ht2_index_getsequence_result) + len + 16);
+    if(result == NULL) {
+        return HT2_ERR;
+    }
+    result->len = len;
+
+    /* the reference store leaves off trailing Ns */
+    uint64_t stored_len = hp->ref->approxLen(chr_id);
+    uint64_t fetch_len = 0;
+    if(start < stored_len) {
+        fetch_len = min(len, stored_len - start);
+    }
+
+    if(fetch_len > 0) {
+        ASSERT_ONLY(SStringExpandable<uint32_t> destU32);
+        int off = hp->ref->getStretch(
+                (uint32_t *)result->bases,
+                chr_id,
+                start,
+                fetch_len
+                ASSERT_ONLY(, destU32));
+        memmove(result->bases, result->bases + off, fetch_len);
+    }
+    memset(result->bases + fetch_len, 4, len - fetch_len);
+
+    (*result_ptr) = result;
+
+    return HT2_OK;
+}
+
+
+EXPORT
+uint32_t ht2_index_minlength(ht2_handle_t handle)
+{
+    struct ht2_handle *hp = (struct ht2_handle *)handle;
+
+    return hp->gfm->gh().ftabChars() + 1;
+}
+
+
+EXPORT
+ht2_error_t ht2_index_count(ht2_handle_t handle, const char *seq, uint64_t *count)
+{
+    struct ht2_handle *hp = (struct ht2_handle *)handle;
+
+    if(hp->ref == NULL || strlen(seq) < ht2_index_minlength(handle)) {
+        return HT2_ERR;
+    }
+
+    ExactMatcher matcher(*(hp->gfm), *(hp->ref));
+    EList<struct ht2_position> positions;
+
+    (*count) = matcher.locate(seq, 0, positions);
+
+    return HT2_OK;
+}
+
+
+EXPORT
+ht2_error_t ht2_index_locate(ht2_handle_t handle,
+        const char *seq,
+        uint64_t max_hits,
+        struct ht2_index_locate_result **result_ptr)
+{
+    struct ht2_handle *hp = (struct ht2_handle *)handle;
+
+    if(hp->ref == NULL || strlen(seq) < ht2_index_minlength(handle)) {
+        return HT2_ERR;
+    }
+
+    ExactMatcher matcher(*(hp->gfm), *(hp->ref));
+    EList<struct ht2_position> positions;
+
+    index_t num_hits = matcher.locate(seq, (index_t)min<uint64_t>(max_hits, INDEX_MAX), positions);
+
+    size_t result_size = sizeof(struct ht2_index_locate_result) + positions.size() * sizeof(struct ht2_position);
+    struct ht2_index_locate_result *result = (struct ht2_index_locate_result *)malloc(result_size);
+    if(result == NULL) {
+        return HT2_ERR;
+    }
+
+    result->num_hits = num_hits;
+    result->count = positions.size();
+    for(size_t i = 0; i < positions.size(); i++) {
+        result->positions[i] = positions[i];
+    }
+
+    (*result_ptr) = result;
+
+    return HT2_OK;
+}
@@ -31,6 +31,9 @@ using namespace std;
 
 MemoryTally gMemTally;
 
+extern void initializeCntLut();
+extern void initializeCntBit();
+
 static const struct ht2_options ht2_default_options = {
     .offRate = -1,
 
@@ -44,10 +47,15 @@ static const struct ht2_options ht2_default_options = {
     .sanityCheck = 0,
 
     .useHaplotype = false,
+
+    .nthreads = 1,
+    .khits = 5,
 };
 
 static void free_handle(struct ht2_handle *hp)
 {
+    free_aligner(hp);
+
     if(hp->altdb) {
         delete hp->altdb;
     }
@@ -74,6 +82,10 @@ static void free_handle(struct ht2_handle *hp)
         delete hp->rgfm;
     }
 
+    if(hp->ref) {
+        delete hp->ref;
+    }
+
     delete hp;
 }
 
@@ -156,12 +168,87 @@ static void init_handle(struct ht2_handle *hp)
             opt->startVerbose);
 
     hp->repeatdb->construct(hp->gfm->rstarts(), hp->gfm->nFrag());
+
+    // Load the bitpair reference for resolving alignments
+    hp->ref = new BitPairReference(
+            hp->ht2_idx_name,
+            NULL,
+            false,
+            opt->sanityCheck,
+            NULL,
+            NULL,
+            false,
+            opt->useMm,
+            opt->useShmem,
+            opt->mmSweep,
+            opt->gVerbose,
+            opt->startVerbose);
+    if(!hp->ref->loaded()) {
+        throw 1;
+    }
+
+    init_aligner(hp);
+}
+
+/**
+ * Check that the memory options can be honored by this build.
+ * --shmem takes precedence over --mm as in hisat2.
+ */
+static bool check_options(struct ht2_options *opt)
+{
+#ifndef BOWTIE_MM
+    if(opt->useMm) {
+        cerr << "ht2lib: " << "Memory-mapped I/O is not supported by this build" << endl;
+        return false;
+    }
+#endif
+#ifndef BOWTIE_SHARED_MEM
+    if(opt->useShmem) {
+        cerr << "ht2lib: " << "Shared memory is not supported by this build" << endl;
+        return false;
+    }
+#endif
+    if(opt->useShmem && opt->useMm) {
+        cerr << "ht2lib: " << "Warning: useShmem overrides useMm" << endl;
+        opt->useMm = false;
+    }
+    return true;
+}
+
+/**
+ * Return true iff the index files can be opened.  The GFM readers
+ * report a missing file but carry on reading from it.
+ */
+static bool check_index_files(const string& name)
+{
+    const string files[] = {
+        name + ".1." + gfm_ext,
+        name + ".2." + gfm_ext,
+        name + ".3." + gfm_ext,
+        name + ".4." + gfm_ext,
+        name + ".5." + gfm_ext,
+        name + ".6." + gfm_ext,
+        name + ".7." + gfm_ext,
+        name + ".8." + gfm_ext,
+        name + ".rep.1." + gfm_ext,
+        name + ".rep.2." + gfm_ext,
+    };
+
+    for(size_t i = 0; i < sizeof(files) / sizeof(files[0]); i++) {
+        FILE *fp = fopen(files[i].c_str(), "rb");
+        if(fp == NULL) {
+            cerr << "ht2lib: " << "Could not open index file " << files[i] << endl;
+            return false;
+        }
+        fclose(fp);
+    }
+    return true;
 }
 
 EXPORT
 ht2_handle_t ht2_init(const char *name, ht2_option_t *options)
 {
-    struct ht2_handle *handle = new ht2_handle;
+    struct ht2_handle *handle = new ht2_handle();
 
     handle->ht2_idx_name = name;
     if(options) {
@@ -170,8 +257,22 @@ ht2_handle_t ht2_init(const char *name, ht2_option_t *options)
         memcpy(&handle->options, &ht2_default_options, sizeof(struct ht2_options));
     }
 
+    if(!check_options(&handle->options) || !check_index_files(handle->ht2_idx_name)) {
+        delete handle;
+        return NULL;
+    }
+
+    initializeCntLut();
+    initializeCntBit();
+
     // Init
-    init_handle(handle);
+    try {
+        init_handle(handle);
+    } catch(...) {
+        cerr << "ht2lib: " << "Can't load index " << name << endl;
+        free_handle(handle);
+        return NULL;
+    }
 
     handle->tmp_str = name;
 
@@ -48,6 +48,55 @@ void ht2_repeat_dump_repeatmap(ht2_handle_t handle)
 }
 
 
+/**
+ * Append the reference coordinates of [left, right) on repeat 'rep_id'
+ * to 'positions'.  Return false if the range is not a repeat.
+ */
+static bool repeat_get_coords(struct ht2_handle *hp,
+        index_t rep_id,
+        TIndexOffU left,
+        TIndexOffU right,
+        EList<index_t>& snp_id_list,
+        EList<pair<RepeatCoord<index_t>, RepeatCoord<index_t> > >& positions)
+{
+    bool ret = hp->repeatdb->repeatExist(rep_id, left, right);
+    if(!ret) {
+        return false;
+    }
+
+    snp_id_list.clear();
+
+    hp->repeatdb->getCoords(
+            rep_id,
+            left, right,
+            snp_id_list,
+            *(hp->raltdb),
+            positions
+            );
+
+    return true;
+}
+
+EXPORT
+ht2_error_t ht2_repeat_getid(ht2_handle_t handle,
+        const char *repeat_name,
+        uint32_t *rep_id)
+{
+    struct ht2_handle *hp = (struct ht2_handle *)handle;
+
+    if(hp->rgfm->empty()) {
+        return HT2_ERR_NOT_REPEAT;
+    }
+
+    index_t id = hp->rgfm->getLocalRFM_idx(repeat_name);
+    if(hp->rgfm->getLocalRFM(id).refnames()[0].compare(repeat_name) != 0) {
+        return HT2_ERR_NOT_REPEAT;
+    }
+
+    *rep_id = id;
+    return HT2_OK;
+}
+
 EXPORT
 ht2_error_t ht2_repeat_expand(ht2_handle_t handle,
         const char *repeat_name,
@@ -57,30 +106,23 @@ ht2_error_t ht2_repeat_expand(ht2_handle_t handle,
 {
     struct ht2_handle *hp = (struct ht2_handle *)handle;
 
-    index_t rep_id = hp->rgfm->getLocalRFM_idx(repeat_name);
+    uint32_t rep_id;
+    ht2_error_t ret = ht2_repeat_getid(handle, repeat_name, &rep_id);
+    if(ret != HT2_OK) {
+        return ret;
+    }
 
     TIndexOffU left = repeat_pos;
     TIndexOffU right = left + repeat_len;
 
-    bool ret = hp->repeatdb->repeatExist(rep_id, left, right);
-    if(!ret) {
-        return HT2_ERR_NOT_REPEAT;
-    }
-
-
     /* get coord */
     EList<pair<RepeatCoord<index_t>, RepeatCoord<index_t> > > positions;
 
     EList<index_t> snp_id_list;
-    snp_id_list.clear();
 
-    hp->repeatdb->getCoords(
-            rep_id,
-            left, right,
-            snp_id_list,
-            *(hp->raltdb),
-            positions
-            );
+    if(!repeat_get_coords(hp, rep_id, left, right, snp_id_list, positions)) {
+        return HT2_ERR_NOT_REPEAT;
+    }
 
     /* build result */
     size_t result_size = sizeof(struct ht2_repeat_expand_result) + positions.size() * sizeof(struct ht2_position);
@@ -101,3 +143,67 @@ ht2_error_t ht2_repeat_expand(ht2_handle_t handle,
     return HT2_OK;
 }
 
+EXPORT
+ht2_error_t ht2_repeat_expand_many(ht2_handle_t handle,
+        size_t count,
+        const uint32_t *rep_ids,
+        const uint64_t *repeat_pos,
+        const uint64_t *repeat_len,
+        struct ht2_repeat_expand_many_result **result_ptr)
+{
+    struct ht2_handle *hp = (struct ht2_handle *)handle;
+
+    EList<pair<RepeatCoord<index_t>, RepeatCoord<index_t> > > positions;
+    EList<index_t> snp_id_list;
+
+    EList<uint64_t> offsets;
+    EList<struct ht2_position> expanded;
+
+    offsets.resizeExact(count + 1);
+    offsets[0] = 0;
+    for(size_t i = 0; i < count; i++) {
+        TIndexOffU left = repeat_pos[i];
+        TIndexOffU right = left + repeat_len[i];
+
+        positions.clear();
+        if(repeat_get_coords(hp, rep_ids[i], left, right, snp_id_list, positions)) {
+            for(size_t j = 0; j < positions.size(); j++) {
+                const RepeatCoord<index_t>& coord = positions[j].first;
+
+                expanded.expand();
+                expanded.back().chr_id = coord.tid;
+                expanded.back().pos = coord.toff;
+                expanded.back().direction = coord.fw ? 0 : 1;
+            }
+        }
+        offsets[i + 1] = expanded.size();
+    }
+
+    /* build result; all arrays share a single allocation */
+    size_t num_positions = expanded.size();
+    size_t result_size = sizeof(struct ht2_repeat_expand_many_result)
+        + (count + 1) * sizeof(uint64_t)
+        + num_positions * (sizeof(uint64_t) + sizeof(uint32_t) + sizeof(uint8_t));
+
+    struct ht2_repeat_expand_many_result *result = (struct ht2_repeat_expand_many_result *)malloc(result_size);
+    if(result == NULL) {
+        return HT2_ERR;
+    }
+
+    result->count = count;
+    result->num_positions = num_positions;
+    result->offsets = (uint64_t *)(result + 1);
+    result->positions = result->offsets + (count + 1);
+    result->chr_ids = (uint32_t *)(result->positions + num_positions);
+    result->directions = (uint8_t *)(result->chr_ids + num_positions);
+
+    memcpy(result->offsets, offsets.ptr(), (count + 1) * sizeof(uint64_t));
+    for(size_t i = 0; i < num_positions; i++) {
+        result->positions[i] = expanded[i].pos;
+        result->chr_ids[i] = expanded[i].chr_id;
+        result->directions[i] = expanded[i].direction;
+    }
+
+    *(result_ptr) = result;
+    return HT2_OK;
+}
@@ -150,6 +150,8 @@ static jobject conv_ht2option(JNIEnv *env, ht2_option_t *opts)
 	HT2_OPT_BUILD(startVerbose);
 	HT2_OPT_BUILD(sanityCheck);
 	HT2_OPT_BUILD(useHaplotype);
+	HT2_OPT_BUILD(nthreads);
+	HT2_OPT_BUILD(khits);
 
 	return hashMap;
 }
@@ -177,6 +179,8 @@ static void update_ht2option(JNIEnv *env, ht2_option_t *opts, jobject jmapObject
 	HT2_OPT_UPDATE(startVerbose);
 	HT2_OPT_UPDATE(sanityCheck);
 	HT2_OPT_UPDATE(useHaplotype);
+	HT2_OPT_UPDATE(nthreads);
+	HT2_OPT_UPDATE(khits);
 }
 
 
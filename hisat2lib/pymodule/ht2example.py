@@ -1,4 +1,4 @@
-#!/usr/bin/python
+#!/usr/bin/env python3
 
 #
 # Copyright 2018, Chanhee Park <parkchanhee@gmail.com> and Daehwan Kim <infphilo@gmail.com>
@@ -19,10 +19,14 @@
 # along with HISAT 2.  If not, see <http://www.gnu.org/licenses/>.
 
 #
-# ./setup.py build
-# ./setup.py install
+# make lib
+#   or
+# pip install .
 #
-import ht2py 
+import array
+import struct
+
+import ht2py
 
 # Path to index
 ht2_index = '../../evaluation/indexes/HISAT2_22/22_rep'
@@ -30,39 +34,72 @@ ht2_index = '../../evaluation/indexes/HISAT2_22/22_rep'
 # Get default options
 ht2_options = ht2py.get_options()
 
-print ht2_options
+print(ht2_options)
 ht2_options['gVerbose'] = 1
 ht2_options['startVerbose'] = 1
+# share one copy of the index between processes
+#ht2_options['useMm'] = 1
+#ht2_options['useShmem'] = 1
 # or
-ht2_options = {}
+ht2_options = None
+
+bases = bytes.maketrans(b'\x00\x01\x02\x03\x04', b'ACGTN')
+
+def strand(direction):
+    return '-' if direction == 1 else '+'
+
+with ht2py.Index(ht2_index, ht2_options) as index:
+    # names are decoded as they are used
+    refnames = index.refnames
+    print(refnames[0])
+
+    # outofindex
+    #print(refnames[len(refnames)])
+
+    # repeat expansion
+    #   positions are (chr_id, direction, pos) records in struct format POSITION_FORMAT
+    positions = index.repeat_expand('rep100-300', 8308, 100)
 
-handle = ht2py.init(ht2_index, ht2_options)
+    for chr_id, direction, chr_pos in struct.iter_unpack(ht2py.POSITION_FORMAT, positions):
+        print(refnames[chr_id].split()[0] + ':' + str(chr_pos) + ':' + strand(direction))
 
-print ht2py.index_getrefnamebyid(handle, 0)
+    # expand many repeat coordinates at once
+    #   results are typed memoryviews; numpy.frombuffer(offsets, dtype=numpy.uint64) also works
+    rep_id = index.repeat_getid('rep100-300')
+    rep_ids = array.array('I', [rep_id] * 3)
+    rep_pos = array.array('L', [8308, 8408, 8508])
+    rep_len = array.array('L', [100, 100, 100])
 
-#print ht2py.index_getrefnamebyid(handle, 0, 1, 3, 5, 7, 9)
-# outofindex
-#print ht2py.index_getrefnamebyid(handle, 1)
-#print ht2py.index_getrefnamebyid(handle, -1)
+    offsets, chr_ids, directions, chr_positions = index.repeat_expand_many(rep_ids, rep_pos, rep_len)
 
-refnames = ht2py.index_getrefnames(handle)
+    for i in range(len(rep_ids)):
+        for j in range(offsets[i], offsets[i + 1]):
+            print(str(i) + '\t' + refnames[chr_ids[j]].split()[0] + ':' + str(chr_positions[j]) + ':' + strand(directions[j]))
 
-#for name in refnames:
-#    print name
+    # reference sequence, straight from the index
+    #   one base per byte; numpy.frombuffer(seq, dtype=numpy.uint8) also works
+    seq = index.sequence(0, 1000, 60)
+    print(refnames[0].split()[0] + ':1000-1060\t' + seq.tobytes().translate(bases).decode())
 
-# repeat expansion
-positions = ht2py.repeat_expand(handle, 'rep100-300', 8308, 100) 
+    # exact matches of a sequence on the forward strand
+    num_hits, positions = index.locate('GAGACATGCTCACTCATAGGG', 10)
+    print('count: ' + str(index.count('GAGACATGCTCACTCATAGGG')) + ', found: ' + str(num_hits))
 
-for pos in positions:
-    chr_id = pos[0]
-    direction = pos[1]
-    chr_pos = pos[2]
+    for chr_id, direction, chr_pos in struct.iter_unpack(ht2py.POSITION_FORMAT, positions):
+        print(refnames[chr_id].split()[0] + ':' + str(chr_pos))
 
-    chr_dir = '+'
-    if direction == 1:
-        chr_dir = '-'
+    # spliced alignment of a batch of reads, as hisat2 -k 5 reports them
+    #   (read_id, chr_id, pos, flag, mapq, xs, score, nm, nh, cigar_offset, cigar_count)
+    #   records in struct format ALIGNMENT_FORMAT, and the CIGARs in BAM encoding
+    reads = ['GAGACATGCTCACTCATAGGGCTGCTGCTTGTCTTCAGAGATGAGAATACAGACCTCTGAGTTCACA',
+             'TGTGAACTCAGAGGTCTGTATTCTCATCTCTGAAGACAAGCAGCAGCCCTATGAGTGAGCATGTCTC']
+    alignments, cigar = index.align(reads)
 
-    print refnames[chr_id].split()[0] + ":" + str(chr_pos) + ':' + chr_dir
+    for read_id, chr_id, chr_pos, flag, mapq, xs, score, nm, nh, cigar_offset, cigar_count in struct.iter_unpack(ht2py.ALIGNMENT_FORMAT, alignments):
+        cigar_str = ''.join(str(op >> 4) + 'MIDNSHP=X'[op & 15] for op in cigar[cigar_offset:cigar_offset + cigar_count])
+        print(str(read_id) + '\t' + refnames[chr_id].split()[0] + ':' + str(chr_pos) + ':' + strand((flag >> 4) & 1) + '\t' + cigar_str + '\tNH:' + str(nh))
 
-# close handle
+# the older handle interface still works
+handle = ht2py.init(ht2_index)
+print(ht2py.index_getrefnamebyid(handle, 0))
 ht2py.close(handle)
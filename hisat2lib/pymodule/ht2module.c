@@ -16,61 +16,414 @@
  * You should have received a copy of the GNU General Public License
  * along with HISAT 2.  If not, see <http://www.gnu.org/licenses/>.
  */
-#include <stdarg.h>
+#define PY_SSIZE_T_CLEAN
 #include <Python.h>
+#include <stdarg.h>
+#include <ctype.h>
+#include <string.h>
 
 #include "ht2.h"
 
 #define HT2_HANDLE_ID "handle"
 
+/* struct formats of the records in result buffers */
+#define HT2_POSITION_FORMAT     "IiQ"       /* struct ht2_position */
+#define HT2_ALIGNMENT_FORMAT    "IIQHBciIIII"   /* struct ht2_alignment */
+
 #ifdef DEBUG
 #define DEBUGLOG(fmt, ...) do { fprintf(stderr, "%s:%d:%s(): " fmt, __FILE__, __LINE__, __func__, ##__VA_ARGS__);  } while(0) 
 #else
 #define DEBUGLOG(fmt, ...) 
 #endif
 
-static ht2_handle_t get_handle(PyObject *cap)
+/*
+ * ht2py.Index owns a handle and closes it when it goes away.
+ */
+typedef struct {
+    PyObject_HEAD
+    ht2_handle_t handle;
+    int busy;               /* calls using the handle without the GIL */
+    PyObject *refnames;     /* built on first use */
+} ht2py_Index;
+
+static PyTypeObject ht2py_IndexType;
+
+static PyObject *ht2py_Index_close(PyObject *self, PyObject *unused);
+
+/*
+ * Return the handle of a capsule from ht2py.init() or of an ht2py.Index.
+ * Return NULL with an exception set otherwise.
+ */
+static ht2_handle_t get_handle(PyObject *obj)
+{
+    if(PyObject_TypeCheck(obj, &ht2py_IndexType)) {
+        ht2py_Index *index = (ht2py_Index *)obj;
+        if(index->handle == NULL) {
+            PyErr_SetString(PyExc_ValueError, "index is closed");
+        }
+        return index->handle;
+    }
+
+	return PyCapsule_GetPointer(obj, HT2_HANDLE_ID);
+}
+
+/*
+ * Keep an ht2py.Index from being closed while its handle is used without the GIL.
+ */
+static void hold_index(PyObject *obj)
+{
+    if(PyObject_TypeCheck(obj, &ht2py_IndexType)) {
+        ((ht2py_Index *)obj)->busy++;
+    }
+}
+
+static void release_index(PyObject *obj)
+{
+    if(PyObject_TypeCheck(obj, &ht2py_IndexType)) {
+        ((ht2py_Index *)obj)->busy--;
+    }
+}
+
+#define HT2_BEGIN_CALL(_obj) \
+    hold_index(_obj); \
+    Py_BEGIN_ALLOW_THREADS
+
+#define HT2_END_CALL(_obj) \
+    Py_END_ALLOW_THREADS \
+    release_index(_obj);
+
+/*
+ * Read-only buffer over a result allocated by hisat2lib.
+ * The result is released by free() when the last view of it goes away,
+ * so results reach memoryview or numpy without being copied.
+ * Buffers over parts of one result share it through 'base'.
+ */
+typedef struct {
+    PyObject_HEAD
+    void *result;
+    PyObject *base;         /* buffer that owns 'result', or NULL */
+    char *buf;
+    Py_ssize_t count;       /* number of items */
+    Py_ssize_t itemsize;
+    const char *format;
+} ht2py_ResultBuffer;
+
+static void ht2py_result_buffer_dealloc(PyObject *obj)
+{
+    ht2py_ResultBuffer *self = (ht2py_ResultBuffer *)obj;
+
+    if(self->base) {
+        Py_DECREF(self->base);
+    } else {
+        free(self->result);
+    }
+    Py_TYPE(obj)->tp_free(obj);
+}
+
+static int ht2py_result_buffer_getbuffer(PyObject *obj, Py_buffer *view, int flags)
+{
+    ht2py_ResultBuffer *self = (ht2py_ResultBuffer *)obj;
+
+    if(PyBuffer_FillInfo(view, obj, self->buf, self->count * self->itemsize, 1, flags) < 0) {
+        return -1;
+    }
+
+    /* without PyBUF_FORMAT the consumer sees unsigned bytes */
+    if((flags & PyBUF_FORMAT) == PyBUF_FORMAT) {
+        view->format = (char *)self->format;
+        view->itemsize = self->itemsize;
+        if((flags & PyBUF_ND) == PyBUF_ND) {
+            view->shape = &self->count;
+        }
+    }
+
+    return 0;
+}
+
+static PyBufferProcs ht2py_result_buffer_procs = {
+    .bf_getbuffer = ht2py_result_buffer_getbuffer,
+};
+
+static PyTypeObject ht2py_ResultBufferType = {
+    PyVarObject_HEAD_INIT(NULL, 0)
+    .tp_name = "ht2py.ResultBuffer",
+    .tp_basicsize = sizeof(ht2py_ResultBuffer),
+    .tp_dealloc = ht2py_result_buffer_dealloc,
+    .tp_as_buffer = &ht2py_result_buffer_procs,
+    .tp_flags = Py_TPFLAGS_DEFAULT,
+    .tp_doc = "Read-only buffer over a hisat2lib result",
+};
+
+/*
+ * Return a buffer of 'count' items at 'buf'.
+ * It owns 'result' if 'base' is NULL and shares the result of 'base' otherwise.
+ * An owned 'result' is released on failure as well.
+ */
+static PyObject *new_result_buffer(void *result, PyObject *base, void *buf, Py_ssize_t count, Py_ssize_t itemsize, const char *format)
+{
+    ht2py_ResultBuffer *rb = NULL;
+
+    rb = PyObject_New(ht2py_ResultBuffer, &ht2py_ResultBufferType);
+    if(rb == NULL) {
+        if(base == NULL) {
+            free(result);
+        }
+        return NULL;
+    }
+
+    Py_XINCREF(base);
+    rb->result = result;
+    rb->base = base;
+    rb->buf = (char *)buf;
+    rb->count = count;
+    rb->itemsize = itemsize;
+    rb->format = format;
+
+    return (PyObject *)rb;
+}
+
+/*
+ * Return a memoryview of a buffer from new_result_buffer() and drop the buffer.
+ */
+static PyObject *conv_result_view(PyObject *rb)
 {
-	return PyCapsule_GetPointer(cap, HT2_HANDLE_ID);
+    PyObject *view = NULL;
+
+    if(rb == NULL) {
+        return NULL;
+    }
+
+    view = PyMemoryView_FromObject(rb);
+    Py_DECREF(rb);
+
+    return view;
+}
+
+static PyObject *conv_result_buffer(void *result, void *buf, Py_ssize_t count, Py_ssize_t itemsize, const char *format)
+{
+    return conv_result_view(new_result_buffer(result, NULL, buf, count, itemsize, format));
+}
+
+/*
+ * Reference names, decoded one at a time from the single block
+ * ht2_index_getrefnames() returns.
+ */
+typedef struct {
+    PyObject_HEAD
+    struct ht2_index_getrefnames_result *result;
+} ht2py_RefNames;
+
+static void ht2py_refnames_dealloc(PyObject *obj)
+{
+    ht2py_RefNames *self = (ht2py_RefNames *)obj;
+
+    free(self->result);
+    Py_TYPE(obj)->tp_free(obj);
+}
+
+static Py_ssize_t ht2py_refnames_length(PyObject *obj)
+{
+    ht2py_RefNames *self = (ht2py_RefNames *)obj;
+
+    return self->result ? self->result->count : 0;
+}
+
+static PyObject *ht2py_refnames_item(PyObject *obj, Py_ssize_t i)
+{
+    ht2py_RefNames *self = (ht2py_RefNames *)obj;
+
+    if(i < 0 || i >= ht2py_refnames_length(obj)) {
+        PyErr_SetString(PyExc_IndexError, "reference id out of range");
+        return NULL;
+    }
+
+    const char *name = self->result->names[i];
+    return PyUnicode_DecodeUTF8(name, strlen(name), "surrogateescape");
 }
 
+static PySequenceMethods ht2py_refnames_as_sequence = {
+    .sq_length = ht2py_refnames_length,
+    .sq_item = ht2py_refnames_item,
+};
+
+static PyTypeObject ht2py_RefNamesType = {
+    PyVarObject_HEAD_INIT(NULL, 0)
+    .tp_name = "ht2py.RefNames",
+    .tp_basicsize = sizeof(ht2py_RefNames),
+    .tp_dealloc = ht2py_refnames_dealloc,
+    .tp_as_sequence = &ht2py_refnames_as_sequence,
+    .tp_flags = Py_TPFLAGS_DEFAULT,
+    .tp_doc = "Reference names of an index",
+};
+
+/*
+ * Return a sequence of the names in 'result' and take ownership of it.
+ */
 static PyObject *conv_refnames_result(struct ht2_index_getrefnames_result *result)
 {
-    PyObject *refnames = NULL;
-    size_t i = 0;
+    ht2py_RefNames *refnames = NULL;
+
+    refnames = PyObject_New(ht2py_RefNames, &ht2py_RefNamesType);
+    if(refnames == NULL) {
+        free(result);
+        return NULL;
+    }
+    refnames->result = result;
 
+    return (PyObject *)refnames;
+}
+
+static PyObject *conv_repeat_expand_result(struct ht2_repeat_expand_result *result)
+{
     if(result == NULL) {
         return NULL;
     }
 
-    refnames = PyList_New(result->count);
-    for(i = 0; i < result->count; i++) {
-        PyObject *str = PyString_FromString(result->names[i]);
-        PyList_SetItem(refnames, i, str);
+    return conv_result_buffer(result, result->positions, result->count, sizeof(struct ht2_position), HT2_POSITION_FORMAT);
+}
+
+/*
+ * Copy a one-dimensional integer buffer (array.array, NumPy array, ...)
+ * into a newly allocated uint64_t array.
+ * Return the number of items, or -1 with an exception set.
+ */
+static Py_ssize_t conv_index_buffer(PyObject *obj, uint64_t **dst)
+{
+    Py_buffer view;
+    Py_ssize_t i = 0;
+    Py_ssize_t n = 0;
+    const char *fmt = NULL;
+    const char *buf = NULL;
+
+    if(PyObject_GetBuffer(obj, &view, PyBUF_C_CONTIGUOUS | PyBUF_FORMAT) < 0) {
+        return -1;
+    }
+
+    fmt = view.format ? view.format : "B";
+    if(*fmt == '@' || *fmt == '=' || *fmt == '<') {
+        fmt++;
+    }
+    if(view.ndim != 1 || strlen(fmt) != 1 || strchr("bBhHiIlLqQ", *fmt) == NULL) {
+        PyErr_SetString(PyExc_TypeError, "expected a one-dimensional integer array");
+        PyBuffer_Release(&view);
+        return -1;
+    }
+
+    n = view.len / view.itemsize;
+    *dst = (uint64_t *)PyMem_Malloc(sizeof(uint64_t) * (n + 1));
+    if(*dst == NULL) {
+        PyBuffer_Release(&view);
+        PyErr_NoMemory();
+        return -1;
     }
 
-    return refnames;
+#define CONV_INDEX_ITEM(_type) \
+    do { \
+        _type v = *(const _type *)(buf + i * view.itemsize); \
+        if(v < 0) { \
+            goto negative; \
+        } \
+        (*dst)[i] = (uint64_t)v; \
+    } while(0)
+
+    buf = (const char *)view.buf;
+    for(i = 0; i < n; i++) {
+        switch(view.itemsize) {
+            case 1:
+                if(*fmt == 'b') CONV_INDEX_ITEM(int8_t); else CONV_INDEX_ITEM(uint8_t);
+                break;
+            case 2:
+                if(*fmt == 'h') CONV_INDEX_ITEM(int16_t); else CONV_INDEX_ITEM(uint16_t);
+                break;
+            case 4:
+                if(islower(*fmt)) CONV_INDEX_ITEM(int32_t); else CONV_INDEX_ITEM(uint32_t);
+                break;
+            default:
+                if(islower(*fmt)) CONV_INDEX_ITEM(int64_t); else CONV_INDEX_ITEM(uint64_t);
+                break;
+        }
+    }
+
+    PyBuffer_Release(&view);
+    return n;
+
+negative:
+    PyBuffer_Release(&view);
+    PyMem_Free(*dst);
+    *dst = NULL;
+    PyErr_SetString(PyExc_ValueError, "negative value in index array");
+    return -1;
 }
 
-static PyObject *conv_repeat_expand_result(struct ht2_repeat_expand_result *result)
+static PyObject *conv_repeat_expand_many_result(struct ht2_repeat_expand_many_result *result)
 {
-    PyObject *positions = NULL;
-    size_t i = 0;
+    PyObject *owner = NULL;
+    PyObject *expanded = NULL;
 
     if(result == NULL) {
         return NULL;
     }
 
-    positions = PyList_New(result->count);
-    for(i = 0; i < result->count; i++) {
-        struct ht2_position *htpos = &result->positions[i];
+    /* the columns share the one allocation */
+    owner = new_result_buffer(result, NULL, result, 0, 1, "B");
+    if(owner == NULL) {
+        return NULL;
+    }
+
+    expanded = Py_BuildValue("(N N N N)",
+            conv_result_view(new_result_buffer(result, owner, result->offsets, result->count + 1, sizeof(uint64_t), "Q")),
+            conv_result_view(new_result_buffer(result, owner, result->chr_ids, result->num_positions, sizeof(uint32_t), "I")),
+            conv_result_view(new_result_buffer(result, owner, result->directions, result->num_positions, sizeof(uint8_t), "B")),
+            conv_result_view(new_result_buffer(result, owner, result->positions, result->num_positions, sizeof(uint64_t), "Q")));
+    Py_DECREF(owner);
+
+    return expanded;
+}
+
+static PyObject *conv_align_batch_result(struct ht2_align_batch_result *result)
+{
+    PyObject *owner = NULL;
+    PyObject *alignments = NULL;
 
-        PyList_SetItem(positions, i, 
-                Py_BuildValue("(III)", htpos->chr_id, htpos->direction, htpos->pos)
-                );
+    if(result == NULL) {
+        return NULL;
+    }
+
+    /* the alignments and their CIGARs share the one allocation */
+    owner = new_result_buffer(result, NULL, result, 0, 1, "B");
+    if(owner == NULL) {
+        return NULL;
     }
 
-    return positions;
+    alignments = Py_BuildValue("(N N)",
+            conv_result_view(new_result_buffer(result, owner, result->alignments, result->count, sizeof(struct ht2_alignment), HT2_ALIGNMENT_FORMAT)),
+            conv_result_view(new_result_buffer(result, owner, result->cigar, result->num_cigar_ops, sizeof(uint32_t), "I")));
+    Py_DECREF(owner);
+
+    return alignments;
+}
+
+/*
+ * Collect the strings (str or bytes) of a tuple into 'strs'.
+ * Return 0 on success, -1 with an exception set otherwise.
+ */
+static int conv_string_list(PyObject *seq, const char **strs, Py_ssize_t count)
+{
+    Py_ssize_t i = 0;
+
+    for(i = 0; i < count; i++) {
+        PyObject *item = PyTuple_GET_ITEM(seq, i);
+        if(PyBytes_Check(item)) {
+            strs[i] = PyBytes_AS_STRING(item);
+        } else {
+            strs[i] = PyUnicode_AsUTF8(item);
+        }
+        if(strs[i] == NULL) {
+            return -1;
+        }
+    }
+
+    return 0;
 }
 
 
@@ -100,6 +453,8 @@ static PyObject *conv_ht2opt(ht2_option_t *opts)
 	HT2_OPT_BUILD(py_opt, opts, startVerbose, "i");
 	HT2_OPT_BUILD(py_opt, opts, sanityCheck, "i");
 	HT2_OPT_BUILD(py_opt, opts, useHaplotype, "i");
+	HT2_OPT_BUILD(py_opt, opts, nthreads, "i");
+	HT2_OPT_BUILD(py_opt, opts, khits, "i");
 
 	return py_opt;
 }
@@ -110,7 +465,7 @@ static void update_ht2_options(ht2_option_t *ht2opt, PyObject *py_opt)
 	do {\
 		PyObject *p;\
 		if((p = PyDict_GetItemString((_pobj), #_name)) != NULL) { \
-			(_ht2opt)->_name = PyInt_AsLong(p); \
+			(_ht2opt)->_name = PyLong_AsLong(p); \
 			DEBUGLOG(#_name " %d\n", (ht2opt)->_name); \
 			if(PyErr_Occurred() != NULL) { \
 				DEBUGLOG("Error Occurred"); \
@@ -120,6 +475,7 @@ static void update_ht2_options(ht2_option_t *ht2opt, PyObject *py_opt)
 
 	HT2_OPT_UPDATE(py_opt, ht2opt, offRate);
 	HT2_OPT_UPDATE(py_opt, ht2opt, useMm);
+	HT2_OPT_UPDATE(py_opt, ht2opt, useShmem);
 	HT2_OPT_UPDATE(py_opt, ht2opt, mmSweep);
 	HT2_OPT_UPDATE(py_opt, ht2opt, noRefNames);
 	HT2_OPT_UPDATE(py_opt, ht2opt, noSplicedAlignment);
@@ -127,6 +483,8 @@ static void update_ht2_options(ht2_option_t *ht2opt, PyObject *py_opt)
 	HT2_OPT_UPDATE(py_opt, ht2opt, startVerbose);
 	HT2_OPT_UPDATE(py_opt, ht2opt, sanityCheck);
 	HT2_OPT_UPDATE(py_opt, ht2opt, useHaplotype);
+	HT2_OPT_UPDATE(py_opt, ht2opt, nthreads);
+	HT2_OPT_UPDATE(py_opt, ht2opt, khits);
 
 }
 
@@ -144,34 +502,58 @@ static PyObject *ht2py_get_options(PyObject *self, PyObject *args)
 	return pobj;
 }
 
+/*
+ * Load index 'name' with options from the dict 'popt' (defaults if NULL or None).
+ * Return NULL with an exception set on failure.
+ */
+static ht2_handle_t open_index(const char *name, PyObject *popt)
+{
+	ht2_handle_t handle;
+	ht2_option_t ht2opt;
+
+	ht2_init_options(&ht2opt);
+	if(popt != NULL && popt != Py_None) {
+		if(!PyDict_Check(popt)) {
+			PyErr_SetString(PyExc_TypeError, "options must be a dict from get_options()");
+			return NULL;
+		}
+		update_ht2_options(&ht2opt, popt);
+		if(PyErr_Occurred()) {
+			return NULL;
+		}
+	}
+
+	Py_BEGIN_ALLOW_THREADS
+	handle = ht2_init(name, &ht2opt);
+	Py_END_ALLOW_THREADS
+
+	DEBUGLOG("handle %p\n", handle);
+	if(handle == NULL) {
+		PyErr_Format(PyExc_IOError, "Can't load index %s", name);
+		return NULL;
+	}
+
+	return handle;
+}
+
 static PyObject *ht2py_init(PyObject *self, PyObject *args)
 {
 	ht2_handle_t handle;
 	PyObject *popt = NULL;
 	char *name = NULL;
 
-	if(!PyArg_ParseTuple(args, "sO", &name, &popt)) {
+	if(!PyArg_ParseTuple(args, "s|O", &name, &popt)) {
 		return NULL;
 	}
 
 	DEBUGLOG("name %s\n", name);
 	DEBUGLOG("popt %p\n", popt);
 
-	if(!PyDict_CheckExact(popt)) {
-		// TODO
-		// exception
-		DEBUGLOG("Invalid data type\n");
+	handle = open_index(name, popt);
+	if(handle == NULL) {
 		return NULL;
 	}
 
-	ht2_option_t ht2opt;
-	ht2_init_options(&ht2opt);
-	update_ht2_options(&ht2opt, popt);
-
-	handle = ht2_init(name, &ht2opt);
-
-	DEBUGLOG("handle %p\n", handle);
-
 	PyObject *cap = PyCapsule_New(handle, HT2_HANDLE_ID, NULL);
 
 	return cap;
@@ -190,6 +572,10 @@ static PyObject *ht2py_close(PyObject *self, PyObject *args)
 		return NULL;
 	}
 
+	if(PyObject_TypeCheck(cap, &ht2py_IndexType)) {
+		return ht2py_Index_close(cap, NULL);
+	}
+
 	handle = get_handle(cap);
 	if(handle == NULL) {
 		DEBUGLOG("Can't get handle\n");
@@ -239,6 +625,8 @@ static PyObject *ht2py_index_getrefnames(PyObject *self, PyObject *args)
 
     // Parse Args
     // ht2py.index_getrefnames(handle)
+    //
+    // Returns a sequence of names, decoded as they are used
     if(!PyArg_ParseTuple(args, "O", &cap)) {
 		DEBUGLOG("Can't parse args\n");
         return NULL;
@@ -254,17 +642,163 @@ static PyObject *ht2py_index_getrefnames(PyObject *self, PyObject *args)
     struct ht2_index_getrefnames_result *result = NULL;
     ht2_error_t ret = ht2_index_getrefnames(handle, &result);
 
-    PyObject *refnames = NULL;
-    
-    if(ret == HT2_OK) {
-        /* Build List of names */
-        refnames = conv_refnames_result(result);
-        free(result);
-    } else {
-        refnames = PyList_New(0);
+    if(ret != HT2_OK) {
+        result = NULL;
     }
 
-    return refnames;
+    return conv_refnames_result(result);
+}
+
+static PyObject *ht2py_index_getreflength(PyObject *self, PyObject *args)
+{
+    PyObject *cap;
+    uint32_t chr_id;
+
+    // ht2py.index_getreflength(handle, chr_id)
+
+    if(!PyArg_ParseTuple(args, "OI", &cap, &chr_id)) {
+		DEBUGLOG("Can't parse args\n");
+		return NULL;
+    }
+
+	ht2_handle_t handle = get_handle(cap);
+	if(handle == NULL) {
+		DEBUGLOG("Can't get handle\n");
+		return NULL;
+	}
+
+    return Py_BuildValue("K", (unsigned long long)ht2_index_getreflength(handle, chr_id));
+}
+
+static PyObject *ht2py_index_getsequence(PyObject *self, PyObject *args)
+{
+    PyObject *cap;
+    uint32_t chr_id;
+    unsigned long long start, len;
+
+    // Parse Args
+    // ht2py.index_getsequence(handle, chr_id, start, len)
+    //
+    // Returns a memoryview of one base per byte (0 - A, 1 - C, 2 - G, 3 - T, 4 - N)
+    if(!PyArg_ParseTuple(args, "OIKK", &cap, &chr_id, &start, &len)) {
+		DEBUGLOG("Can't parse args\n");
+        return NULL;
+    }
+
+    ht2_handle_t handle = get_handle(cap);
+    if(handle == NULL) {
+		DEBUGLOG("Can't get handle\n");
+        return NULL;
+    }
+
+    struct ht2_index_getsequence_result *result = NULL;
+    ht2_error_t ret;
+
+    HT2_BEGIN_CALL(cap)
+    ret = ht2_index_getsequence(handle, chr_id, start, len, &result);
+    HT2_END_CALL(cap)
+
+    if(ret != HT2_OK) {
+        PyErr_SetString(PyExc_ValueError, "invalid reference range");
+        return NULL;
+    }
+
+    return conv_result_buffer(result, result->bases, result->len, sizeof(uint8_t), "B");
+}
+
+static PyObject *ht2py_index_minlength(PyObject *self, PyObject *args)
+{
+    PyObject *cap;
+
+    // ht2py.index_minlength(handle)
+
+    if(!PyArg_ParseTuple(args, "O", &cap)) {
+		DEBUGLOG("Can't parse args\n");
+		return NULL;
+    }
+
+	ht2_handle_t handle = get_handle(cap);
+	if(handle == NULL) {
+		DEBUGLOG("Can't get handle\n");
+		return NULL;
+	}
+
+    return Py_BuildValue("I", ht2_index_minlength(handle));
+}
+
+static PyObject *ht2py_index_count(PyObject *self, PyObject *args)
+{
+    PyObject *cap;
+    char *seq = NULL;
+    uint64_t count = 0;
+    ht2_error_t ret;
+
+    // Parse Args
+    // ht2py.index_count(handle, 'sequence')
+    if(!PyArg_ParseTuple(args, "Os", &cap, &seq)) {
+		DEBUGLOG("Can't parse args\n");
+        return NULL;
+    }
+
+    ht2_handle_t handle = get_handle(cap);
+    if(handle == NULL) {
+		DEBUGLOG("Can't get handle\n");
+        return NULL;
+    }
+
+    HT2_BEGIN_CALL(cap)
+    ret = ht2_index_count(handle, seq, &count);
+    HT2_END_CALL(cap)
+
+    if(ret != HT2_OK) {
+        PyErr_SetString(PyExc_ValueError, "sequence is shorter than index_minlength()");
+        return NULL;
+    }
+
+    return Py_BuildValue("K", (unsigned long long)count);
+}
+
+static PyObject *ht2py_index_locate(PyObject *self, PyObject *args)
+{
+    PyObject *cap;
+    char *seq = NULL;
+    unsigned long long max_hits = 1000;
+    ht2_error_t ret;
+
+    // Parse Args
+    // ht2py.index_locate(handle, 'sequence', max_hits=1000)
+    //
+    // Returns (num_hits, positions). positions is a memoryview of
+    // (chr_id, direction, pos) records in struct format 'IiQ'
+    if(!PyArg_ParseTuple(args, "Os|K", &cap, &seq, &max_hits)) {
+		DEBUGLOG("Can't parse args\n");
+        return NULL;
+    }
+
+    ht2_handle_t handle = get_handle(cap);
+    if(handle == NULL) {
+		DEBUGLOG("Can't get handle\n");
+        return NULL;
+    }
+
+    struct ht2_index_locate_result *result = NULL;
+
+    HT2_BEGIN_CALL(cap)
+    ret = ht2_index_locate(handle, seq, max_hits, &result);
+    HT2_END_CALL(cap)
+
+    if(ret != HT2_OK) {
+        PyErr_SetString(PyExc_ValueError, "sequence is shorter than index_minlength()");
+        return NULL;
+    }
+
+    unsigned long long num_hits = result->num_hits;
+    PyObject *positions = conv_result_buffer(result, result->positions, result->count, sizeof(struct ht2_position), "IiQ");
+    if(positions == NULL) {
+        return NULL;
+    }
+
+    return Py_BuildValue("(K N)", num_hits, positions);
 }
 
 static PyObject *ht2py_repeat_expand(PyObject *self, PyObject *args)
@@ -276,6 +810,8 @@ static PyObject *ht2py_repeat_expand(PyObject *self, PyObject *args)
 
     // Parse Args
     // ht2py.repeat_expand(handle, 'repeat_name', repeat_pos, repeat_len)
+    //
+    // Returns a memoryview of (chr_id, direction, pos) records in struct format 'IiQ'
     if(!PyArg_ParseTuple(args, "OsLL", &cap, &name, &rpos, &rlen)) {
 		DEBUGLOG("Can't parse args\n");
         return NULL;
@@ -291,23 +827,412 @@ static PyObject *ht2py_repeat_expand(PyObject *self, PyObject *args)
 
 
     struct ht2_repeat_expand_result *result = NULL;
-    ht2_error_t ret = ht2_repeat_expand(handle, name, rpos, rlen, &result);
+    ht2_error_t ret;
 
-    PyObject *positions = NULL;
-    if(ret == HT2_OK) {
-        /* Build list of position */
-        positions = conv_repeat_expand_result(result);
-        free(result);
-    } else {
+    HT2_BEGIN_CALL(cap)
+    ret = ht2_repeat_expand(handle, name, rpos, rlen, &result);
+    HT2_END_CALL(cap)
+
+    if(ret != HT2_OK) {
 		DEBUGLOG("error %d, %s, %lu, %lu\n", ret,
 				name, rpos, rlen);
-        positions = PyList_New(0);
+        /* not a repeat, no positions */
+        return conv_result_buffer(NULL, NULL, 0, sizeof(struct ht2_position), HT2_POSITION_FORMAT);
+    }
+
+    return conv_repeat_expand_result(result);
+}
+
+static PyObject *ht2py_repeat_getid(PyObject *self, PyObject *args)
+{
+    PyObject *cap;
+    char *name = NULL;
+    uint32_t rep_id = 0;
+
+    // Parse Args
+    // ht2py.repeat_getid(handle, 'repeat_name')
+    if(!PyArg_ParseTuple(args, "Os", &cap, &name)) {
+		DEBUGLOG("Can't parse args\n");
+        return NULL;
+    }
+
+    ht2_handle_t handle = get_handle(cap);
+    if(handle == NULL) {
+		DEBUGLOG("Can't get handle\n");
+        return NULL;
+    }
+
+    if(ht2_repeat_getid(handle, name, &rep_id) != HT2_OK) {
+        PyErr_SetString(PyExc_KeyError, name);
+        return NULL;
+    }
+
+    return Py_BuildValue("I", rep_id);
+}
+
+static PyObject *ht2py_repeat_expand_many(PyObject *self, PyObject *args)
+{
+    PyObject *cap;
+    PyObject *py_ids, *py_pos, *py_len;
+    uint64_t *ids = NULL;
+    uint64_t *rpos = NULL;
+    uint64_t *rlen = NULL;
+    uint32_t *rep_ids = NULL;
+    Py_ssize_t count = 0;
+    Py_ssize_t i = 0;
+    PyObject *expanded = NULL;
+    struct ht2_repeat_expand_many_result *result = NULL;
+    ht2_error_t ret;
+
+    // Parse Args
+    // ht2py.repeat_expand_many(handle, repeat_ids, repeat_pos, repeat_len)
+    //
+    // Takes integer arrays and returns memoryviews
+    //   (offsets(uint64), chr_ids(uint32), directions(uint8), positions(uint64))
+    // positions of query i are at [offsets[i], offsets[i + 1])
+    if(!PyArg_ParseTuple(args, "OOOO", &cap, &py_ids, &py_pos, &py_len)) {
+		DEBUGLOG("Can't parse args\n");
+        return NULL;
+    }
+
+    ht2_handle_t handle = get_handle(cap);
+    if(handle == NULL) {
+		DEBUGLOG("Can't get handle\n");
+        return NULL;
+    }
+
+    count = conv_index_buffer(py_ids, &ids);
+    if(count < 0) {
+        goto out;
+    }
+    if(conv_index_buffer(py_pos, &rpos) != count || conv_index_buffer(py_len, &rlen) != count) {
+        if(!PyErr_Occurred()) {
+            PyErr_SetString(PyExc_ValueError, "arrays have different lengths");
+        }
+        goto out;
+    }
+
+    rep_ids = (uint32_t *)PyMem_Malloc(sizeof(uint32_t) * (count + 1));
+    if(rep_ids == NULL) {
+        PyErr_NoMemory();
+        goto out;
+    }
+    for(i = 0; i < count; i++) {
+        rep_ids[i] = (uint32_t)ids[i];
+    }
+
+    HT2_BEGIN_CALL(cap)
+    ret = ht2_repeat_expand_many(handle, count, rep_ids, rpos, rlen, &result);
+    HT2_END_CALL(cap)
+
+    if(ret == HT2_OK) {
+        expanded = conv_repeat_expand_many_result(result);
+    } else {
+		DEBUGLOG("error %d\n", ret);
+        PyErr_NoMemory();
+    }
+
+out:
+    PyMem_Free(ids);
+    PyMem_Free(rpos);
+    PyMem_Free(rlen);
+    PyMem_Free(rep_ids);
+
+    return expanded;
+}
+
+static PyObject *ht2py_align_batch(PyObject *self, PyObject *args)
+{
+    PyObject *cap;
+    PyObject *py_reads = NULL;
+    PyObject *py_quals = Py_None;
+    PyObject *reads = NULL;
+    PyObject *quals = NULL;
+    PyObject *alignments = NULL;
+    const char **seqs = NULL;
+    const char **qual_strs = NULL;
+    Py_ssize_t count = 0;
+    struct ht2_align_batch_result *result = NULL;
+    ht2_error_t ret;
+
+    // Parse Args
+    // ht2py.align_batch(handle, reads, quals=None)
+    //
+    // Returns memoryviews (alignments, cigar).
+    // alignments are (read_id, chr_id, pos, flag, mapq, xs, score, nm, nh,
+    // cigar_offset, cigar_count) records in struct format 'IIQHBciIIII'.
+    // The CIGAR of an alignment is cigar[cigar_offset:cigar_offset + cigar_count]
+    // in BAM encoding (length << 4 | op)
+    if(!PyArg_ParseTuple(args, "OO|O", &cap, &py_reads, &py_quals)) {
+		DEBUGLOG("Can't parse args\n");
+        return NULL;
+    }
+
+    ht2_handle_t handle = get_handle(cap);
+    if(handle == NULL) {
+		DEBUGLOG("Can't get handle\n");
+        return NULL;
+    }
+
+    // Tuples keep the strings alive and unchanged while the GIL is released
+    reads = PySequence_Tuple(py_reads);
+    if(reads == NULL) {
+        return NULL;
+    }
+    count = PyTuple_GET_SIZE(reads);
+
+    seqs = (const char **)PyMem_Malloc(sizeof(char *) * (count + 1));
+    if(seqs == NULL) {
+        PyErr_NoMemory();
+        goto out;
+    }
+
+    if(conv_string_list(reads, seqs, count) < 0) {
+        goto out;
+    }
+
+    if(py_quals != Py_None) {
+        quals = PySequence_Tuple(py_quals);
+        if(quals == NULL) {
+            goto out;
+        }
+        if(PyTuple_GET_SIZE(quals) != count) {
+            PyErr_SetString(PyExc_ValueError, "reads and quals have different lengths");
+            goto out;
+        }
+
+        qual_strs = (const char **)PyMem_Malloc(sizeof(char *) * (count + 1));
+        if(qual_strs == NULL) {
+            PyErr_NoMemory();
+            goto out;
+        }
+
+        if(conv_string_list(quals, qual_strs, count) < 0) {
+            goto out;
+        }
     }
 
-    return positions;
+    HT2_BEGIN_CALL(cap)
+    ret = ht2_align_batch(handle, count, seqs, qual_strs, &result);
+    HT2_END_CALL(cap)
+
+    if(ret == HT2_OK) {
+        alignments = conv_align_batch_result(result);
+    } else {
+		DEBUGLOG("error %d\n", ret);
+        PyErr_SetString(PyExc_ValueError, "Can't align reads");
+    }
+
+out:
+    PyMem_Free(seqs);
+    PyMem_Free(qual_strs);
+    Py_XDECREF(reads);
+    Py_XDECREF(quals);
+
+    return alignments;
 }
 
 
+/*
+ * ht2py.Index
+ */
+static int ht2py_Index_init(PyObject *self, PyObject *args, PyObject *kwds)
+{
+    ht2py_Index *index = (ht2py_Index *)self;
+    static char *kwlist[] = {"name", "options", NULL};
+    char *name = NULL;
+    PyObject *popt = NULL;
+
+    // ht2py.Index(name, options=None)
+    if(!PyArg_ParseTupleAndKeywords(args, kwds, "s|O", kwlist, &name, &popt)) {
+        return -1;
+    }
+
+    if(index->handle != NULL) {
+        PyErr_SetString(PyExc_RuntimeError, "index is already open");
+        return -1;
+    }
+
+    index->handle = open_index(name, popt);
+    if(index->handle == NULL) {
+        return -1;
+    }
+
+    return 0;
+}
+
+static PyObject *ht2py_Index_close(PyObject *self, PyObject *unused)
+{
+    ht2py_Index *index = (ht2py_Index *)self;
+
+    if(index->busy > 0) {
+        PyErr_SetString(PyExc_RuntimeError, "index is in use by another thread");
+        return NULL;
+    }
+
+    if(index->handle != NULL) {
+        ht2_close(index->handle);
+        index->handle = NULL;
+    }
+    Py_CLEAR(index->refnames);
+
+    Py_RETURN_NONE;
+}
+
+static void ht2py_Index_dealloc(PyObject *self)
+{
+    ht2py_Index *index = (ht2py_Index *)self;
+
+    if(index->handle != NULL) {
+        ht2_close(index->handle);
+    }
+    Py_XDECREF(index->refnames);
+    Py_TYPE(self)->tp_free(self);
+}
+
+static PyObject *ht2py_Index_enter(PyObject *self, PyObject *unused)
+{
+    if(get_handle(self) == NULL) {
+        return NULL;
+    }
+
+    Py_INCREF(self);
+    return self;
+}
+
+static PyObject *ht2py_Index_exit(PyObject *self, PyObject *args)
+{
+    PyObject *ret = ht2py_Index_close(self, NULL);
+    if(ret == NULL) {
+        return NULL;
+    }
+    Py_DECREF(ret);
+
+    Py_RETURN_FALSE;
+}
+
+static PyObject *ht2py_Index_get_refnames(PyObject *self, void *closure)
+{
+    ht2py_Index *index = (ht2py_Index *)self;
+    ht2_handle_t handle = get_handle(self);
+
+    if(handle == NULL) {
+        return NULL;
+    }
+
+    if(index->refnames == NULL) {
+        struct ht2_index_getrefnames_result *result = NULL;
+        if(ht2_index_getrefnames(handle, &result) != HT2_OK) {
+            result = NULL;
+        }
+        index->refnames = conv_refnames_result(result);
+        if(index->refnames == NULL) {
+            return NULL;
+        }
+    }
+
+    Py_INCREF(index->refnames);
+    return index->refnames;
+}
+
+static PyObject *ht2py_Index_get_minlength(PyObject *self, void *closure)
+{
+    ht2_handle_t handle = get_handle(self);
+
+    if(handle == NULL) {
+        return NULL;
+    }
+
+    return Py_BuildValue("I", ht2_index_minlength(handle));
+}
+
+static PyObject *ht2py_Index_get_closed(PyObject *self, void *closure)
+{
+    return PyBool_FromLong(((ht2py_Index *)self)->handle == NULL);
+}
+
+/*
+ * Call a module function with the index as its handle argument.
+ */
+static PyObject *index_call(PyObject *self, PyObject *args, PyCFunction func)
+{
+    PyObject *full_args = NULL;
+    PyObject *ret = NULL;
+    Py_ssize_t i = 0;
+    Py_ssize_t n = PyTuple_GET_SIZE(args);
+
+    full_args = PyTuple_New(n + 1);
+    if(full_args == NULL) {
+        return NULL;
+    }
+
+    Py_INCREF(self);
+    PyTuple_SET_ITEM(full_args, 0, self);
+    for(i = 0; i < n; i++) {
+        PyObject *item = PyTuple_GET_ITEM(args, i);
+        Py_INCREF(item);
+        PyTuple_SET_ITEM(full_args, i + 1, item);
+    }
+
+    ret = func(NULL, full_args);
+    Py_DECREF(full_args);
+
+    return ret;
+}
+
+#define HT2PY_INDEX_METHOD(_name, _func) \
+    static PyObject *ht2py_Index_##_name(PyObject *self, PyObject *args) \
+    { \
+        return index_call(self, args, (_func)); \
+    }
+
+HT2PY_INDEX_METHOD(reflength, ht2py_index_getreflength)
+HT2PY_INDEX_METHOD(sequence, ht2py_index_getsequence)
+HT2PY_INDEX_METHOD(count, ht2py_index_count)
+HT2PY_INDEX_METHOD(locate, ht2py_index_locate)
+HT2PY_INDEX_METHOD(repeat_getid, ht2py_repeat_getid)
+HT2PY_INDEX_METHOD(repeat_expand, ht2py_repeat_expand)
+HT2PY_INDEX_METHOD(repeat_expand_many, ht2py_repeat_expand_many)
+HT2PY_INDEX_METHOD(align, ht2py_align_batch)
+
+static PyMethodDef ht2py_Index_methods[] = {
+	{"close", ht2py_Index_close, METH_NOARGS, "Release the index"},
+	{"__enter__", ht2py_Index_enter, METH_NOARGS, NULL},
+	{"__exit__", ht2py_Index_exit, METH_VARARGS, NULL},
+
+	{"reflength", ht2py_Index_reflength, METH_VARARGS, "reflength(chr_id): see index_getreflength()"},
+	{"sequence", ht2py_Index_sequence, METH_VARARGS, "sequence(chr_id, start, len): see index_getsequence()"},
+	{"count", ht2py_Index_count, METH_VARARGS, "count(seq): see index_count()"},
+	{"locate", ht2py_Index_locate, METH_VARARGS, "locate(seq, max_hits=1000): see index_locate()"},
+	{"repeat_getid", ht2py_Index_repeat_getid, METH_VARARGS, "repeat_getid(name): see repeat_getid()"},
+	{"repeat_expand", ht2py_Index_repeat_expand, METH_VARARGS, "repeat_expand(name, pos, len): see repeat_expand()"},
+	{"repeat_expand_many", ht2py_Index_repeat_expand_many, METH_VARARGS, "repeat_expand_many(rep_ids, pos, len): see repeat_expand_many()"},
+	{"align", ht2py_Index_align, METH_VARARGS, "align(reads, quals=None): see align_batch()"},
+
+	{NULL, NULL, 0, NULL}
+};
+
+static PyGetSetDef ht2py_Index_getset[] = {
+	{"refnames", ht2py_Index_get_refnames, NULL, "Reference names, decoded as they are used", NULL},
+	{"minlength", ht2py_Index_get_minlength, NULL, "Shortest sequence count()/locate() accept", NULL},
+	{"closed", ht2py_Index_get_closed, NULL, "True after close()", NULL},
+
+	{NULL, NULL, NULL, NULL, NULL}
+};
+
+static PyTypeObject ht2py_IndexType = {
+    PyVarObject_HEAD_INIT(NULL, 0)
+    .tp_name = "ht2py.Index",
+    .tp_basicsize = sizeof(ht2py_Index),
+    .tp_dealloc = ht2py_Index_dealloc,
+    .tp_flags = Py_TPFLAGS_DEFAULT,
+    .tp_doc = "Index(name, options=None)\n\nHISAT2 index loaded by hisat2lib. Use as a context manager or call close().",
+    .tp_methods = ht2py_Index_methods,
+    .tp_getset = ht2py_Index_getset,
+    .tp_init = ht2py_Index_init,
+    .tp_new = PyType_GenericNew,
+};
+
 static PyMethodDef myMethods[] = {
 	/* Initialize APIs */
 	{"get_options", ht2py_get_options, METH_NOARGS, "Get default options"},
@@ -317,17 +1242,61 @@ static PyMethodDef myMethods[] = {
 	/* Index APIs */
 	{"index_getrefnamebyid", ht2py_index_getrefnamebyid, METH_VARARGS, "Get reference name"},
 	{"index_getrefnames", ht2py_index_getrefnames, METH_VARARGS, "Get all reference names"},
+	{"index_getreflength", ht2py_index_getreflength, METH_VARARGS, "Get reference length"},
+	{"index_getsequence", ht2py_index_getsequence, METH_VARARGS, "Get reference sequence"},
+	{"index_minlength", ht2py_index_minlength, METH_VARARGS, "Get the shortest sequence index_count/index_locate accept"},
+	{"index_count", ht2py_index_count, METH_VARARGS, "Count exact occurrences of a sequence"},
+	{"index_locate", ht2py_index_locate, METH_VARARGS, "Find exact occurrences of a sequence"},
 
 	/* Repeat APIs */
 	{"repeat_expand", ht2py_repeat_expand, METH_VARARGS, "Find reference positions"},
+	{"repeat_getid", ht2py_repeat_getid, METH_VARARGS, "Get repeat id"},
+	{"repeat_expand_many", ht2py_repeat_expand_many, METH_VARARGS, "Find reference positions of many repeat coordinates"},
+
+	/* Alignment APIs */
+	{"align_batch", ht2py_align_batch, METH_VARARGS, "Align a batch of reads"},
 
 	/* */
 	{NULL, NULL, 0, NULL}
 };
 
 
+static struct PyModuleDef ht2pyModule = {
+	PyModuleDef_HEAD_INIT,
+	"_ht2py",
+	"Python binding of hisat2lib",
+	-1,
+	myMethods
+};
+
 PyMODINIT_FUNC
-initht2py(void)
+PyInit__ht2py(void)
 {
-	(void)Py_InitModule("ht2py", myMethods);
+	PyObject *m;
+
+	if(PyType_Ready(&ht2py_ResultBufferType) < 0 ||
+	   PyType_Ready(&ht2py_RefNamesType) < 0 ||
+	   PyType_Ready(&ht2py_IndexType) < 0) {
+		return NULL;
+	}
+
+	m = PyModule_Create(&ht2pyModule);
+	if(m == NULL) {
+		return NULL;
+	}
+
+	Py_INCREF(&ht2py_IndexType);
+	if(PyModule_AddObject(m, "Index", (PyObject *)&ht2py_IndexType) < 0) {
+		Py_DECREF(&ht2py_IndexType);
+		Py_DECREF(m);
+		return NULL;
+	}
+
+	if(PyModule_AddStringConstant(m, "POSITION_FORMAT", HT2_POSITION_FORMAT) < 0 ||
+	   PyModule_AddStringConstant(m, "ALIGNMENT_FORMAT", HT2_ALIGNMENT_FORMAT) < 0) {
+		Py_DECREF(m);
+		return NULL;
+	}
+
+	return m;
 }
@@ -0,0 +1,34 @@
+#
+# Copyright 2018, Chanhee Park <parkchanhee@gmail.com> and Daehwan Kim <infphilo@gmail.com>
+#
+# This file is part of HISAT 2.
+#
+# HISAT 2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# HISAT 2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with HISAT 2.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Python binding of hisat2lib
+
+Load an index with ht2py.Index(name[, options]) and use it as a context
+manager, or call close() when done. The module functions take either an
+Index or the handle returned by init(). See ht2example.py.
+
+Results are memoryviews over the buffer hisat2lib returned, so they can be
+passed to struct.iter_unpack() or numpy.frombuffer() without copying.
+Position records use POSITION_FORMAT and alignment records ALIGNMENT_FORMAT,
+with their CIGAR operations in a separate array.
+
+Asynchronous versions of the query functions are in ht2py.aio.
+"""
+
+from ._ht2py import *
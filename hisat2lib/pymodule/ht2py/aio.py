@@ -0,0 +1,134 @@
+#
+# Copyright 2018, Chanhee Park <parkchanhee@gmail.com> and Daehwan Kim <infphilo@gmail.com>
+#
+# This file is part of HISAT 2.
+#
+# HISAT 2 is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# HISAT 2 is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with HISAT 2.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+asyncio interface to ht2py
+
+Queries run on a pool of worker threads. ht2py releases the GIL while
+hisat2lib works on a query, so the workers run in parallel against the
+one loaded index and the event loop keeps serving other requests.
+
+    import asyncio
+    import ht2py
+    import ht2py.aio
+
+    async def main(index):
+        positions, (alignments, cigar) = await asyncio.gather(
+            ht2py.aio.repeat_expand(index, 'rep100-300', 8308, 100),
+            ht2py.aio.align(index, reads))
+
+    ht2py.aio.init_pool(8)
+    with ht2py.Index(index_name) as index:
+        asyncio.run(main(index))
+
+Every function returns an asyncio future and must be called from a
+running event loop. Wait for all outstanding queries on an index
+before closing it; Index.close() refuses while a query is running.
+"""
+
+import asyncio
+import concurrent.futures
+import os
+import threading
+
+from . import _ht2py
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _default_workers():
+    return os.cpu_count() or 1
+
+
+def _new_executor(workers):
+    return concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix='ht2py')
+
+
+def init_pool(workers=None):
+    """
+    (Re)create the worker pool with 'workers' threads, os.cpu_count() by default.
+    Queries already submitted finish on the old pool.
+    """
+    global _executor
+
+    if workers is None:
+        workers = _default_workers()
+    if workers < 1:
+        raise ValueError('workers must be at least 1')
+
+    with _executor_lock:
+        old = _executor
+        _executor = _new_executor(workers)
+    if old is not None:
+        old.shutdown(wait=False)
+
+
+def shutdown_pool(wait=True):
+    """
+    Stop the worker pool. The next query starts a new one.
+    """
+    global _executor
+
+    with _executor_lock:
+        old = _executor
+        _executor = None
+    if old is not None:
+        old.shutdown(wait=wait)
+
+
+def _submit(func, *args):
+    global _executor
+
+    loop = asyncio.get_running_loop()
+    with _executor_lock:
+        if _executor is None:
+            _executor = _new_executor(_default_workers())
+        executor = _executor
+
+    return loop.run_in_executor(executor, func, *args)
+
+
+def repeat_expand(handle, repeat_name, repeat_pos, repeat_len):
+    """ ht2py.repeat_expand() """
+    return _submit(_ht2py.repeat_expand, handle, repeat_name, repeat_pos, repeat_len)
+
+
+def repeat_expand_many(handle, rep_ids, repeat_pos, repeat_len):
+    """ ht2py.repeat_expand_many() """
+    return _submit(_ht2py.repeat_expand_many, handle, rep_ids, repeat_pos, repeat_len)
+
+
+def align(handle, reads, quals=None):
+    """ ht2py.align_batch() """
+    return _submit(_ht2py.align_batch, handle, reads, quals)
+
+
+def index_getsequence(handle, chr_id, start, length):
+    """ ht2py.index_getsequence() """
+    return _submit(_ht2py.index_getsequence, handle, chr_id, start, length)
+
+
+def index_count(handle, seq):
+    """ ht2py.index_count() """
+    return _submit(_ht2py.index_count, handle, seq)
+
+
+def index_locate(handle, seq, max_hits=1000):
+    """ ht2py.index_locate() """
+    return _submit(_ht2py.index_locate, handle, seq, max_hits)
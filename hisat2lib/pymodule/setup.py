@@ -19,15 +19,98 @@
 # along with HISAT 2.  If not, see <http://www.gnu.org/licenses/>.
 
 
-from distutils.core import setup, Extension
+#
+# Builds ht2py against the hisat2lib sources in this tree:
+#
+#   pip install .
+#   python setup.py build_ext --inplace
+#
+
+import os
+import re
+
+from setuptools import setup, Extension
+from setuptools.command.build_ext import build_ext
+
+PYMODULE_DIR = os.path.dirname(os.path.abspath(__file__))
+HISAT2_DIR = os.path.normpath(os.path.join(PYMODULE_DIR, '..', '..'))
+
+
+def makefile_sources(name):
+    """
+    Return the files listed in variable 'name' of the HISAT2 Makefile,
+    so the module is built from the same sources as libhisat2lib.a
+    """
+    with open(os.path.join(HISAT2_DIR, 'Makefile')) as f:
+        makefile = f.read().replace('\\\n', ' ')
+
+    values = dict(re.findall(r'^([A-Za-z0-9_]+)\s*=(.*)$', makefile, re.M))
+
+    def expand(words):
+        files = []
+        for word in words.split():
+            ref = re.match(r'^\$\((\w+)\)(.*)$', word)
+            if ref is None:
+                files.append(word)
+            elif ref.group(2):
+                files.append(values[ref.group(1)].strip() + ref.group(2))
+            else:
+                files.extend(expand(values[ref.group(1)]))
+        return files
+
+    return [os.path.join(HISAT2_DIR, f) for f in expand(values[name])]
+
+
+def hisat2_version():
+    with open(os.path.join(HISAT2_DIR, 'VERSION')) as f:
+        return f.read().strip()
+
+
+# same flags as the .ht2lib-obj-release objects in the Makefile
+CXX_FLAGS = ['-std=c++11', '-O3', '-msse2', '-funroll-loops', '-fno-strict-aliasing']
+
+DEFINE_MACROS = [
+    ('BOWTIE2', None),
+    ('BOWTIE_MM', None),
+    ('BOWTIE_SHARED_MEM', None),
+    ('POPCNT_CAPABILITY', None),
+    ('NDEBUG', None),
+    ('_LARGEFILE_SOURCE', None),
+    ('_FILE_OFFSET_BITS', '64'),
+    ('_GNU_SOURCE', None),
+    ('HISAT2_VERSION', '"%s"' % hisat2_version()),
+#   ('DEBUG', '1'),
+]
+
+
+class BuildExt(build_ext):
+    """ Pass the C++ flags to the hisat2lib sources only """
+
+    def build_extensions(self):
+        compile_source = self.compiler._compile
+
+        def _compile(obj, src, ext, cc_args, extra_postargs, pp_opts):
+            if src.endswith('.cpp'):
+                extra_postargs = extra_postargs + CXX_FLAGS
+            compile_source(obj, src, ext, cc_args, extra_postargs, pp_opts)
+
+        self.compiler._compile = _compile
+        build_ext.build_extensions(self)
+
 
-module1 = Extension('ht2py',
-#                    define_macros = [('DEBUG', '1')],
-                    include_dirs=['../'],
-                    libraries=['stdc++'],
-                    extra_objects = ['../../libhisat2lib.a'],
-                    sources = ['ht2module.c'])
+module1 = Extension('ht2py._ht2py',
+                    include_dirs = [HISAT2_DIR,
+                                    os.path.join(HISAT2_DIR, 'third_party'),
+                                    os.path.join(HISAT2_DIR, 'hisat2lib')],
+                    define_macros = DEFINE_MACROS,
+                    libraries = ['stdc++', 'pthread', 'z'],
+                    sources = [os.path.join(PYMODULE_DIR, 'ht2module.c')] + makefile_sources('HT2LIB_SRCS'))
 
 setup(name = 'ht2py',
-        version = '1.0',
+        version = hisat2_version(),
+        description = 'Python binding of hisat2lib',
+        packages = ['ht2py'],
+        package_dir = {'ht2py': os.path.join(PYMODULE_DIR, 'ht2py')},
+        python_requires = '>=3.7',
+        cmdclass = {'build_ext': BuildExt},
         ext_modules = [module1])
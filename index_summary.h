@@ -0,0 +1,131 @@
+/*
+ * Copyright 2015, Daehwan Kim <infphilo@gmail.com>
+ *
+ * This file is part of HISAT 2.
+ *
+ * HISAT 2 is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * HISAT 2 is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with HISAT 2.  If not, see <http://www.gnu.org/licenses/>.
+ */
+
+#ifndef INDEX_SUMMARY_H_
+#define INDEX_SUMMARY_H_
+
+#include <iostream>
+#include <string>
+#include "ds.h"
+#include "gfm.h"
+#include "alt.h"
+
+using namespace std;
+
+/**
+ * What "hisat2-inspect -s" reports about an index: its version and
+ * flags, SA sample rate, ftab width, reference names and lengths, and
+ * the number of SNPs, splice sites and exons.  hisat2-inspect prints
+ * it, and hisat2-build stores it in the index metadata sidecar.
+ */
+template <typename index_t>
+struct IndexSummary {
+	int            major;
+	int            minor;
+	string         extra_version;
+	int32_t        flags;
+	bool           entireReverse;
+	int32_t        offRate;
+	int32_t        ftabChars;
+	EList<string>  refnames;
+	EList<index_t> reflens;
+	index_t        numSnps;
+	index_t        numSpliceSites;
+	index_t        numExons;
+
+	/**
+	 * Read the summary of the index with basename 'fname'.
+	 */
+	void read(const string& fname, bool verbose) {
+		flags = GFM<index_t>::readVersionFlags(fname, major, minor, extra_version);
+		entireReverse = false;
+		ALTDB<index_t> altdb;
+		GFM<index_t> gfm(
+		                 fname,
+		                 &altdb,
+		                 NULL,
+		                 NULL,
+		                 -1,                   // don't require entire reverse
+		                 true,                 // index is for the forward direction
+		                 -1,                   // offrate (-1 = index default)
+		                 0,                    // offrate-plus (0 = index default)
+		                 false,                // use memory-mapped IO
+		                 false,                // use shared memory
+		                 false,                // sweep memory-mapped memory
+		                 true,                 // load names?
+		                 false,                // load SA sample?
+		                 false,                // load ftab?
+		                 false,                // load rstarts?
+		                 true,                 // load splice sites?
+		                 verbose,              // be talkative?
+		                 verbose,              // be talkative at startup?
+		                 false,                // pass up memory exceptions?
+		                 false,                // sanity check?
+		                 false);               // use haplotypes?
+		refnames.clear();
+		readEbwtRefnames<index_t>(fname, refnames);
+		offRate = gfm.gh().offRate();
+		ftabChars = gfm.gh().ftabChars();
+		assert_eq(gfm.nPat(), refnames.size());
+		reflens.clear();
+		for(size_t i = 0; i < refnames.size(); i++) {
+			reflens.push_back(gfm.plen()[i]);
+		}
+		numSnps = numSpliceSites = numExons = 0;
+		const EList<ALT<index_t> >& alts = altdb.alts();
+		for(size_t i = 0; i < alts.size(); i++) {
+			const ALT<index_t>& alt = alts[i];
+			if(alt.snp()) {
+				numSnps++;
+			} else if(alt.splicesite()) {
+				if(alt.left < alt.right) {
+					numSpliceSites++;
+				}
+			} else if(alt.exon()) {
+				numExons++;
+			}
+		}
+	}
+
+	/**
+	 * Print the summary as "hisat2-inspect -s" does.
+	 */
+	void print(ostream& fout) const {
+		fout << "Index version" << "\t2." << major << '.' << minor;
+		if(extra_version != "") {
+			fout << "-" << extra_version;
+		}
+		fout << endl;
+		fout << "Flags" << '\t' << (-flags) << endl;
+		fout << "2.0-compatible" << '\t' << (entireReverse ? "1" : "0") << endl;
+		fout << "SA-Sample" << "\t1 in " << (1 << offRate) << endl;
+		fout << "FTab-Chars" << '\t' << ftabChars << endl;
+		for(size_t i = 0; i < refnames.size(); i++) {
+			fout << "Sequence-" << (i+1)
+			     << '\t' << refnames[i].c_str()
+			     << '\t' << reflens[i]
+			     << endl;
+		}
+		fout << "Num. SNPs: " << numSnps << endl;
+		fout << "Num. Splice Sites: " << numSpliceSites << endl;
+		fout << "Num. Exons: " << numExons << endl;
+	}
+};
+
+#endif /* INDEX_SUMMARY_H_ */
@@ -958,6 +958,13 @@ void RFM<index_t>::readIntoMemory(
                                   bool startVerbose)
 {
     bool switchEndian; // dummy; caller doesn't care
+	// Local indexes are too many to get a shared-memory segment each, so
+	// they are memory-mapped instead when the index lives in shared memory
+#ifdef BOWTIE_MM
+	const bool localMm = this->_useMm || this->useShmem_;
+#else
+	const bool localMm = false;
+#endif
 #ifdef BOWTIE_MM
 	char *mmFile[] = { NULL, NULL };
 #endif
@@ -985,7 +992,7 @@ void RFM<index_t>::readIntoMemory(
 		}
 		
 #ifdef BOWTIE_MM
-		if(this->_useMm /*&& !justHeader*/) {
+		if(localMm /*&& !justHeader*/) {
 			const char *names[] = {_in1Str.c_str(), _in2Str.c_str()};
             int fds[] = { fileno(_in1), fileno(_in2) };
 			for(int i = 0; i < (loadSASamp ? 2 : 1); i++) {
@@ -1023,11 +1030,11 @@ void RFM<index_t>::readIntoMemory(
 #endif
 	}
 #ifdef BOWTIE_MM
-	else if(this->_useMm && !justHeader) {
+	else if(localMm && !justHeader) {
 		mmFile[0] = mmFile1_;
 		mmFile[1] = mmFile2_;
 	}
-	if(this->_useMm && !justHeader) {
+	if(localMm && !justHeader) {
 		assert(mmFile[0] == mmFile1_);
 		assert(mmFile[1] == mmFile2_);
 	}
@@ -1105,8 +1112,8 @@ void RFM<index_t>::readIntoMemory(
                                                             this->fw_,
                                                             -1, // overrideOffRate
                                                             -1, // offRatePlus
-                                                            this->_useMm,
-                                                            this->useShmem_,
+                                                            localMm,
+                                                            false, // local indexes never use shared memory
                                                             mmSweep,
                                                             loadNames,
                                                             loadSASamp,
@@ -1,14 +1,20 @@
 #!/usr/bin/python
-import sys, subprocess
+import sys, os, subprocess
 import re
 from argparse import ArgumentParser, FileType
 from collections import defaultdict, Counter
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), ".."))
+import hisat2_genome
+
 flag_include_N = True
 
 """
 """
 def read_genome(genome_file):
+    if flag_include_N:
+        return hisat2_genome.read_genome(genome_file)
+
     chr_dic = {}
     chr_name, sequence = "", ""
     for line in genome_file: